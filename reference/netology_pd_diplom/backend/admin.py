@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
 from backend.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
-    Contact, ConfirmEmailToken
+    Contact, ConfirmEmailToken, CatalogOffer, CatalogChange
 from django.shortcuts import render, redirect
 
 from backend.models import TaskStatus, Shop
@@ -89,6 +89,32 @@ class ProductParameterAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(CatalogOffer)
+class CatalogOfferAdmin(admin.ModelAdmin):
+    list_display = ('product_info', 'product_name', 'model', 'shop', 'price', 'quantity')
+    list_filter = ('shop', 'category')
+
+    def has_add_permission(self, request):
+        # Витрина поддерживается автоматически
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(CatalogChange)
+class CatalogChangeAdmin(admin.ModelAdmin):
+    list_display = ('id', 'product_info_id', 'deleted', 'dt')
+    list_filter = ('deleted',)
+
+    def has_add_permission(self, request):
+        # Журнал пишется автоматически
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     pass
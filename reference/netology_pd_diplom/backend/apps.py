@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db import connection
 
 
 class BackendConfig(AppConfig):
@@ -9,3 +10,12 @@ class BackendConfig(AppConfig):
         """
         импортируем сигналы
         """
+        from backend import signals  # noqa: F401
+
+        # Оператор %> для поиска по каталогу регистрируем один раз, модули
+        # django.contrib.postgres импортируем только на PostgreSQL
+        if connection.vendor == 'postgresql':
+            from django.contrib.postgres.lookups import TrigramWordSimilar
+            from django.db.models import CharField
+
+            CharField.register_lookup(TrigramWordSimilar)
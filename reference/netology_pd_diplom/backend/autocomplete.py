@@ -0,0 +1,169 @@
+"""
+Индекс автодополнения по названиям товаров и моделям.
+
+Индекс - отсортированный массив терминов в одном файле. Файл читается
+через mmap, поэтому страницы индекса разделяются всеми процессами
+воркеров и не копируются в память каждого из них. Поиск - двоичный
+поиск начала префикса и просмотр подряд идущих терминов.
+
+Терминами служат нормализованный текст и все его окончания, начинающиеся
+с границы слова, поэтому "iph" находит "Смартфон Apple iPhone".
+Вес подсказки - популярность продукта (сколько штук заказано) плюс один.
+
+Формат файла:
+    заголовок: MAGIC, число записей (uint32)
+    таблица смещений записей от начала данных (uint32 на запись)
+    записи: вес (uint32), id продукта (uint32), длина термина (uint16),
+            длина текста (uint16), термин, текст подсказки (UTF-8)
+"""
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+
+from django.conf import settings
+from django.db.models import Sum
+
+from backend.models import CatalogOffer, OrderItem
+
+MAGIC = b'ACIDX001'
+HEADER = struct.Struct('<8sI')
+OFFSET = struct.Struct('<I')
+RECORD = struct.Struct('<IIHH')
+
+
+def normalize(text):
+    """
+    Нормализация текста для поиска: нижний регистр, ё -> е, одиночные пробелы.
+    """
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+
+def _terms(text):
+    words = normalize(text).split()
+    return [' '.join(words[start:]) for start in range(len(words))]
+
+
+def _product_popularity():
+    rows = OrderItem.objects.exclude(order__state='basket').values_list('product_info__product_id').annotate(
+        ordered=Sum('quantity'))
+    return dict(rows)
+
+
+def build_autocomplete_index(path=None):
+    """
+    Строит индекс по витрине каталога и атомарно заменяет файл индекса.
+    """
+    path = path or settings.AUTOCOMPLETE_INDEX_PATH
+    popularity = _product_popularity()
+
+    # (термин, текст) -> (вес, id продукта)
+    entries = {}
+    rows = CatalogOffer.objects.values_list('product_id', 'product_name', 'model').distinct().order_by()
+    for product_id, product_name, model in rows.iterator():
+        weight = popularity.get(product_id, 0) + 1
+        for text in (product_name, model):
+            for term in _terms(text):
+                key = (term.encode(), text)
+                if weight > entries.get(key, (0, 0))[0]:
+                    entries[key] = (weight, product_id)
+
+    records = []
+    for (term, text), (weight, product_id) in sorted(entries.items()):
+        text = text.encode()
+        records.append(RECORD.pack(weight, product_id, len(term), len(text)) + term + text)
+
+    offsets, position = [], 0
+    for record in records:
+        offsets.append(OFFSET.pack(position))
+        position += len(record)
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+        file.write(HEADER.pack(MAGIC, len(records)))
+        file.write(b''.join(offsets))
+        file.write(b''.join(records))
+    os.replace(file.name, path)
+    return len(records)
+
+
+class AutocompleteIndex:
+    """
+    Индекс автодополнения, открытый только для чтения через mmap.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f'Неверный формат индекса автодополнения: {path}')
+        self._data_start = HEADER.size + OFFSET.size * self._count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        # Термин записи - для двоичного поиска через bisect
+        offset = self._offset(index)
+        term_length = RECORD.unpack_from(self._mmap, offset)[2]
+        return self._mmap[offset + RECORD.size:offset + RECORD.size + term_length]
+
+    def _offset(self, index):
+        return self._data_start + OFFSET.unpack_from(self._mmap, HEADER.size + OFFSET.size * index)[0]
+
+    def _record(self, index):
+        offset = self._offset(index)
+        weight, product_id, term_length, text_length = RECORD.unpack_from(self._mmap, offset)
+        offset += RECORD.size
+        term = self._mmap[offset:offset + term_length]
+        text = self._mmap[offset + term_length:offset + term_length + text_length].decode()
+        return term, weight, product_id, text
+
+    def search(self, prefix, limit):
+        """
+        Подсказки для префикса, самые популярные первыми.
+        Просматривается не больше AUTOCOMPLETE_SCAN_LIMIT терминов, чтобы время ответа было ограничено.
+        """
+        prefix = normalize(prefix).encode()
+        if not prefix:
+            return []
+
+        best = {}
+        index = bisect.bisect_left(self, prefix)
+        end = min(self._count, index + settings.AUTOCOMPLETE_SCAN_LIMIT)
+        while index < end:
+            term, weight, product_id, text = self._record(index)
+            if not term.startswith(prefix):
+                break
+            if weight > best.get(text, (0, 0))[0]:
+                best[text] = (weight, product_id)
+            index += 1
+
+        top = heapq.nsmallest(limit, best.items(), key=lambda item: (-item[1][0], item[0]))
+        return [{'text': text, 'product_id': product_id} for text, (weight, product_id) in top]
+
+
+_index = None
+_index_key = None
+
+
+def get_autocomplete_index():
+    """
+    Открытый индекс текущего процесса. Переоткрывается, когда файл заменён новой сборкой.
+    Если индекса ещё нет, возвращает None: сборка идёт в Celery, а не в запросе.
+    """
+    global _index, _index_key
+    path = settings.AUTOCOMPLETE_INDEX_PATH
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if _index is None or _index_key != key:
+        _index, _index_key = AutocompleteIndex(path), key
+    return _index
@@ -0,0 +1,194 @@
+"""
+Кэш каталога.
+
+Все закэшированные выборки каталога привязаны к версии каталога, которая
+увеличивается при импорте и любых изменениях товаров/магазинов.
+Пересчёт выполняет только один запрос (single-flight), остальные ждут
+или получают устаревшее значение. Значения обновляются досрочно
+с вероятностью, растущей к концу срока жизни (XFetch), чтобы пересчёт
+не приходился на всех разом в момент истечения.
+
+Для клиентов, принимающих сжатие, в кэше хранится уже отрендеренное
+и сжатое тело ответа, поэтому горячий путь не сериализует и не сжимает.
+
+ETag закэшированного ответа строится по версии, для которой посчитано
+отданное значение, а не по текущей: устаревшее значение, отданное
+во время пересчёта, не получит ETag новой версии и не будет потом
+подтверждаться ответом 304.
+"""
+import hashlib
+import math
+import random
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+
+from backend.compression import compress, negotiate_encoding
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def get_catalog_version():
+    """
+    Текущая версия каталога.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Стартуем с метки времени, чтобы после вытеснения ключа
+        # версия не совпала ни с одной из ранее выданных
+        cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Увеличиваем версию каталога, делая все закэшированные выборки устаревшими.
+    """
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        get_catalog_version()
+        return cache.incr(CATALOG_VERSION_KEY)
+
+
+def catalog_cache_key(name, request, names=None):
+    """
+    Ключ кэша для выборки каталога с учётом параметров запроса.
+    names - учитывать только эти параметры, по умолчанию все.
+    """
+    params = urlencode(sorted((name, values) for name, values in request.query_params.lists()
+                              if names is None or name in names), doseq=True)
+    return f'catalog:{name}:{hashlib.md5(params.encode()).hexdigest()}'
+
+
+def _etag(request, version):
+    params = urlencode(sorted(request.query_params.lists()), doseq=True)
+    media_type = getattr(request, 'accepted_media_type', '')
+    source = f'{version}|{request.path}|{params}|{media_type}|{negotiate_encoding(request)}'
+    return hashlib.md5(source.encode()).hexdigest()
+
+
+def catalog_etag(request, *args, **kwargs):
+    """
+    Сильный ETag выборки каталога: версия каталога, путь, параметры запроса,
+    согласованные формат ответа и кодировка сжатия.
+    Вычисляется без формирования тела ответа.
+    """
+    return _etag(request, get_catalog_version())
+
+
+def _is_expired(expires_at, delta):
+    """
+    Проверка срока жизни с вероятностным досрочным обновлением (XFetch).
+    delta - время последнего пересчёта, чем он дольше, тем раньше начинаем обновлять.
+    """
+    jitter = -delta * settings.CATALOG_CACHE_BETA * math.log(1.0 - random.random())
+    return time.time() + jitter >= expires_at
+
+
+def _recompute(key, compute, version, versioned):
+    started = time.monotonic()
+    value = compute()
+    if versioned:
+        value, version = value
+    delta = time.monotonic() - started
+    expires_at = time.time() + settings.CATALOG_CACHE_TIMEOUT
+    # Физически храним дольше логического срока, чтобы было что отдать во время пересчёта
+    cache.set(key, (value, version, expires_at, delta), settings.CATALOG_CACHE_STALE_TIMEOUT)
+    return value, version
+
+
+def get_catalog_entry(key, compute, versioned=False):
+    """
+    Возвращает закэшированное значение выборки каталога или пересчитывает его
+    вместе с версией каталога, для которой оно посчитано.
+
+    Пересчитывает только запрос, захвативший блокировку. Остальные получают
+    устаревшее значение, а если его нет - ждут, пока пересчёт завершится.
+
+    versioned - compute возвращает пару (значение, версия), например когда
+    строит значение из другой выборки, которая сама может оказаться устаревшей.
+    """
+    version = get_catalog_version()
+    entry = cache.get(key)
+    if entry is not None:
+        value, entry_version, expires_at, delta = entry
+        if entry_version >= version and not _is_expired(expires_at, delta):
+            return value, entry_version
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, settings.CATALOG_CACHE_LOCK_TIMEOUT):
+        try:
+            return _recompute(key, compute, version, versioned)
+        finally:
+            cache.delete(lock_key)
+
+    if entry is not None:
+        return entry[0], entry[1]
+
+    deadline = time.monotonic() + settings.CATALOG_CACHE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None and entry[1] >= version:
+            return entry[0], entry[1]
+        if cache.get(lock_key) is None:
+            break
+
+    # Не дождались пересчёта - считаем сами, но не блокируем остальных
+    return _recompute(key, compute, version, versioned)
+
+
+def get_catalog_cached(key, compute):
+    """
+    Возвращает закэшированное значение выборки каталога или пересчитывает его.
+    """
+    return get_catalog_entry(key, compute)[0]
+
+
+def catalog_response(request, name, compute):
+    """
+    Ответ с выборкой каталога.
+
+    Если клиент принимает сжатие, тело рендерится и сжимается один раз
+    и хранится в кэше отдельно для каждого формата и кодировки.
+    Browsable API и клиенты без сжатия получают обычный Response из кэша данных.
+    ETag ответа соответствует версии отданного значения.
+    """
+    data_key = catalog_cache_key(name, request)
+    renderer = request.accepted_renderer
+    encoding = negotiate_encoding(request)
+    if encoding is None or renderer.format == 'api':
+        data, version = get_catalog_entry(data_key, compute)
+        response = Response(data)
+        response['ETag'] = quote_etag(_etag(request, version))
+        return response
+
+    media_type = hashlib.md5(request.accepted_media_type.encode()).hexdigest()
+    body_key = f'{data_key}:{media_type}:{encoding}'
+
+    def render():
+        # Тело из устаревших данных хранится с их версией и будет пересчитано
+        data, data_version = get_catalog_entry(data_key, compute)
+        body = renderer.render(data, request.accepted_media_type, {})
+        if len(body) < settings.COMPRESSION_MIN_SIZE:
+            return (body, None), data_version
+        return (compress(body, encoding), encoding), data_version
+
+    (body, content_encoding), version = get_catalog_entry(body_key, render, versioned=True)
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type = f'{content_type}; charset={renderer.charset}'
+    response = HttpResponse(body, content_type=content_type)
+    if content_encoding:
+        response['Content-Encoding'] = content_encoding
+    response['ETag'] = quote_etag(_etag(request, version))
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
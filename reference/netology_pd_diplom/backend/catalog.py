@@ -0,0 +1,420 @@
+"""
+Денормализованная витрина каталога (CatalogOffer).
+
+Витрина хранит по одной строке на предложение активного магазина вместе
+с готовым списком параметров, поэтому список товаров читается одним
+запросом без соединений и prefetch. Строки поддерживаются сигналами при
+изменении каталога и пересобираются целиком по магазину после импорта.
+
+Каждое реальное изменение строки витрины записывается в журнал
+CatalogChange, по которому клиенты получают изменения после своего токена,
+и сбрасывает кэш этого предложения для выборки по id. Токен - id записи
+журнала, поэтому записи должны становиться видимыми в порядке id: SQLite
+выполняет пишущие транзакции по очереди, в PostgreSQL запись журнала
+упорядочивается advisory-блокировкой до конца транзакции.
+Вместе с витриной пересчитывается BestOffer - самое дешёвое предложение
+в наличии по каждому затронутому продукту, сводки CategoryStats по
+затронутым категориям и индексы поиска.
+
+Сортировки списка товаров опираются на составные индексы витрины и
+листаются курсором по последней строке страницы (keyset), поэтому
+глубина страницы не влияет на время запроса.
+"""
+import base64
+import json
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+
+from backend.cache import bump_catalog_version
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, CatalogOffer, \
+    CatalogChange, BestOffer, CategoryStats, OrderItem
+from backend.search import update_search_index
+from backend.serializers import PRODUCT_INFO_VALUES, group_product_parameters, product_info_data
+
+# Сколько предложений пересобираем за один запрос
+CHUNK_SIZE = 500
+
+# Ключ advisory-блокировки журнала изменений в PostgreSQL
+CATALOG_CHANGES_LOCK_ID = 7_301_035
+
+# Поля ответа (как у ProductInfoSerializer) и столбцы витрины, из которых они строятся
+CATALOG_OFFER_COLUMNS = {
+    'id': ('product_info_id',),
+    'name': ('product_name',),
+    'model': ('model',),
+    'product': ('product_name', 'category_name'),
+    'shop': ('shop_id',),
+    'quantity': ('quantity',),
+    'price': ('price',),
+    'price_rrc': ('price_rrc',),
+    'product_parameters': ('parameters',),
+}
+
+# Полный набор полей предложения
+CATALOG_OFFER_FIELDS = ('id', 'model', 'product', 'shop', 'quantity', 'price', 'price_rrc', 'product_parameters')
+
+# Компактный набор для сеток каталога и истории заказов
+CATALOG_OFFER_COMPACT_FIELDS = ('id', 'name', 'model', 'shop', 'price')
+
+_FIELD_GETTERS = {
+    'id': lambda row: row['product_info_id'],
+    'name': lambda row: row['product_name'],
+    'model': lambda row: row['model'],
+    'product': lambda row: {'name': row['product_name'], 'category': row['category_name']},
+    'shop': lambda row: row['shop_id'],
+    'quantity': lambda row: row['quantity'],
+    'price': lambda row: row['price'],
+    'price_rrc': lambda row: row['price_rrc'],
+    'product_parameters': lambda row: row['parameters'],
+}
+
+# Столбцы строки витрины, изменение которых попадает в журнал
+CATALOG_OFFER_STATE = ('product_info_id', 'shop_id', 'product_id', 'category_id', 'model', 'product_name',
+                       'category_name', 'quantity', 'price', 'price_rrc', 'parameters')
+
+# Сортировки списка товаров: порядок столбцов витрины, последний столбец - уникальный.
+# relevance упорядочивается по оценке BM25 в памяти
+CATALOG_SORTS = {
+    'price_asc': ('price', 'product_info_id'),
+    'price_desc': ('-price', '-product_info_id'),
+    'newest': ('-product_info_id',),
+    'popularity': ('-popularity', '-product_info_id'),
+    'relevance': None,
+}
+
+# Параметры запроса, от которых зависит порядок по релевантности (курсор и поля ответа - нет)
+RELEVANCE_PARAMS = ('q', 'shop_id', 'category_id', 'mode')
+
+_state = threading.local()
+
+
+@contextmanager
+def catalog_sync_paused():
+    """
+    Отключает поддержку витрины сигналами, например на время импорта.
+    После выхода витрину магазина нужно пересобрать.
+    """
+    previous = catalog_sync_is_paused()
+    _state.paused = True
+    try:
+        yield
+    finally:
+        _state.paused = previous
+
+
+def catalog_sync_is_paused():
+    return getattr(_state, 'paused', False)
+
+
+def catalog_offer_columns(fields=CATALOG_OFFER_FIELDS):
+    """
+    Столбцы витрины, которые нужно прочитать для указанных полей.
+    """
+    columns = []
+    for field in fields:
+        columns.extend(column for column in CATALOG_OFFER_COLUMNS[field] if column not in columns)
+    return columns
+
+
+def catalog_offer_data(row, fields=CATALOG_OFFER_FIELDS):
+    """
+    Данные предложения витрины в формате ProductInfoSerializer.
+    row - словарь .values(*catalog_offer_columns(fields)).
+    """
+    return {field: _FIELD_GETTERS[field](row) for field in fields}
+
+
+def encode_cursor(values):
+    """
+    Непрозрачный курсор страницы из значений сортировки последней строки.
+    """
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, size):
+    """
+    Значения сортировки из курсора. ValueError, если курсор повреждён.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, UnicodeError, json.JSONDecodeError, base64.binascii.Error) as error:
+        raise ValueError('Неверный курсор') from error
+    if not isinstance(values, list) or len(values) != size or \
+            not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        raise ValueError('Неверный курсор')
+    return values
+
+
+def keyset_filter(ordering, values):
+    """
+    Условие "строго после строки со значениями values" для порядка ordering.
+    """
+    condition, equal = Q(), Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def _build_offers(product_info_ids):
+    """
+    Строки витрины для предложений активных магазинов из списка.
+    """
+    rows = list(ProductInfo.objects.filter(id__in=product_info_ids, shop__state=True).values(
+        *PRODUCT_INFO_VALUES, 'product_id', 'product__category_id'))
+    parameters = group_product_parameters(row['id'] for row in rows)
+    popularity = dict(OrderItem.objects.filter(product_info_id__in=[row['id'] for row in rows]).exclude(
+        order__state='basket').values_list('product_info_id').annotate(ordered=Sum('quantity')).order_by())
+    offers = []
+    for row in rows:
+        data = product_info_data(row, parameters.get(row['id'], []))
+        offers.append(CatalogOffer(
+            product_info_id=data['id'],
+            shop_id=data['shop'],
+            product_id=row['product_id'],
+            category_id=row['product__category_id'],
+            model=data['model'],
+            product_name=data['product']['name'],
+            category_name=data['product']['category'],
+            quantity=data['quantity'],
+            price=data['price'],
+            price_rrc=data['price_rrc'],
+            parameters=data['product_parameters'],
+            popularity=popularity.get(data['id'], 0),
+        ))
+    return offers
+
+
+def _offer_state(offer):
+    return tuple(getattr(offer, field) for field in CATALOG_OFFER_STATE)
+
+
+def _offer_cache_key(product_info_id):
+    return f'catalog:offer:{product_info_id}'
+
+
+def get_catalog_offer_rows(product_info_ids):
+    """
+    Строки витрины со всеми столбцами полей для указанных предложений: id -> строка.
+    Строки берутся из кэша одним get_many, промахи читаются одним запросом и кэшируются.
+    """
+    keys = {_offer_cache_key(product_info_id): product_info_id for product_info_id in product_info_ids}
+    cached = cache.get_many(keys)
+    rows = {keys[key]: row for key, row in cached.items()}
+
+    missing = [product_info_id for key, product_info_id in keys.items() if key not in cached]
+    if missing:
+        loaded = {row['product_info_id']: row for row in CatalogOffer.objects.filter(
+            product_info_id__in=missing).values(*catalog_offer_columns(tuple(CATALOG_OFFER_COLUMNS)))}
+        cache.set_many({_offer_cache_key(product_info_id): row for product_info_id, row in loaded.items()},
+                       settings.CATALOG_OFFER_CACHE_TIMEOUT)
+        rows.update(loaded)
+    return rows
+
+
+def invalidate_offer_cache(product_info_ids):
+    """
+    Сбрасывает кэш предложений сразу и ещё раз после фиксации транзакции,
+    чтобы чтение до фиксации не оставило в кэше старую строку.
+    """
+    keys = [_offer_cache_key(product_info_id) for product_info_id in product_info_ids]
+    if keys:
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _lock_catalog_changes():
+    """
+    Не даёт другим транзакциям писать в журнал изменений до конца текущей.
+
+    В PostgreSQL id выделяются последовательностью сразу, а видны в порядке фиксации:
+    без блокировки долгая пересборка могла бы зафиксировать id N, когда клиент уже
+    получил N+k, и изменение было бы потеряно. SQLite и так пишет по очереди.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [CATALOG_CHANGES_LOCK_ID])
+
+
+def record_catalog_changes(product_info_ids, deleted=False):
+    """
+    Записывает изменения предложений в журнал и сбрасывает их кэш.
+    """
+    product_info_ids = list(product_info_ids)
+    if product_info_ids:
+        with transaction.atomic():
+            _lock_catalog_changes()
+            CatalogChange.objects.bulk_create(
+                [CatalogChange(product_info_id=product_info_id, deleted=deleted)
+                 for product_info_id in product_info_ids], batch_size=CHUNK_SIZE)
+    invalidate_offer_cache(product_info_ids)
+
+
+def refresh_best_offers(product_ids):
+    """
+    Пересчитывает лучшие предложения для указанных продуктов.
+    """
+    for chunk in _chunks(set(product_ids)):
+        best = {}
+        rows = CatalogOffer.objects.filter(product_id__in=chunk, quantity__gt=0).order_by(
+            'product_id', 'price', 'product_info_id').values_list('product_id', 'product_info_id')
+        for product_id, product_info_id in rows:
+            best.setdefault(product_id, product_info_id)
+        BestOffer.objects.filter(product_id__in=chunk).delete()
+        BestOffer.objects.bulk_create(
+            [BestOffer(product_id=product_id, offer_id=product_info_id) for product_id, product_info_id in best.items()])
+
+
+def refresh_category_stats(category_ids):
+    """
+    Пересчитывает сводки указанных категорий. Категории без предложений сводки не имеют.
+    """
+    category_ids = {category_id for category_id in category_ids if category_id is not None}
+    for chunk in _chunks(category_ids):
+        rows = CatalogOffer.objects.filter(category_id__in=chunk).values('category_id').annotate(
+            offers_count=Count('product_info_id'), in_stock_count=Count('product_info_id', filter=Q(quantity__gt=0)),
+            min_price=Min('price'), max_price=Max('price')).order_by()
+        CategoryStats.objects.filter(category_id__in=chunk).delete()
+        CategoryStats.objects.bulk_create([CategoryStats(**row) for row in rows])
+
+
+def _replace_offers(old_offers, offers):
+    """
+    Заменяет строки витрины old_offers на offers.
+    В журнал попадают только новые, изменившиеся и исчезнувшие предложения.
+    """
+    old_state = {row[0]: row for row in old_offers.values_list(*CATALOG_OFFER_STATE)}
+    old_offers.delete()
+    CatalogOffer.objects.bulk_create(offers, batch_size=CHUNK_SIZE)
+    # Удаление строк каскадом удалило и их лучшие предложения, пересчитываем по всем затронутым продуктам
+    product_id_index = CATALOG_OFFER_STATE.index('product_id')
+    refresh_best_offers({row[product_id_index] for row in old_state.values()} |
+                        {offer.product_id for offer in offers})
+    category_id_index = CATALOG_OFFER_STATE.index('category_id')
+    refresh_category_stats({row[category_id_index] for row in old_state.values()} |
+                           {offer.category_id for offer in offers})
+
+    changed = [offer.product_info_id for offer in offers
+               if old_state.get(offer.product_info_id) != _offer_state(offer)]
+    removed = old_state.keys() - {offer.product_info_id for offer in offers}
+    record_catalog_changes(changed)
+    record_catalog_changes(sorted(removed), deleted=True)
+
+    # Триграммы поиска пересчитываем только для предложений с изменившимся текстом
+    name_index, model_index = CATALOG_OFFER_STATE.index('product_name'), CATALOG_OFFER_STATE.index('model')
+    retexted = []
+    for offer in offers:
+        old = old_state.get(offer.product_info_id)
+        if old is None or (old[name_index], old[model_index]) != (offer.product_name, offer.model):
+            retexted.append(offer)
+    update_search_index(retexted, removed)
+
+
+def refresh_catalog_offers(product_info_ids):
+    """
+    Пересобирает строки витрины для указанных предложений.
+    """
+    with transaction.atomic():
+        for chunk in _chunks(product_info_ids):
+            _replace_offers(CatalogOffer.objects.filter(product_info_id__in=chunk), _build_offers(chunk))
+
+
+def reserve_catalog_offers(quantities):
+    """
+    Списывает проданное при оформлении заказа в строках витрины: остаток и популярность
+    меняются UPDATE с F(), строки не пересобираются.
+    Журнал изменений и кэш предложений, а для закончившихся предложений ещё и лучшие
+    предложения и сводки категорий обновляются после фиксации транзакции. Тогда же
+    увеличивается версия каталога, чтобы ETag выборок сменился вместе с остатками.
+    quantities - пары (id предложения, количество).
+    """
+    product_info_ids = []
+    for product_info_id, quantity in quantities:
+        CatalogOffer.objects.filter(product_info_id=product_info_id).update(
+            quantity=F('quantity') - quantity, popularity=F('popularity') + quantity)
+        product_info_ids.append(product_info_id)
+    if product_info_ids:
+        transaction.on_commit(lambda: _catalog_offers_reserved(product_info_ids))
+
+
+def _catalog_offers_reserved(product_info_ids):
+    # Наличие влияет на лучшие предложения и сводки, только когда остаток закончился
+    sold_out = list(CatalogOffer.objects.filter(product_info_id__in=product_info_ids, quantity=0).values_list(
+        'product_id', 'category_id'))
+    with transaction.atomic():
+        if sold_out:
+            refresh_best_offers({product_id for product_id, _ in sold_out})
+            refresh_category_stats({category_id for _, category_id in sold_out})
+        record_catalog_changes(product_info_ids)
+    # Выборки пересчитывает один запрос под блокировкой, остальные получают прежнее значение
+    bump_catalog_version()
+
+
+def refresh_catalog_parameters(product_info_ids):
+    """
+    Обновляет только параметры уже существующих строк витрины.
+    Не добавляет строк, поэтому безопасно при каскадном удалении предложений.
+    """
+    product_info_ids = set(product_info_ids)
+    parameters = group_product_parameters(product_info_ids)
+    current = CatalogOffer.objects.filter(product_info_id__in=product_info_ids).values_list(
+        'product_info_id', 'parameters')
+    changed = [product_info_id for product_info_id, value in current
+               if value != parameters.get(product_info_id, [])]
+    for product_info_id in changed:
+        CatalogOffer.objects.filter(product_info_id=product_info_id).update(
+            parameters=parameters.get(product_info_id, []))
+    record_catalog_changes(changed)
+
+
+def rebuild_catalog_for_shop(shop_id):
+    """
+    Полностью пересобирает витрину магазина, например после импорта или смены статуса.
+    """
+    with transaction.atomic():
+        offers = []
+        for chunk in _chunks(ProductInfo.objects.filter(shop_id=shop_id, shop__state=True).values_list(
+                'id', flat=True)):
+            offers.extend(_build_offers(chunk))
+        _replace_offers(CatalogOffer.objects.filter(shop_id=shop_id), offers)
+
+
+def sync_catalog_offers(instance, deleted=False):
+    """
+    Обновляет строки витрины, затронутые изменением объекта каталога.
+    Удаления предложений, продуктов, категорий и магазинов витрина получает каскадом.
+    """
+    if isinstance(instance, ProductParameter):
+        refresh_catalog_parameters([instance.product_info_id])
+    elif deleted:
+        # Строка витрины удалена каскадом, остаётся отметить удаление в журнале
+        if isinstance(instance, ProductInfo):
+            record_catalog_changes([instance.id], deleted=True)
+            refresh_best_offers([instance.product_id])
+            refresh_category_stats(Product.objects.filter(id=instance.product_id).values_list(
+                'category_id', flat=True))
+    elif isinstance(instance, ProductInfo):
+        refresh_catalog_offers([instance.id])
+    elif isinstance(instance, Shop):
+        rebuild_catalog_for_shop(instance.id)
+    elif isinstance(instance, Parameter):
+        refresh_catalog_parameters(
+            ProductParameter.objects.filter(parameter=instance).values_list('product_info_id', flat=True))
+    elif isinstance(instance, Product):
+        refresh_catalog_offers(instance.product_infos.values_list('id', flat=True))
+    elif isinstance(instance, Category):
+        refresh_catalog_offers(
+            ProductInfo.objects.filter(product__category=instance).values_list('id', flat=True))
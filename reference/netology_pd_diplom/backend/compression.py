@@ -0,0 +1,94 @@
+"""
+Сжатие ответов gzip и zstd.
+
+Кодировка выбирается по заголовку Accept-Encoding с учётом q-значений,
+при равном весе предпочитаем zstd. zstd доступен, только если установлен
+пакет zstandard. Ответы меньше COMPRESSION_MIN_SIZE не сжимаются.
+"""
+import gzip
+
+from django.conf import settings
+from django.utils.text import compress_sequence, compress_string
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен, без него остаётся gzip
+    zstandard = None
+
+
+def available_encodings():
+    """
+    Поддерживаемые кодировки в порядке предпочтения.
+    """
+    if zstandard is not None:
+        return ('zstd', 'gzip')
+    return ('gzip',)
+
+
+def parse_quality_header(header):
+    """
+    Разбор заголовков вида Accept / Accept-Encoding: значение -> q.
+    """
+    accepted = {}
+    for part in header.split(','):
+        value, *params = part.split(';')
+        value = value.strip().lower()
+        if not value:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, param_value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(param_value)
+                except ValueError:
+                    quality = 0.0
+        accepted[value] = quality
+    return accepted
+
+
+def negotiate_encoding(request):
+    """
+    Кодировка сжатия для запроса или None, если клиент не принимает ни одной из поддерживаемых.
+    """
+    accepted = parse_quality_header(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    best, best_quality = None, 0.0
+    for encoding in available_encodings():
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding):
+    """
+    Детерминированное сжатие тела ответа, подходит для хранения в кэше.
+    """
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=settings.COMPRESSION_ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def compress_response_body(body, encoding):
+    """
+    Сжатие тела динамического ответа. Для gzip добавляем случайное
+    дополнение, как GZipMiddleware, чтобы затруднить атаки вида BREACH.
+    """
+    if encoding == 'zstd':
+        return compress(body, encoding)
+    return compress_string(body, max_random_bytes=100)
+
+
+def compress_stream(chunks, encoding):
+    """
+    Сжатие потокового ответа, каждая порция отдаётся сразу после сжатия.
+    """
+    if encoding != 'zstd':
+        yield from compress_sequence(chunks, max_random_bytes=100)
+        return
+    compressor = zstandard.ZstdCompressor(level=settings.COMPRESSION_ZSTD_LEVEL).compressobj()
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        if data:
+            yield data
+    yield compressor.flush()
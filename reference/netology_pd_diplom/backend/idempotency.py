@@ -0,0 +1,93 @@
+"""
+Ключи идемпотентности (заголовок Idempotency-Key).
+
+Клиент, повторяющий запрос после обрыва связи, передаёт тот же ключ.
+Первый ответ JsonResponse сохраняется в кэше на IDEMPOTENCY_TTL секунд:
+статус и данные, и повтор получает его без повторного выполнения
+представления и без обращений к базе. Повтор собирается заново как
+JsonResponse, поэтому формат ответа (JSON или MessagePack) согласуется
+по Accept повтора. Ключи действуют в пределах пользователя и адреса.
+
+Пока первый запрос выполняется, повтор получает 409. Метка выполнения живёт
+IDEMPOTENCY_LOCK_TIMEOUT секунд, поэтому ключ запроса, оборванного без
+очистки (падение процесса), освобождается через минуту, а не через сутки.
+Тот же ключ с другим
+телом запроса отклоняется с 422. Слишком большое тело (413) отклоняется
+до разбора. Ответы с ошибкой сервера (5xx) не сохраняются, такой запрос
+можно повторить с тем же ключом.
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+
+from backend.parsers import bulk_payload_error
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IN_PROGRESS = 'in-progress'
+
+
+def _cache_key(request, key):
+    source = f'{request.user.id}|{request.method}|{request.path}|{key}'
+    return f'idempotency:{hashlib.sha256(source.encode()).hexdigest()}'
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.md5(body.encode()).hexdigest()
+
+
+def idempotent(method):
+    """
+    Декоратор метода APIView, сохраняющий ответ под ключом из заголовка Idempotency-Key.
+    Запросы без ключа и анонимные запросы выполняются как обычно.
+    """
+
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or not request.user.is_authenticated:
+            return method(self, request, *args, **kwargs)
+        if len(key) > settings.IDEMPOTENCY_KEY_MAX_LENGTH:
+            return JsonResponse({'Status': False, 'Errors': 'Слишком длинный Idempotency-Key'}, status=400)
+
+        # Размер проверяем по заголовку до того, как отпечаток разберёт тело
+        too_large = bulk_payload_error(request)
+        if too_large:
+            return too_large
+
+        cache_key = _cache_key(request, key)
+        fingerprint = _fingerprint(request)
+        if not cache.add(cache_key, (IN_PROGRESS, fingerprint), settings.IDEMPOTENCY_LOCK_TIMEOUT):
+            stored = cache.get(cache_key)
+            if stored is not None:
+                if stored[1] != fingerprint:
+                    return JsonResponse({'Status': False, 'Errors': 'Idempotency-Key уже использован '
+                                                                    'с другим запросом'}, status=422)
+                if stored[0] == IN_PROGRESS:
+                    return JsonResponse({'Status': False, 'Errors': 'Запрос с этим Idempotency-Key '
+                                                                    'ещё выполняется'}, status=409)
+                _, _, status, data = stored
+                response = JsonResponse(data, status=status, safe=False)
+                response['Idempotent-Replayed'] = 'true'
+                return response
+            # Запись вытеснена между add и get, выполняем запрос под ключом заново
+            cache.set(cache_key, (IN_PROGRESS, fingerprint), settings.IDEMPOTENCY_LOCK_TIMEOUT)
+
+        try:
+            response = method(self, request, *args, **kwargs)
+        except BaseException:
+            cache.delete(cache_key)
+            raise
+        # Сохраняем данные JsonResponse до MessagePackMiddleware, а не байты согласованного формата
+        if response.status_code >= 500 or not isinstance(response, JsonResponse):
+            cache.delete(cache_key)
+            return response
+        cache.set(cache_key, ('done', fingerprint, response.status_code, json.loads(response.content)),
+                  settings.IDEMPOTENCY_TTL)
+        return response
+
+    return wrapper
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from backend.models import ProductInfo
+from backend.serializers import ProductInfoSerializer, serialize_product_infos
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает время сериализации предложений: ProductInfoSerializer и serialize_product_infos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=200, help='Сколько предложений сериализовать')
+        parser.add_argument('--repeat', type=int, default=5, help='Сколько раз повторить замер, берётся лучший')
+
+    def handle(self, *args, **options):
+        product_info_ids = list(ProductInfo.objects.order_by('id').values_list('id', flat=True)[:options['limit']])
+
+        def queryset():
+            return ProductInfo.objects.filter(id__in=product_info_ids).select_related(
+                'product__category').prefetch_related('product_parameters__parameter').order_by('id')
+
+        def measure(func):
+            best = float('inf')
+            for _ in range(max(options['repeat'], 1)):
+                started = time.perf_counter()
+                func()
+                best = min(best, time.perf_counter() - started)
+            return best
+
+        slow = measure(lambda: ProductInfoSerializer(queryset(), many=True).data)
+        fast = measure(lambda: serialize_product_infos(queryset()))
+        self.stdout.write(f'Предложений: {len(product_info_ids)}')
+        self.stdout.write(f'ProductInfoSerializer: {slow * 1000:.1f} ms')
+        self.stdout.write(f'serialize_product_infos: {fast * 1000:.1f} ms')
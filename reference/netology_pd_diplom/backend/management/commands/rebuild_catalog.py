@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from backend.autocomplete import build_autocomplete_index
+from backend.cache import bump_catalog_version
+from backend.catalog import rebuild_catalog_for_shop
+from backend.models import Shop
+from backend.search import rebuild_search_index
+from backend.similar import build_similarity_indexes
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает витрину каталога для всех магазинов и поисковые индексы'
+
+    def handle(self, *args, **options):
+        for shop_id in Shop.objects.values_list('id', flat=True):
+            rebuild_catalog_for_shop(shop_id)
+        bump_catalog_version()
+        build_autocomplete_index()
+        rebuild_search_index()
+        build_similarity_indexes()
+        self.stdout.write(self.style.SUCCESS('Витрина каталога пересобрана'))
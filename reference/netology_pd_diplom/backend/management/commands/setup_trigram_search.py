@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from backend.models import CatalogOffer
+from backend.search import rebuild_search_index, uses_pg_trgm
+
+
+class Command(BaseCommand):
+    help = 'Готовит триграммный поиск: pg_trgm и GIN-индексы на PostgreSQL, таблицу триграмм на остальных базах'
+
+    def handle(self, *args, **options):
+        if not uses_pg_trgm():
+            rebuild_search_index()
+            self.stdout.write(self.style.SUCCESS('Таблица триграмм пересобрана'))
+            return
+
+        table = CatalogOffer._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for column in ('product_name', 'model'):
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS catalog_offer_{column}_trgm_idx '
+                               f'ON {table} USING gin ({column} gin_trgm_ops)')
+        self.stdout.write(self.style.SUCCESS('Расширение pg_trgm и триграммные индексы созданы'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backend.models import Order
+from backend.orders import refresh_order_totals, snapshot_order_items
+
+
+class Command(BaseCommand):
+    help = 'Заполняет снимок предложений в позициях оформленных заказов, созданных до его появления'
+
+    def handle(self, *args, **options):
+        order_ids = list(Order.objects.exclude(state='basket').filter(ordered_items__price__isnull=True).values_list(
+            'id', flat=True).distinct())
+        with transaction.atomic():
+            snapshot_order_items(order_ids)
+            refresh_order_totals(order_ids)
+        self.stdout.write(self.style.SUCCESS(f'Снимок заполнен для заказов: {len(order_ids)}'))
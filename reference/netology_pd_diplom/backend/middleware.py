@@ -0,0 +1,83 @@
+import json
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from backend.compression import compress_response_body, compress_stream, negotiate_encoding, parse_quality_header
+from backend.renderers import MessagePackRenderer, msgpack_dumps
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Сжимает ответы gzip или zstd в зависимости от Accept-Encoding.
+
+    Ответы, уже имеющие Content-Encoding (например, заранее сжатые
+    ответы каталога из кэша), отдаются как есть.
+    """
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        if response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = negotiate_encoding(request)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                return response
+            response.streaming_content = compress_stream(response.streaming_content, encoding)
+            # Размер сжатого потока заранее неизвестен
+            del response.headers['Content-Length']
+        else:
+            compressed_content = compress_response_body(response.content, encoding)
+            if len(compressed_content) >= len(response.content):
+                return response
+            response.content = compressed_content
+            response.headers['Content-Length'] = str(len(response.content))
+
+        # Сильный ETag становится слабым: тело изменилось, но условные запросы продолжают работать
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+
+        return response
+
+
+def prefers_msgpack(request):
+    """
+    Клиент предпочитает MessagePack: он указан в Accept с весом не меньше, чем у JSON.
+    """
+    accepted = parse_quality_header(request.META.get('HTTP_ACCEPT', ''))
+    quality = accepted.get(MessagePackRenderer.media_type, 0.0)
+    return quality > 0 and quality >= accepted.get('application/json', 0.0)
+
+
+class MessagePackMiddleware(MiddlewareMixin):
+    """
+    Отдаёт ответы JsonResponse в MessagePack, если клиент предпочитает этот формат.
+
+    Ответы DRF согласуют формат сами через MessagePackRenderer,
+    а представления, возвращающие JsonResponse напрямую, получают его здесь.
+    """
+
+    def process_response(self, request, response):
+        if not isinstance(response, JsonResponse):
+            return response
+
+        patch_vary_headers(response, ('Accept',))
+        if not prefers_msgpack(request):
+            return response
+
+        response.content = msgpack_dumps(json.loads(response.content))
+        response.headers['Content-Type'] = MessagePackRenderer.media_type
+        response.headers['Content-Length'] = str(len(response.content))
+        return response
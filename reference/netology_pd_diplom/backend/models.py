@@ -201,6 +201,152 @@ class ProductParameter(models.Model):
         ]
 
 
+class CatalogOffer(models.Model):
+    """
+    Денормализованная витрина каталога: одна строка на предложение активного магазина
+    """
+    objects = models.manager.Manager()
+    product_info = models.OneToOneField(ProductInfo, verbose_name='Информация о продукте', primary_key=True,
+                                        related_name='catalog_offer', on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='catalog_offers',
+                             on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, verbose_name='Продукт', related_name='catalog_offers',
+                                on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, verbose_name='Категория', related_name='catalog_offers',
+                                 on_delete=models.CASCADE)
+    model = models.CharField(max_length=80, verbose_name='Модель', blank=True)
+    product_name = models.CharField(max_length=80, verbose_name='Название продукта')
+    category_name = models.CharField(max_length=40, verbose_name='Название категории')
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    price = models.PositiveIntegerField(verbose_name='Цена')
+    price_rrc = models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')
+    parameters = models.JSONField(verbose_name='Параметры', default=list)
+    popularity = models.PositiveIntegerField(verbose_name='Популярность (заказано штук)', default=0)
+
+    class Meta:
+        verbose_name = 'Предложение витрины каталога'
+        verbose_name_plural = "Витрина каталога"
+        ordering = ('product_info',)
+        indexes = [
+            models.Index(fields=['category', 'product_info'], name='catalog_offer_category_idx'),
+            models.Index(fields=['shop', 'product_info'], name='catalog_offer_shop_idx'),
+            # Индексы режимов сортировки списка товаров (sort=)
+            models.Index(fields=['price', 'product_info'], name='catalog_offer_price_idx'),
+            models.Index(fields=['category', 'price', 'product_info'], name='catalog_offer_cat_price_idx'),
+            models.Index(fields=['popularity', 'product_info'], name='catalog_offer_popularity_idx'),
+            models.Index(fields=['category', 'popularity', 'product_info'], name='catalog_offer_cat_pop_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_name} ({self.model})'
+
+
+class BestOffer(models.Model):
+    """
+    Лучшее предложение по продукту: самое дешёвое в наличии среди активных магазинов
+    """
+    objects = models.manager.Manager()
+    product = models.OneToOneField(Product, verbose_name='Продукт', primary_key=True, related_name='best_offer',
+                                   on_delete=models.CASCADE)
+    offer = models.OneToOneField(CatalogOffer, verbose_name='Предложение', related_name='best_offer',
+                                 on_delete=models.CASCADE)
+
+    class Meta:
+        verbose_name = 'Лучшее предложение'
+        verbose_name_plural = "Лучшие предложения"
+        ordering = ('product',)
+
+    def __str__(self):
+        return f'{self.product_id}: {self.offer_id}'
+
+
+class CategoryStats(models.Model):
+    """
+    Сводка по предложениям категории в витрине
+    """
+    objects = models.manager.Manager()
+    category = models.OneToOneField(Category, verbose_name='Категория', primary_key=True, related_name='stats',
+                                    on_delete=models.CASCADE)
+    offers_count = models.PositiveIntegerField(verbose_name='Предложений', default=0)
+    in_stock_count = models.PositiveIntegerField(verbose_name='Предложений в наличии', default=0)
+    min_price = models.PositiveIntegerField(verbose_name='Минимальная цена', null=True, blank=True)
+    max_price = models.PositiveIntegerField(verbose_name='Максимальная цена', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Сводка по категории'
+        verbose_name_plural = "Сводки по категориям"
+        ordering = ('category',)
+
+    def __str__(self):
+        return f'{self.category_id}: {self.offers_count}'
+
+
+class ProductTrigram(models.Model):
+    """
+    Триграммы названия и модели предложения витрины для нечёткого поиска (кроме PostgreSQL, там pg_trgm)
+    """
+    objects = models.manager.Manager()
+    product_info = models.ForeignKey(ProductInfo, verbose_name='Информация о продукте', related_name='trigrams',
+                                     on_delete=models.CASCADE, db_index=False)
+    trigram = models.CharField(max_length=3, verbose_name='Триграмма')
+
+    class Meta:
+        verbose_name = 'Триграмма'
+        verbose_name_plural = "Триграммы поиска"
+        indexes = [
+            models.Index(fields=['trigram', 'product_info'], name='product_trigram_idx'),
+            models.Index(fields=['product_info'], name='product_trigram_offer_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_info_id}: {self.trigram}'
+
+
+class ProductToken(models.Model):
+    """
+    Слова названия и модели предложения витрины для ранжирования BM25
+    """
+    objects = models.manager.Manager()
+    product_info = models.ForeignKey(ProductInfo, verbose_name='Информация о продукте', related_name='tokens',
+                                     on_delete=models.CASCADE, db_index=False)
+    token = models.CharField(max_length=80, verbose_name='Слово')
+    tf = models.PositiveSmallIntegerField(verbose_name='Число вхождений')
+    length = models.PositiveSmallIntegerField(verbose_name='Число слов в тексте предложения')
+
+    class Meta:
+        verbose_name = 'Слово поиска'
+        verbose_name_plural = "Слова поиска"
+        indexes = [
+            models.Index(fields=['token', 'product_info'], name='product_token_idx'),
+            models.Index(fields=['product_info'], name='product_token_offer_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_info_id}: {self.token}'
+
+
+class CatalogChange(models.Model):
+    """
+    Журнал изменений витрины каталога для синхронизации клиентов.
+    Возрастающий id служит токеном версии: клиент запрашивает изменения после него.
+    Пишется только через backend.catalog.record_catalog_changes, которая гарантирует
+    появление записей в порядке id.
+    """
+    objects = models.manager.Manager()
+    # id предложения - BigAutoField (DEFAULT_AUTO_FIELD), столбец должен вмещать те же значения
+    product_info_id = models.PositiveBigIntegerField(verbose_name='ID предложения')
+    deleted = models.BooleanField(verbose_name='Удалено', default=False)
+    dt = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Изменение каталога'
+        verbose_name_plural = "Журнал изменений каталога"
+        ordering = ('id',)
+
+    def __str__(self):
+        return f'{self.id}: {self.product_info_id}{" (удалено)" if self.deleted else ""}'
+
+
 class Contact(models.Model):
     objects = models.manager.Manager()
     user = models.ForeignKey(User, verbose_name='Пользователь',
@@ -233,11 +379,19 @@ class Order(models.Model):
     contact = models.ForeignKey(Contact, verbose_name='Контакт',
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
+    # Итоги по позициям, поддерживаются backend.orders
+    total_sum = models.PositiveIntegerField(verbose_name='Сумма заказа', default=0)
+    items_count = models.PositiveIntegerField(verbose_name='Число позиций', default=0)
+    # Растёт при каждом изменении корзины, для оптимистичной блокировки
+    version = models.PositiveIntegerField(verbose_name='Версия', default=0)
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = "Список заказ"
         ordering = ('-dt',)
+        indexes = [
+            models.Index(fields=['user', 'state', '-dt'], name='order_user_state_dt_idx'),
+        ]
 
     def __str__(self):
         return str(self.dt)
@@ -252,16 +406,26 @@ class OrderItem(models.Model):
     order = models.ForeignKey(Order, verbose_name='Заказ', related_name='ordered_items', blank=True,
                               on_delete=models.CASCADE)
 
+    # Оформленные позиции переживают удаление предложения: история читает снимок ниже.
+    # Без предложения может остаться только позиция со снимком, позиции корзин удаляются (см. signals)
     product_info = models.ForeignKey(ProductInfo, verbose_name='Информация о продукте', related_name='ordered_items',
-                                     blank=True,
-                                     on_delete=models.CASCADE)
+                                     blank=True, null=True,
+                                     on_delete=models.SET_NULL)
     quantity = models.PositiveIntegerField(verbose_name='Количество')
+    # Снимок предложения на момент оформления заказа, история заказов читает только его
+    price = models.PositiveIntegerField(verbose_name='Цена', null=True, blank=True)
+    product_name = models.CharField(max_length=80, verbose_name='Название продукта', blank=True)
+    model = models.CharField(max_length=80, verbose_name='Модель', blank=True)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='+', blank=True, null=True,
+                             on_delete=models.SET_NULL)
 
     class Meta:
         verbose_name = 'Заказанная позиция'
         verbose_name_plural = "Список заказанных позиций"
         constraints = [
             models.UniqueConstraint(fields=['order_id', 'product_info'], name='unique_order_item'),
+            models.CheckConstraint(check=models.Q(product_info__isnull=False) | models.Q(price__isnull=False),
+                                   name='order_item_offer_or_snapshot'),
         ]
 
 
@@ -0,0 +1,160 @@
+"""
+Итоги заказов.
+
+Сумма заказа (total_sum) и число позиций (items_count) хранятся в Order,
+поэтому списки заказов и корзины читаются без соединений с позициями
+и предложениями. Итоги пересчитываются одним UPDATE при каждом изменении
+позиций: сигналами для отдельных позиций и явно после массовых операций,
+которые сигналов не вызывают. При смене цены предложения пересчитываются
+только корзины, итоги размещённых заказов остаются прежними.
+
+При оформлении заказа в позиции копируются цена, название, модель
+и магазин предложения. История заказов и их суммы берутся из этого
+снимка и не зависят от последующих изменений каталога.
+
+Там же под позиции списываются остатки предложений. Списание делается
+условными UPDATE (quantity >= n) в порядке id предложений, поэтому
+одновременные оформления не уводят остаток в минус и не блокируют
+друг друга взаимно. При нехватке хотя бы по одной позиции оформление
+откатывается целиком.
+
+Изменения корзины увеличивают её версию (Order.version) условным UPDATE.
+Клиент может передать версию, которую видел, тогда при расхождении
+изменение отклоняется (BasketConflict) вместо того, чтобы молча
+перезаписать правки с другого устройства.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from backend.models import Order, OrderItem, ProductInfo
+
+_state = threading.local()
+
+
+class StockShortage(Exception):
+    """
+    Остатков не хватает для позиций заказа.
+    shortages - список словарей product_info, requested, available.
+    """
+
+    def __init__(self, shortages):
+        super().__init__(shortages)
+        self.shortages = shortages
+
+
+class BasketConflict(Exception):
+    """
+    Корзина изменилась после того, как клиент получил её версию.
+    version - текущая версия или None, если корзины нет.
+    """
+
+    def __init__(self, version):
+        super().__init__(version)
+        self.version = version
+
+
+def refresh_order_totals(order_ids):
+    """
+    Пересчитывает итоги указанных заказов по их позициям.
+    """
+    order_ids = set(order_ids)
+    if not order_ids:
+        return
+    items = OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+    # Цена из снимка, если он уже сделан, иначе текущая
+    price = Coalesce('price', 'product_info__price')
+    Order.objects.filter(id__in=order_ids).update(
+        total_sum=Coalesce(Subquery(items.annotate(total=Sum(F('quantity') * price)).values('total')), 0),
+        items_count=Coalesce(Subquery(items.annotate(count=Count('id')).values('count')), 0))
+
+
+@contextmanager
+def order_totals_deferred():
+    """
+    Откладывает пересчёт итогов до выхода из блока, например на время массового удаления позиций.
+    Каждый затронутый заказ пересчитывается один раз.
+    """
+    previous = getattr(_state, 'pending', None)
+    _state.pending = set()
+    try:
+        yield
+        refresh_order_totals(_state.pending)
+    finally:
+        _state.pending = previous
+
+
+def order_item_changed(item):
+    """
+    Пересчитывает итоги заказа изменившейся позиции.
+    Загруженный вместе с позицией заказ получает новые итоги и в памяти.
+    """
+    pending = getattr(_state, 'pending', None)
+    if pending is not None:
+        pending.add(item.order_id)
+        return
+    refresh_order_totals([item.order_id])
+    if OrderItem.order.is_cached(item):
+        item.order.total_sum, item.order.items_count = Order.objects.filter(id=item.order_id).values_list(
+            'total_sum', 'items_count').first() or (0, 0)
+
+
+def refresh_basket_totals(product_info_ids):
+    """
+    Пересчитывает итоги корзин, в которых лежат указанные предложения.
+    """
+    refresh_order_totals(Order.objects.filter(state='basket', ordered_items__product_info_id__in=product_info_ids)
+                         .values_list('id', flat=True))
+
+
+def snapshot_order_items(order_ids):
+    """
+    Копирует в позиции заказов текущие цену, название, модель и магазин предложений одним UPDATE.
+    Позиции, у которых снимок уже есть, не меняются: в них цена на момент оформления.
+    """
+    offer = ProductInfo.objects.filter(id=OuterRef('product_info_id'))
+    OrderItem.objects.filter(order_id__in=order_ids, price__isnull=True).update(
+        price=Subquery(offer.values('price')[:1]),
+        product_name=Subquery(offer.values('product__name')[:1]),
+        model=Subquery(offer.values('model')[:1]),
+        shop_id=Subquery(offer.values('shop_id')[:1]))
+
+
+def reserve_stock(order_id):
+    """
+    Списывает остатки предложений под позиции заказа.
+    Вызывается внутри транзакции оформления: при нехватке бросает StockShortage
+    со всеми недостающими позициями, и транзакция откатывается.
+    Возвращает пары (id предложения, списанное количество).
+    """
+    items = list(OrderItem.objects.filter(order_id=order_id).order_by('product_info_id').values_list(
+        'product_info_id', 'quantity'))
+    short = {}
+    for product_info_id, quantity in items:
+        if not ProductInfo.objects.filter(id=product_info_id, quantity__gte=quantity).update(
+                quantity=F('quantity') - quantity):
+            short[product_info_id] = quantity
+    if short:
+        available = dict(ProductInfo.objects.filter(id__in=short).values_list('id', 'quantity'))
+        raise StockShortage([{'product_info': product_info_id, 'requested': quantity,
+                              'available': available.get(product_info_id, 0)}
+                             for product_info_id, quantity in short.items()])
+    return items
+
+
+def bump_basket_version(user_id, expected=None):
+    """
+    Увеличивает версию корзины пользователя и возвращает новую.
+    Вызывается первым в транзакции изменения корзины: UPDATE блокирует строку заказа,
+    и одновременные изменения той же корзины выполняются по очереди.
+    При переданной версии, не совпадающей с текущей, бросает BasketConflict.
+    """
+    baskets = Order.objects.filter(user_id=user_id, state='basket')
+    if expected is None:
+        baskets.update(version=F('version') + 1)
+        return baskets.values_list('version', flat=True).first()
+    if not baskets.filter(version=expected).update(version=F('version') + 1):
+        raise BasketConflict(baskets.values_list('version', flat=True).first())
+    return expected + 1
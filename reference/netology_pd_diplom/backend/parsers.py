@@ -0,0 +1,54 @@
+"""
+Быстрые парсеры DRF: JSON на ujson и MessagePack.
+"""
+import msgpack
+import ujson
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+from backend.renderers import MessagePackRenderer, UJSONRenderer
+
+
+class UJSONParser(JSONParser):
+    """
+    JSONParser на ujson.
+    """
+    renderer_class = UJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        try:
+            return ujson.loads(stream.read().decode(encoding))
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class MessagePackParser(BaseParser):
+    """
+    Парсер MessagePack (application/msgpack).
+    """
+    media_type = 'application/msgpack'
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, TypeError, msgpack.UnpackException) as exc:
+            raise ParseError('MessagePack parse error - %s' % str(exc))
+
+
+def bulk_payload_error(request):
+    """
+    Ответ 413, если тело запроса больше BULK_MAX_BODY_SIZE. Проверяется по заголовку до разбора тела.
+    """
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length > settings.BULK_MAX_BODY_SIZE:
+        return JsonResponse({'Status': False, 'Errors': 'Слишком большой запрос'}, status=413)
+    return None
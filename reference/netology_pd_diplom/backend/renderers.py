@@ -0,0 +1,68 @@
+"""
+Быстрые рендереры DRF: JSON на ujson и MessagePack.
+
+Результат JSON совпадает с rest_framework.renderers.JSONRenderer: компактный
+вывод, ensure_ascii=False, типы, которые ujson не знает (datetime, UUID,
+ленивые строки и т.п.), преобразуются кодировщиком DRF. MessagePack
+использует то же преобразование, поэтому данные в обоих форматах одинаковы.
+"""
+import msgpack
+import ujson
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+_encoder = JSONEncoder()
+
+
+def json_default(obj):
+    """
+    Преобразование типов, которые ujson не сериализует сам, так же, как это делает DRF.
+    """
+    return _encoder.default(obj)
+
+
+def json_dumps(data, indent=0):
+    """
+    Сериализация в JSON-строку через ujson.
+    """
+    ret = ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False, default=json_default,
+                      indent=indent or 0)
+    # Как и DRF, экранируем \u2028 и \u2029, чтобы ответ оставался корректным JavaScript
+    if '\u2028' in ret or '\u2029' in ret:
+        ret = ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+    return ret
+
+
+class UJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на ujson.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        return json_dumps(data, indent).encode()
+
+
+def msgpack_dumps(data):
+    """
+    Сериализация в MessagePack с тем же преобразованием типов, что и у JSON.
+    """
+    return msgpack.packb(data, default=json_default, use_bin_type=True)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Рендерер MessagePack (application/msgpack).
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack_dumps(data)
@@ -0,0 +1,203 @@
+"""
+Нечёткий поиск по названиям товаров и моделям на триграммах.
+
+На PostgreSQL используется расширение pg_trgm (word_similarity по полям
+витрины с GIN-индексами, см. команду setup_trigram_search). На остальных
+базах триграммы хранятся в таблице ProductTrigram и обновляются вместе
+с витриной только для предложений, у которых изменился текст.
+
+Поиск в два этапа: кандидаты - предложения с наибольшим числом общих
+с запросом триграмм (не больше SEARCH_CANDIDATES), затем ранжирование
+по сходству, как у word_similarity в pg_trgm. По каждой триграмме
+читается не больше SEARCH_TRIGRAM_POSTINGS записей, а частые триграммы,
+у которых записей больше, отбрасываются, если у запроса есть более
+редкие. Так время ответа не растёт вместе с каталогом.
+
+Для сортировки списка товаров по релевантности (sort=relevance) слова
+предложений хранятся в ProductToken на всех базах и ранжируются по BM25.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Sum
+
+from backend.autocomplete import normalize
+from backend.cache import get_catalog_cached
+from backend.models import CatalogOffer, ProductTrigram, ProductToken
+
+WORD_RE = re.compile(r'\w+')
+
+# Сколько предложений индексируем за раз при полной пересборке
+INDEX_CHUNK_SIZE = 1000
+
+# Параметры BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def uses_pg_trgm():
+    return connection.vendor == 'postgresql'
+
+
+def trigrams(text):
+    """
+    Триграммы текста как в pg_trgm: каждое слово дополняется двумя пробелами слева и одним справа.
+    """
+    result = set()
+    for word in WORD_RE.findall(normalize(text)):
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def _similarity(left, right):
+    if not left or not right:
+        return 0.0
+    shared = len(left & right)
+    return shared / (len(left) + len(right) - shared)
+
+
+def word_similarity(query, text):
+    """
+    Сходство запроса с текстом: лучшее из сходства с текстом целиком и с его отдельными словами.
+    """
+    query_trigrams = trigrams(query)
+    scores = [_similarity(query_trigrams, trigrams(text))]
+    scores.extend(_similarity(query_trigrams, trigrams(word)) for word in WORD_RE.findall(normalize(text)))
+    return max(scores)
+
+
+def tokens(text):
+    """
+    Нормализованные слова текста.
+    """
+    return WORD_RE.findall(normalize(text))
+
+
+def _create_index(offers):
+    ProductToken.objects.bulk_create([
+        ProductToken(product_info_id=offer.product_info_id, token=token[:80], tf=tf, length=len(words))
+        for offer in offers
+        for words in [tokens(f'{offer.product_name} {offer.model}')]
+        for token, tf in Counter(words).items()
+    ], batch_size=INDEX_CHUNK_SIZE)
+    if uses_pg_trgm():
+        return
+    ProductTrigram.objects.bulk_create([
+        ProductTrigram(product_info_id=offer.product_info_id, trigram=trigram)
+        for offer in offers
+        for trigram in trigrams(f'{offer.product_name} {offer.model}')
+    ], batch_size=INDEX_CHUNK_SIZE)
+
+
+def update_search_index(offers, removed_ids=()):
+    """
+    Пересчитывает слова и триграммы указанных строк витрины и удаляет их у исчезнувших предложений.
+    """
+    product_info_ids = [offer.product_info_id for offer in offers] + list(removed_ids)
+    if not product_info_ids:
+        return
+    ProductToken.objects.filter(product_info_id__in=product_info_ids).delete()
+    ProductTrigram.objects.filter(product_info_id__in=product_info_ids).delete()
+    _create_index(offers)
+
+
+def rebuild_search_index():
+    """
+    Полностью пересобирает слова и триграммы по витрине.
+    """
+    ProductToken.objects.all().delete()
+    ProductTrigram.objects.all().delete()
+    offers = CatalogOffer.objects.only('product_info_id', 'product_name', 'model').iterator(
+        chunk_size=INDEX_CHUNK_SIZE)
+    while batch := list(islice(offers, INDEX_CHUNK_SIZE)):
+        _create_index(batch)
+
+
+def _search_pg_trgm(query, limit):
+    from django.contrib.postgres.search import TrigramWordSimilarity
+    from django.db.models import Q
+    from django.db.models.functions import Greatest
+
+    # Кандидатов отбирает оператор %> (trigram_word_similar, см. BackendConfig.ready)
+    # по GIN-индексам, ранжирует word_similarity
+    similarity = Greatest(TrigramWordSimilarity(query, 'product_name'), TrigramWordSimilarity(query, 'model'))
+    return list(CatalogOffer.objects.filter(
+        Q(product_name__trigram_word_similar=query) | Q(model__trigram_word_similar=query)).annotate(
+        similarity=similarity).filter(similarity__gte=settings.SEARCH_SIMILARITY_THRESHOLD).order_by(
+        '-similarity', 'product_info_id').values_list('product_info_id', flat=True)[:limit])
+
+
+def _candidate_ids(query_trigrams):
+    """
+    id предложений с наибольшим числом общих с запросом триграмм, не больше SEARCH_CANDIDATES.
+    """
+    limit = settings.SEARCH_TRIGRAM_POSTINGS
+    rare, frequent = [], []
+    for trigram in sorted(query_trigrams):
+        # Записи триграммы читаются по индексу (trigram, product_info) не дальше limit + 1
+        ids = list(ProductTrigram.objects.filter(trigram=trigram).order_by('product_info_id').values_list(
+            'product_info_id', flat=True)[:limit + 1])
+        if len(ids) > limit:
+            frequent.append(ids[:limit])
+        else:
+            rare.append(ids)
+
+    # Частая триграмма почти ничего не говорит о сходстве, учитываем их, только если других нет
+    shared = Counter(chain.from_iterable(rare or frequent))
+    return [product_info_id for product_info_id, _ in sorted(
+        shared.items(), key=lambda item: (-item[1], item[0]))[:settings.SEARCH_CANDIDATES]]
+
+
+def search_offer_ids(query, limit):
+    """
+    id предложений витрины, похожих на запрос, в порядке убывания сходства.
+    """
+    if uses_pg_trgm():
+        return _search_pg_trgm(query, limit)
+
+    query_trigrams = trigrams(query)
+    if not query_trigrams:
+        return []
+
+    scored = []
+    for product_info_id, product_name, model in CatalogOffer.objects.filter(
+            product_info_id__in=_candidate_ids(query_trigrams)).values_list('product_info_id', 'product_name', 'model'):
+        similarity = max(word_similarity(query, product_name), word_similarity(query, model))
+        if similarity >= settings.SEARCH_SIMILARITY_THRESHOLD:
+            scored.append((-similarity, product_info_id))
+    return [product_info_id for _, product_info_id in sorted(scored)[:limit]]
+
+
+def _bm25_stats():
+    total = CatalogOffer.objects.count()
+    words = ProductToken.objects.aggregate(words=Sum('tf'))['words'] or 0
+    return total, words / total if total else 0.0
+
+
+def bm25_scores(query):
+    """
+    Оценки BM25 предложений, содержащих хотя бы одно слово запроса: id -> оценка.
+    Число предложений и средняя длина текста кэшируются до изменения каталога.
+    """
+    query_tokens = set(tokens(query))
+    if not query_tokens:
+        return {}
+
+    postings = defaultdict(list)
+    for product_info_id, token, tf, length in ProductToken.objects.filter(token__in=query_tokens).values_list(
+            'product_info_id', 'token', 'tf', 'length'):
+        postings[token].append((product_info_id, tf, length))
+
+    total, average_length = get_catalog_cached('catalog:bm25-stats', _bm25_stats)
+    scores = defaultdict(float)
+    for token, documents in postings.items():
+        idf = math.log(1 + (total - len(documents) + 0.5) / (len(documents) + 0.5))
+        for product_info_id, tf, length in documents:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (average_length or 1))
+            scores[product_info_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+    return scores
@@ -1,9 +1,50 @@
 # Верстальщик
+from collections import defaultdict
+
 from rest_framework import serializers
 
 from backend.models import User, Category, Shop, ProductInfo, Product, ProductParameter, OrderItem, Order, Contact
 
 
+def requested_fields(request, available, compact):
+    """
+    Набор полей ответа из параметров запроса.
+
+    ?fields=a,b - только перечисленные поля (неизвестные игнорируются; если известных
+    нет, параметр не учитывается), ?view=compact - компактный набор compact,
+    иначе None - все поля.
+    """
+    fields = request.query_params.get('fields')
+    if fields:
+        fields = set(field.strip() for field in fields.split(','))
+        selected = tuple(field for field in available if field in fields)
+        if selected:
+            return selected
+    if request.query_params.get('view') == 'compact':
+        return compact
+    return None
+
+
+def compact_requested(request):
+    """
+    Клиент запросил компактное представление параметром ?view=compact.
+    """
+    return request.query_params.get('view') == 'compact'
+
+
+class DynamicFieldsMixin:
+    """
+    Позволяет оставить в сериализаторе только поля, переданные аргументом fields.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
 class ContactSerializer(serializers.ModelSerializer):
     class Meta:
         model = Contact
@@ -63,31 +104,157 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+# Поля ProductInfo для быстрой сериализации через .values()
+PRODUCT_INFO_VALUES = ('id', 'model', 'product__name', 'product__category__name', 'shop_id', 'quantity', 'price',
+                       'price_rrc')
+
+# Сколько предложений обрабатываем за один запрос параметров
+PARAMETERS_CHUNK_SIZE = 500
+
+
+def group_product_parameters(product_info_ids):
+    """
+    Параметры предложений, сгруппированные по id предложения,
+    в формате ProductParameterSerializer.
+    """
+    product_info_ids = list(product_info_ids)
+    parameters = defaultdict(list)
+    for start in range(0, len(product_info_ids), PARAMETERS_CHUNK_SIZE):
+        rows = ProductParameter.objects.filter(
+            product_info_id__in=product_info_ids[start:start + PARAMETERS_CHUNK_SIZE]).order_by('id').values_list(
+            'product_info_id', 'parameter__name', 'value')
+        for product_info_id, parameter, value in rows:
+            parameters[product_info_id].append({'parameter': parameter, 'value': value})
+    return parameters
+
+
+def product_info_data(row, parameters):
+    """
+    Данные предложения в формате ProductInfoSerializer из строки .values(*PRODUCT_INFO_VALUES).
+    """
+    return {
+        'id': row['id'],
+        'model': row['model'],
+        'product': {'name': row['product__name'], 'category': row['product__category__name']},
+        'shop': row['shop_id'],
+        'quantity': row['quantity'],
+        'price': row['price'],
+        'price_rrc': row['price_rrc'],
+        'product_parameters': parameters,
+    }
+
+
+def serialize_product_infos(queryset):
+    """
+    Быстрая сериализация предложений только для чтения.
+
+    Результат совпадает с ProductInfoSerializer(queryset, many=True).data, но строится
+    из .values() и заранее сгруппированных параметров без вложенных сериализаторов:
+    два запроса и простые словари вместо полей DRF на каждый объект.
+    """
+    rows = list(queryset.values(*PRODUCT_INFO_VALUES))
+    parameters = group_product_parameters(row['id'] for row in rows)
+    return [product_info_data(row, parameters.get(row['id'], [])) for row in rows]
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ('id', 'product_info', 'quantity', 'order',)
         read_only_fields = ('id',)
         extra_kwargs = {
-            'order': {'write_only': True}
+            'order': {'write_only': True},
+            'product_info': {'required': True, 'allow_null': False},
         }
 
 
+def order_product_infos(orders):
+    """
+    Предложения позиций заказов в формате ProductInfoSerializer: id -> данные.
+    Строятся одним проходом serialize_product_infos для всех заказов и передаются
+    сериализатору заказа в context['product_infos'].
+    """
+    product_info_ids = {item.product_info_id for order in orders for item in order.ordered_items.all()}
+    return {data['id']: data for data in serialize_product_infos(ProductInfo.objects.filter(id__in=product_info_ids))}
+
+
 class OrderItemCreateSerializer(OrderItemSerializer):
-    product_info = ProductInfoSerializer(read_only=True)
+    product_info = serializers.SerializerMethodField()
 
+    def get_product_info(self, obj):
+        # Готовые данные из order_product_infos, без них - вложенный сериализатор на каждую позицию
+        product_infos = self.context.get('product_infos')
+        if product_infos is not None:
+            return product_infos.get(obj.product_info_id)
+        if obj.product_info_id is None:
+            return None
+        return ProductInfoSerializer(obj.product_info).data
 
-class OrderSerializer(serializers.ModelSerializer):
+
+class CompactProductInfoSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(source='product.name', read_only=True)
+
+    class Meta:
+        model = ProductInfo
+        fields = ('id', 'name', 'model', 'shop', 'price',)
+        read_only_fields = ('id',)
+
+
+class CompactOrderItemSerializer(OrderItemSerializer):
+    product_info = CompactProductInfoSerializer(read_only=True)
+
+
+class OrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     ordered_items = OrderItemCreateSerializer(read_only=True, many=True)
     contact = ContactSerializer(read_only=True)
-    total_sum = serializers.SerializerMethodField()
+    # Хранится в заказе и поддерживается при изменении позиций
+    total_sum = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Order
         fields = ('id', 'ordered_items', 'state', 'dt', 'total_sum', 'contact',)
         read_only_fields = ('id',)
 
-    def get_total_sum(self, obj):
-        # Рассчитываем сумму заказанных позиций
-        return sum(item.quantity * item.product_info.price for item in obj.ordered_items.all())
 
+
+class CompactOrderSerializer(OrderSerializer):
+    ordered_items = CompactOrderItemSerializer(read_only=True, many=True)
+
+
+class OrderItemSnapshotSerializer(serializers.ModelSerializer):
+    """
+    Позиция оформленного заказа из снимка предложения, без обращения к каталогу.
+    """
+    product_info = serializers.SerializerMethodField()
+
+    class Meta:
+        model = OrderItem
+        fields = ('id', 'product_info', 'quantity',)
+        read_only_fields = ('id',)
+
+    def get_product_info(self, obj):
+        return {'id': obj.product_info_id, 'name': obj.product_name, 'model': obj.model, 'shop': obj.shop_id,
+                'price': obj.price}
+
+
+class OrderHistorySerializer(OrderSerializer):
+    ordered_items = OrderItemSnapshotSerializer(read_only=True, many=True)
+
+
+class BasketSerializer(OrderSerializer):
+    """
+    Корзина с версией, которую клиент передаёт в поле version при её изменении.
+    """
+
+    class Meta(OrderSerializer.Meta):
+        fields = OrderSerializer.Meta.fields + ('version',)
+
+
+class CompactBasketSerializer(CompactOrderSerializer):
+    class Meta(CompactOrderSerializer.Meta):
+        fields = CompactOrderSerializer.Meta.fields + ('version',)
+
+
+# Поля заказа и корзины, доступные для выбора через ?fields=
+ORDER_FIELDS = ('id', 'ordered_items', 'state', 'dt', 'total_sum', 'contact',)
+BASKET_FIELDS = ORDER_FIELDS + ('version',)
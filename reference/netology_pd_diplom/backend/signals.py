@@ -1,8 +1,12 @@
 from django.dispatch import receiver, Signal
 from django_rest_passwordreset.signals import reset_password_token_created
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete
 from .tasks import send_password_reset_token, send_registration_confirmation, send_new_order_notification
-from backend.models import User
+from backend.cache import bump_catalog_version
+from backend.catalog import catalog_sync_is_paused, sync_catalog_offers
+from backend.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, OrderItem
+from backend.orders import order_item_changed, order_totals_deferred, refresh_basket_totals, \
+    snapshot_order_items
 
 new_user_registered = Signal()
 
@@ -30,3 +34,48 @@ def new_order_signal(user_id, **kwargs):
     Отправляем письмо при изменении статуса заказа.
     """
     send_new_order_notification.delay(user_id)  # Используем Celery для отправки письма
+
+
+@receiver([post_save, post_delete], sender=Shop)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductInfo)
+@receiver([post_save, post_delete], sender=Parameter)
+@receiver([post_save, post_delete], sender=ProductParameter)
+def catalog_changed_signal(instance, signal, **kwargs):
+    """
+    Любое изменение каталога обновляет витрину и делает закэшированные выборки устаревшими.
+    """
+    if catalog_sync_is_paused():
+        return
+    sync_catalog_offers(instance, deleted=signal is post_delete)
+    bump_catalog_version()
+
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def order_item_changed_signal(instance, **kwargs):
+    """
+    Изменение позиции пересчитывает итоги её заказа.
+    """
+    order_item_changed(instance)
+
+
+@receiver(post_save, sender=ProductInfo)
+def product_info_saved_signal(instance, created, **kwargs):
+    """
+    Цена предложения могла измениться, пересчитываем итоги корзин с ним.
+    """
+    if not created:
+        refresh_basket_totals([instance.id])
+
+
+@receiver(pre_delete, sender=ProductInfo)
+def product_info_deleted_signal(instance, **kwargs):
+    """
+    Удалённое предложение убираем из корзин. В оформленных заказах позиция остаётся со снимком,
+    снимок делается сейчас, если его ещё нет.
+    """
+    items = OrderItem.objects.filter(product_info_id=instance.id)
+    with order_totals_deferred():
+        items.filter(order__state='basket').delete()
+    snapshot_order_items(items.filter(price__isnull=True).values('order_id'))
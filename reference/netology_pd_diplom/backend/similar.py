@@ -0,0 +1,193 @@
+"""
+Похожие товары по параметрам предложений.
+
+Предложения категории кодируются векторами признаков: по одному столбцу
+на частое значение текстового параметра (one-hot), нормированные в [0, 1]
+числовые параметры и логарифм цены. Похожие - ближайшие соседи по
+евклидову расстоянию, которое считается для пачки запросов одним
+матричным умножением.
+
+Матрица каждой категории хранится в отдельном файле и пересобирается
+после импорта задачей Celery, а не в запросе. Процесс загружает файл
+один раз и перечитывает его, когда файл заменён новой сборкой.
+"""
+import math
+import os
+import tempfile
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.conf import settings
+
+from backend.models import CatalogOffer
+
+# Вес столбца one-hot: у двух разных значений расстояние в квадрате 1, как у крайних числовых
+ONE_HOT_WEIGHT = 1 / math.sqrt(2)
+
+
+def _number(value):
+    try:
+        number = float(str(value).replace(',', '.'))
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _scale(values):
+    """
+    Нормирует числа в [0, 1]. Отсутствующие значения заменяются средним.
+    """
+    column = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    missing = np.isnan(column)
+    low, high = column[~missing].min(), column[~missing].max()
+    column = (column - low) / (high - low) if high > low else np.zeros_like(column)
+    column[missing] = column[~missing].mean()
+    return column
+
+
+def encode_offers(rows):
+    """
+    Матрица признаков предложений.
+    rows - список (id предложения, цена, параметры витрины).
+    """
+    values = defaultdict(lambda: [None] * len(rows))
+    for position, (_, _, parameters) in enumerate(rows):
+        for parameter in parameters:
+            values[parameter['parameter']][position] = parameter['value']
+
+    columns = []
+    for name in sorted(values):
+        column = values[name]
+        numbers = [None if value is None else _number(value) for value in column]
+        if all(number is not None for number, value in zip(numbers, column) if value is not None):
+            columns.append(_scale(numbers))
+            continue
+        # Текстовый параметр: столбцы только для самых частых значений, чтобы матрица оставалась узкой
+        items = np.array(column, dtype=object)
+        for value, _ in Counter(value for value in column if value is not None).most_common(
+                settings.SIMILAR_MAX_VALUES):
+            columns.append((items == value) * ONE_HOT_WEIGHT)
+
+    if rows:
+        columns.append(_scale([math.log1p(price) for _, price, _ in rows]) * settings.SIMILAR_PRICE_WEIGHT)
+
+    matrix = np.column_stack(columns).astype(np.float32) if columns else np.zeros((len(rows), 0), np.float32)
+    return np.array([row[0] for row in rows], dtype=np.int64), matrix
+
+
+def _index_path(category_id):
+    return os.path.join(settings.SIMILAR_INDEX_DIR, f'{category_id}.npz')
+
+
+def build_similarity_index(category_id):
+    """
+    Строит матрицу признаков категории и атомарно заменяет её файл.
+    """
+    rows = list(CatalogOffer.objects.filter(category_id=category_id).order_by('product_info_id').values_list(
+        'product_info_id', 'price', 'parameters'))
+    ids, matrix = encode_offers(rows)
+
+    path = _index_path(category_id)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.npz', delete=False) as file:
+        np.savez(file, ids=ids, matrix=matrix)
+    os.replace(file.name, path)
+    return len(ids)
+
+
+def build_similarity_indexes(category_ids=None):
+    """
+    Пересобирает матрицы указанных категорий, по умолчанию - всех категорий витрины.
+    """
+    if category_ids is None:
+        category_ids = CatalogOffer.objects.values_list('category_id', flat=True).distinct().order_by()
+    for category_id in set(category_ids):
+        if category_id is not None:
+            build_similarity_index(category_id)
+
+
+class SimilarityIndex:
+    """
+    Матрица признаков категории в памяти процесса.
+    """
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.ids, self.matrix = data['ids'], data['matrix']
+        self.norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+
+    def positions(self, product_info_ids):
+        """
+        Строки матрицы для предложений, -1 для отсутствующих в матрице.
+        """
+        product_info_ids = np.asarray(product_info_ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, product_info_ids)
+        found = positions < len(self.ids)
+        found[found] = self.ids[positions[found]] == product_info_ids[found]
+        return np.where(found, positions, -1)
+
+    def nearest(self, positions, limit):
+        """
+        Ближайшие соседи строк positions: массив id предложений, ближайшие первыми.
+        Расстояния считаются пачками по SIMILAR_BATCH_SIZE запросов.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        limit = min(limit, len(self.ids) - 1)
+        if limit <= 0 or not len(positions):
+            return np.zeros((len(positions), 0), dtype=np.int64)
+
+        result = []
+        for start in range(0, len(positions), settings.SIMILAR_BATCH_SIZE):
+            batch = positions[start:start + settings.SIMILAR_BATCH_SIZE]
+            # |a - b|^2 = |a|^2 + |b|^2 - 2ab
+            distances = self.norms[batch, None] + self.norms[None, :] - 2 * (self.matrix[batch] @ self.matrix.T)
+            distances[np.arange(len(batch)), batch] = np.inf
+            top = np.argpartition(distances, limit - 1, axis=1)[:, :limit]
+            # Внутри первых limit - по расстоянию, при равенстве по id
+            order = np.lexsort((self.ids[top], np.take_along_axis(distances, top, axis=1)), axis=1)
+            result.append(self.ids[np.take_along_axis(top, order, axis=1)])
+        return np.concatenate(result)
+
+
+_indexes = {}
+
+
+def get_similarity_index(category_id):
+    """
+    Матрица категории текущего процесса. Перечитывается, когда файл заменён новой сборкой.
+    Если файла ещё нет, возвращает None.
+    """
+    path = _index_path(category_id)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _indexes.get(path)
+    if cached is None or cached[0] != key:
+        cached = _indexes[path] = (key, SimilarityIndex(path))
+    return cached[1]
+
+
+def similar_offer_ids(category_id, product_info_ids, limit):
+    """
+    Похожие предложения той же категории: id предложения -> список id, ближайшие первыми.
+    Для предложений, которых ещё нет в матрице, список пуст, а пересборка матрицы ставится в очередь.
+    """
+    result = {product_info_id: [] for product_info_id in product_info_ids}
+    index = get_similarity_index(category_id)
+    positions = index.positions(product_info_ids) if index is not None else np.full(len(product_info_ids), -1)
+    if (positions < 0).any():
+        # tasks импортирует этот модуль
+        from backend.tasks import schedule_similarity_build
+        schedule_similarity_build([category_id])
+    if index is None:
+        return result
+
+    found = positions >= 0
+    neighbours = index.nearest(positions[found], limit)
+    for product_info_id, ids in zip(np.asarray(product_info_ids)[found], neighbours):
+        result[int(product_info_id)] = ids.tolist()
+    return result
@@ -0,0 +1,45 @@
+"""
+Потоковая выдача больших списков в JSON.
+
+Список не собирается целиком в памяти: объекты читаются из базы порциями
+через .iterator(chunk_size=...), сериализуются по одному и сразу пишутся
+в ответ в виде JSON-массива.
+"""
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from backend.renderers import json_dumps
+
+# Размер буфера, после которого порция отдаётся серверу
+BUFFER_SIZE = 64 * 1024
+
+
+def stream_requested(request):
+    """
+    Клиент запросил потоковую выдачу параметром ?stream=true.
+    """
+    return request.query_params.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def _json_array(items):
+    buffer = ['[']
+    size = 1
+    for index, item in enumerate(items):
+        chunk = json_dumps(item)
+        if index:
+            chunk = ',' + chunk
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= BUFFER_SIZE:
+            yield ''.join(buffer).encode()
+            buffer, size = [], 0
+    buffer.append(']')
+    yield ''.join(buffer).encode()
+
+
+def stream_queryset(queryset, serialize, status=200):
+    """
+    Потоковый JSON-ответ: queryset читается порциями, каждый объект сериализуется функцией serialize.
+    """
+    items = (serialize(obj) for obj in queryset.iterator(chunk_size=settings.STREAM_CHUNK_SIZE))
+    return StreamingHttpResponse(_json_array(items), content_type='application/json', status=status)
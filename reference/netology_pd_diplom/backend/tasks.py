@@ -1,14 +1,25 @@
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.mail import EmailMultiAlternatives
 from django.conf import settings
 from celery import shared_task
 from django.core.validators import URLValidator
+from django.db import transaction
 from requests import get
 import requests
 import yaml
+from backend.autocomplete import build_autocomplete_index
+from backend.cache import bump_catalog_version
+from backend.catalog import catalog_sync_paused, rebuild_catalog_for_shop
+from backend.similar import build_similarity_indexes
 from backend.models import Shop, Category, ProductInfo, Product, Parameter, ProductParameter, TaskStatus, \
     ConfirmEmailToken, User
 
+# Пока сборка индекса стоит в очереди, повторные запросы на неё не ставят новую
+AUTOCOMPLETE_BUILD_LOCK = 'autocomplete:build'
+SIMILAR_BUILD_LOCK = 'similar:build:{}'
+INDEX_BUILD_LOCK_TIMEOUT = 600
+
 
 @shared_task
 def send_email(subject, message, recipient_email):
@@ -81,41 +92,90 @@ def load_data_from_url(self, url, user_id):
     except yaml.YAMLError as e:
         return {"Status": "FAILED", "Error": f"YAML parsing error: {str(e)}"}
 
+    shop = None
     try:
-        shop_data = data.get("shop")
-        shop = Shop.objects.create(name=shop_data["name"], user=user)
-
-        for category_data in data.get("categories", []):
-            category = Category.objects.create(name=category_data["name"])
-            category.shops.add(shop)
-
-        for product_data in data.get("products", []):
-            category = Category.objects.get(id=product_data["category"])
-            product = Product.objects.create(name=product_data["name"], category=category)
-
-            # Проверка наличия external_id
-            external_id = product_data.get("external_id", None)
-            if not external_id:
-                return {"Status": "FAILED", "Error": f"Missing external_id for product {product_data['name']}"}
-
-            # Создаем ProductInfo с учетом внешнего ID
-            product_info = ProductInfo.objects.create(
-                product=product,
-                shop=shop,
-                model=product_data["model"],
-                price=product_data["price"],
-                price_rrc=product_data.get("price_rrc", product_data["price"]),
-                external_id=external_id,
-                quantity=product_data.get("quantity", 0),  # Если количество не указано, ставим 0
-            )
-
-            for param_name, param_value in product_data.get("parameters", {}).items():
-                parameter, _ = Parameter.objects.get_or_create(name=param_name)
-                ProductParameter.objects.create(
-                    product_info=product_info, parameter=parameter, value=param_value
+        # Витрину обновляем один раз после импорта, а не на каждую запись
+        with catalog_sync_paused():
+            shop_data = data.get("shop")
+            shop = Shop.objects.create(name=shop_data["name"], user=user)
+
+            for category_data in data.get("categories", []):
+                category = Category.objects.create(name=category_data["name"])
+                category.shops.add(shop)
+
+            for product_data in data.get("products", []):
+                category = Category.objects.get(id=product_data["category"])
+                product = Product.objects.create(name=product_data["name"], category=category)
+
+                # Проверка наличия external_id
+                external_id = product_data.get("external_id", None)
+                if not external_id:
+                    return {"Status": "FAILED", "Error": f"Missing external_id for product {product_data['name']}"}
+
+                # Создаем ProductInfo с учетом внешнего ID
+                product_info = ProductInfo.objects.create(
+                    product=product,
+                    shop=shop,
+                    model=product_data["model"],
+                    price=product_data["price"],
+                    price_rrc=product_data.get("price_rrc", product_data["price"]),
+                    external_id=external_id,
+                    quantity=product_data.get("quantity", 0),  # Если количество не указано, ставим 0
                 )
 
+                for param_name, param_value in product_data.get("parameters", {}).items():
+                    parameter, _ = Parameter.objects.get_or_create(name=param_name)
+                    ProductParameter.objects.create(
+                        product_info=product_info, parameter=parameter, value=param_value
+                    )
+
         TaskStatus.objects.create(task_id=self.request.id, user=user, status="SUCCESS")
         return {"Status": "SUCCESS"}
     except Exception as e:
         return {"Status": "FAILED", "Error": f"Processing error: {str(e)}"}
+    finally:
+        # Пересобираем витрину магазина и сбрасываем кэш каталога, даже если импорт прерван
+        if shop is not None:
+            rebuild_catalog_for_shop(shop.id)
+            bump_catalog_version()
+            build_autocomplete_index()
+            build_similarity_indexes(Product.objects.filter(product_infos__shop_id=shop.id).values_list(
+                'category_id', flat=True))
+
+
+@shared_task
+def rebuild_autocomplete_index():
+    """
+    Пересборка индекса автодополнения в фоне.
+    """
+    cache.delete(AUTOCOMPLETE_BUILD_LOCK)
+    build_autocomplete_index()
+
+
+def schedule_autocomplete_build():
+    """
+    Ставит пересборку индекса автодополнения в очередь после фиксации транзакции.
+    Пока задача не начала выполняться, повторный вызов ничего не делает.
+    """
+    if cache.add(AUTOCOMPLETE_BUILD_LOCK, True, INDEX_BUILD_LOCK_TIMEOUT):
+        transaction.on_commit(rebuild_autocomplete_index.delay)
+
+
+@shared_task
+def rebuild_similarity_indexes(category_ids):
+    """
+    Пересборка матриц похожих товаров указанных категорий в фоне.
+    """
+    cache.delete_many([SIMILAR_BUILD_LOCK.format(category_id) for category_id in category_ids])
+    build_similarity_indexes(category_ids)
+
+
+def schedule_similarity_build(category_ids):
+    """
+    Ставит пересборку матриц категорий в очередь после фиксации транзакции.
+    Категории, пересборка которых уже ждёт в очереди, пропускаются.
+    """
+    category_ids = [category_id for category_id in set(category_ids) if category_id is not None and
+                    cache.add(SIMILAR_BUILD_LOCK.format(category_id), True, INDEX_BUILD_LOCK_TIMEOUT)]
+    if category_ids:
+        transaction.on_commit(lambda: rebuild_similarity_indexes.delay(category_ids))
@@ -0,0 +1,39 @@
+"""
+Запуск тестов без внешних сервисов.
+
+В рабочей конфигурации кэш общий для всех процессов и живёт в Redis.
+Тесты по умолчанию используют кэш в памяти процесса, а проверки
+работы с Redis включаются отдельно (см. REDIS_TEST_URL в test_cache).
+
+Файлы индексов (автодополнение, похожие товары) тесты пишут во временный
+каталог, который удаляется после прогона, а не в рабочий var/.
+"""
+import os
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._index_directory = tempfile.mkdtemp(prefix='test-var-')
+        self._test_settings = override_settings(
+            CACHES=TEST_CACHES,
+            AUTOCOMPLETE_INDEX_PATH=os.path.join(self._index_directory, 'autocomplete.idx'),
+            SIMILAR_INDEX_DIR=os.path.join(self._index_directory, 'similar'),
+        )
+        self._test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_settings.disable()
+        shutil.rmtree(self._index_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
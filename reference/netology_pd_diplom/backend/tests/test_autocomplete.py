@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from backend import autocomplete
+from backend.autocomplete import AutocompleteIndex, build_autocomplete_index, get_autocomplete_index
+from backend.tasks import rebuild_autocomplete_index
+from backend.models import Shop, Category, Product, ProductInfo, Order, OrderItem, User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'autocomplete.idx')
+        self.settings_override = override_settings(AUTOCOMPLETE_INDEX_PATH=self.path)
+        self.settings_override.enable()
+
+        shop = Shop.objects.create(name='Test Shop', state=True)
+        category = Category.objects.create(name='Смартфоны')
+        self.offers = {}
+        for name, model in (('Смартфон Apple iPhone XS Max', 'apple/iphone/xs-max'),
+                            ('Смартфон Apple iPhone XR', 'apple/iphone/xr'),
+                            ('Смартфон Samsung Galaxy S9', 'samsung/galaxy/s9'),
+                            ('Ёлочная игрушка', '')):
+            product = Product.objects.create(name=name, category=category)
+            self.offers[name] = ProductInfo.objects.create(shop=shop, product=product, model=model, quantity=10,
+                                                           price=100, price_rrc=120, external_id=len(self.offers))
+
+        user = User.objects.create_user(email='buyer@example.com', password='password123', is_active=True)
+        order = Order.objects.create(user=user, state='new')
+        OrderItem.objects.create(order=order, product_info=self.offers['Смартфон Apple iPhone XR'], quantity=5)
+        build_autocomplete_index()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+        cache.clear()
+
+    def texts(self, prefix, limit=10):
+        return [item['text'] for item in AutocompleteIndex(self.path).search(prefix, limit)]
+
+    def test_prefix(self):
+        self.assertEqual(self.texts('смартфон apple'), ['Смартфон Apple iPhone XR', 'Смартфон Apple iPhone XS Max'])
+
+    def test_word_start(self):
+        self.assertEqual(self.texts('IPH'), ['Смартфон Apple iPhone XR', 'Смартфон Apple iPhone XS Max'])
+        self.assertEqual(self.texts('galaxy s'), ['Смартфон Samsung Galaxy S9'])
+
+    def test_model(self):
+        self.assertEqual(self.texts('samsung/'), ['samsung/galaxy/s9'])
+
+    def test_normalization(self):
+        self.assertEqual(self.texts('елочная  '), ['Ёлочная игрушка'])
+
+    def test_popularity_and_limit(self):
+        self.assertEqual(self.texts('смартфон', limit=1), ['Смартфон Apple iPhone XR'])
+
+    def test_no_match(self):
+        self.assertEqual(self.texts('nokia'), [])
+        self.assertEqual(self.texts(''), [])
+
+    @override_settings(AUTOCOMPLETE_SCAN_LIMIT=1)
+    def test_scan_limit(self):
+        self.assertEqual(len(self.texts('смартфон')), 1)
+
+    def test_index_reopened_after_rebuild(self):
+        index = get_autocomplete_index()
+        self.assertIs(get_autocomplete_index(), index)
+
+        product = Product.objects.create(name='Смартфон Nokia', category=Category.objects.first())
+        ProductInfo.objects.create(shop=Shop.objects.first(), product=product, quantity=1, price=10,
+                                   price_rrc=20, external_id=100)
+        build_autocomplete_index()
+        self.assertIsNot(get_autocomplete_index(), index)
+        self.assertEqual([item['text'] for item in get_autocomplete_index().search('nok', 10)],
+                         ['Смартфон Nokia'])
+
+    def test_missing_index_scheduled(self):
+        os.remove(self.path)
+        autocomplete._index = None
+        self.assertIsNone(get_autocomplete_index())
+
+        client = APIClient()
+        with mock.patch('backend.tasks.rebuild_autocomplete_index.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                for _ in range(2):
+                    response = client.get(reverse('products-autocomplete'), {'q': 'смарт'})
+                    self.assertEqual(response.json(), [])
+        # Сборка не выполняется в запросе и ставится в очередь один раз
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(delay.call_count, 1)
+
+        rebuild_autocomplete_index()
+        self.assertEqual(len(get_autocomplete_index().search('смарт', 10)), 3)
+
+    def test_partner_state_schedules_builds(self):
+        user = User.objects.create_user(email='shop@example.com', password='password123', type='shop',
+                                        is_active=True)
+        Shop.objects.update(user=user)
+        client = APIClient()
+        client.force_authenticate(user)
+        with mock.patch('backend.tasks.rebuild_autocomplete_index.delay') as delay, \
+                mock.patch('backend.tasks.rebuild_similarity_indexes.delay') as similar_delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = client.post(reverse('partner-state'), {'state': 'off'})
+        self.assertEqual(response.json(), {'Status': True})
+        self.assertEqual(delay.call_count, 1)
+        similar_delay.assert_called_once_with([Category.objects.get().id])
+
+    def test_view(self):
+        client = APIClient()
+        response = client.get(reverse('products-autocomplete'), {'q': 'iphone x', 'limit': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [
+            {'text': 'Смартфон Apple iPhone XR',
+             'product_id': self.offers['Смартфон Apple iPhone XR'].product_id}])
+
+        response = client.get(reverse('products-autocomplete'), {'q': 'iphone', 'limit': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
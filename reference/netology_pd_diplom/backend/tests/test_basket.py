@@ -0,0 +1,292 @@
+import json
+
+from backend.models import Shop, Category, Product, ProductInfo, Order, OrderItem, User, Contact, Parameter, \
+    ProductParameter
+from backend.serializers import ProductInfoSerializer
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+class BasketGetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='buyer@example.com', password='password123', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.shop = Shop.objects.create(name='Test Shop', state=True)
+        self.category = Category.objects.create(name='Категория')
+        self.parameter = Parameter.objects.create(name='Цвет')
+        self.basket = Order.objects.create(user=self.user, state='basket')
+
+    def add_items(self, count):
+        for i in range(count):
+            product = Product.objects.create(name=f'Товар {i}', category=self.category)
+            product_info = ProductInfo.objects.create(shop=self.shop, product=product, model=f'm{i}', quantity=10,
+                                                      price=10 + i, price_rrc=20, external_id=i)
+            ProductParameter.objects.create(product_info=product_info, parameter=self.parameter, value=str(i))
+            OrderItem.objects.create(order=self.basket, product_info=product_info, quantity=1)
+
+    def test_matches_nested_serializer(self):
+        self.add_items(2)
+        items = self.client.get(reverse('basket')).json()[0]['ordered_items']
+        self.assertEqual([item['product_info'] for item in items],
+                         [ProductInfoSerializer(item.product_info).data
+                          for item in OrderItem.objects.filter(order=self.basket).order_by('id')])
+
+    def test_query_count_independent_of_items(self):
+        self.add_items(1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('basket'))
+        self.add_items(20)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(reverse('basket'))
+        self.assertEqual(len(response.json()[0]['ordered_items']), 21)
+
+
+class BasketPostTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='buyer@example.com', password='password123', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        shop = Shop.objects.create(name='Test Shop', state=True)
+        category = Category.objects.create(name='Категория')
+        self.product_infos = []
+        for i in range(50):
+            product = Product.objects.create(name=f'Товар {i}', category=category)
+            self.product_infos.append(ProductInfo.objects.create(shop=shop, product=product, quantity=10, price=10,
+                                                                 price_rrc=10, external_id=i))
+
+    def post_items(self, items):
+        return self.client.post(reverse('basket'), {'items': json.dumps(items)}, format='json')
+
+    def basket_quantities(self):
+        return dict(OrderItem.objects.filter(order__user=self.user, order__state='basket').values_list(
+            'product_info_id', 'quantity'))
+
+    def test_query_count_independent_of_items(self):
+        self.post_items([{'product_info': self.product_infos[0].id, 'quantity': 1}])
+        items = [{'product_info': product_info.id, 'quantity': 2} for product_info in self.product_infos]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_items(items)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['Создано объектов'], 49)
+        self.assertLessEqual(len(queries), 10)
+        quantities = self.basket_quantities()
+        self.assertEqual(quantities[self.product_infos[0].id], 3)
+        self.assertEqual(quantities[self.product_infos[1].id], 2)
+
+    def test_duplicates_merged(self):
+        product_info_id = self.product_infos[0].id
+        response = self.post_items([{'product_info': product_info_id, 'quantity': 1},
+                                    {'product_info': product_info_id, 'quantity': 4}])
+        self.assertEqual(response.json()['Создано объектов'], 1)
+        self.assertEqual(self.basket_quantities(), {product_info_id: 5})
+
+    def test_missing_product_rejected(self):
+        response = self.post_items([{'product_info': self.product_infos[0].id, 'quantity': 1},
+                                    {'product_info': 0, 'quantity': 1}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.basket_quantities(), {})
+
+    def test_invalid_quantity(self):
+        for quantity in (0, -1, '2'):
+            response = self.post_items([{'product_info': self.product_infos[0].id, 'quantity': quantity}])
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.filter(user=self.user).exists())
+
+
+class BasketPutTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='buyer@example.com', password='password123', is_active=True)
+        self.other = User.objects.create_user(email='other@example.com', password='password123', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        shop = Shop.objects.create(name='Test Shop', state=True)
+        category = Category.objects.create(name='Категория')
+        basket = Order.objects.create(user=self.user, state='basket')
+        placed = Order.objects.create(user=self.user, state='new')
+        other_basket = Order.objects.create(user=self.other, state='basket')
+        self.items = []
+        for i in range(20):
+            product = Product.objects.create(name=f'Товар {i}', category=category)
+            product_info = ProductInfo.objects.create(shop=shop, product=product, quantity=10, price=10,
+                                                      price_rrc=10, external_id=i)
+            self.items.append(OrderItem.objects.create(order=basket, product_info=product_info, quantity=1))
+        self.placed_item = OrderItem.objects.create(order=placed, product_info=product_info, quantity=1)
+        self.other_item = OrderItem.objects.create(order=other_basket, product_info=product_info, quantity=1)
+
+    def put_items(self, items):
+        return self.client.put(reverse('basket'), {'items': json.dumps(items)}, format='json')
+
+    def test_single_update(self):
+        items = [{'id': item.id, 'quantity': index + 2} for index, item in enumerate(self.items)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.put_items(items)
+        self.assertEqual(response.json()['Обновлено объектов'], 20)
+        self.assertEqual(len([query for query in queries
+                              if query['sql'].startswith('UPDATE "backend_orderitem"')]), 1)
+        self.assertEqual([item.quantity for item in OrderItem.objects.filter(id__in=[i.id for i in self.items])
+                         .order_by('id')], list(range(2, 22)))
+
+    def test_per_item_results(self):
+        response = self.put_items([{'id': self.items[0].id, 'quantity': 5},
+                                   {'id': self.placed_item.id, 'quantity': 5},
+                                   {'id': self.other_item.id, 'quantity': 5}])
+        data = response.json()
+        self.assertEqual(data['Обновлено объектов'], 1)
+        self.assertEqual([item['Status'] for item in data['Позиции']], [True, False, False])
+        self.placed_item.refresh_from_db()
+        self.other_item.refresh_from_db()
+        self.assertEqual((self.placed_item.quantity, self.other_item.quantity), (1, 1))
+
+    def test_invalid_quantity(self):
+        response = self.put_items([{'id': self.items[0].id, 'quantity': 5},
+                                   {'id': self.items[1].id, 'quantity': 0}])
+        self.assertEqual(response.json(), {'Status': False, 'Errors': 'Неверные данные в элементе'})
+        self.items[0].refresh_from_db()
+        self.assertEqual(self.items[0].quantity, 1)
+
+
+class NativeItemsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='buyer@example.com', password='password123', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        shop = Shop.objects.create(name='Test Shop', state=True)
+        category = Category.objects.create(name='Категория')
+        self.product_infos = []
+        for i in range(3):
+            product = Product.objects.create(name=f'Товар {i}', category=category)
+            self.product_infos.append(ProductInfo.objects.create(shop=shop, product=product, quantity=10, price=10,
+                                                                 price_rrc=10, external_id=i))
+
+    def test_basket_native_arrays(self):
+        response = self.client.post(reverse('basket'), {'items': [
+            {'product_info': product_info.id, 'quantity': 1} for product_info in self.product_infos]}, format='json')
+        self.assertEqual(response.json()['Создано объектов'], 3)
+        item_ids = list(OrderItem.objects.order_by('id').values_list('id', flat=True))
+
+        response = self.client.put(reverse('basket'), {'items': [{'id': item_ids[0], 'quantity': 7}]}, format='json')
+        self.assertEqual(response.json()['Обновлено объектов'], 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(reverse('basket'), {'items': item_ids[:2]}, format='json')
+        self.assertEqual(response.json()['Удалено объектов'], 2)
+        self.assertFalse(any(' OR ' in query['sql'] for query in queries))
+        self.assertEqual(list(OrderItem.objects.values_list('id', flat=True)), item_ids[2:])
+
+    def test_delete_other_users_items_ignored(self):
+        other = User.objects.create_user(email='other@example.com', password='password123', is_active=True)
+        item = OrderItem.objects.create(order=Order.objects.create(user=other, state='basket'),
+                                        product_info=self.product_infos[0], quantity=1)
+        response = self.client.delete(reverse('basket'), {'items': [item.id]}, format='json')
+        self.assertEqual(response.json()['Удалено объектов'], 0)
+        self.assertTrue(OrderItem.objects.filter(id=item.id).exists())
+
+    def test_contact_native_array(self):
+        contacts = [Contact.objects.create(user=self.user, city='city', street='street', phone='phone')
+                    for _ in range(3)]
+        response = self.client.delete(reverse('user-contact'), {'items': [contacts[0].id, contacts[1].id]},
+                                      format='json')
+        self.assertEqual(response.json()['Удалено объектов'], 2)
+        self.assertEqual(list(Contact.objects.values_list('id', flat=True)), [contacts[2].id])
+
+    @override_settings(BULK_MAX_ITEMS=2)
+    def test_items_limit(self):
+        response = self.client.post(reverse('basket'), {'items': [
+            {'product_info': product_info.id, 'quantity': 1} for product_info in self.product_infos]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.delete(reverse('basket'), {'items': '1,2,3'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(OrderItem.objects.exists())
+
+    @override_settings(BULK_MAX_BODY_SIZE=10)
+    def test_body_limit(self):
+        response = self.client.post(reverse('basket'), {'items': [
+            {'product_info': self.product_infos[0].id, 'quantity': 1}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        response = self.client.delete(reverse('user-contact'), {'items': [1, 2, 3]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+
+class BasketVersionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='buyer@example.com', password='password123', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        product = Product.objects.create(name='Товар', category=Category.objects.create(name='Категория'))
+        self.product_info = ProductInfo.objects.create(shop=Shop.objects.create(name='Test Shop', state=True),
+                                                       product=product, quantity=10, price=10, price_rrc=10,
+                                                       external_id=1)
+
+    def post_item(self, **data):
+        return self.client.post(reverse('basket'), {
+            'items': [{'product_info': self.product_info.id, 'quantity': 1}], **data}, format='json')
+
+    def quantity(self):
+        return OrderItem.objects.get(order__user=self.user, order__state='basket').quantity
+
+    def test_version_grows(self):
+        self.assertEqual(self.post_item().json()['Версия'], 1)
+        self.assertEqual(self.post_item(version=1).json()['Версия'], 2)
+        item_id = OrderItem.objects.get().id
+        response = self.client.put(reverse('basket'), {'items': [{'id': item_id, 'quantity': 5}], 'version': 2},
+                                   format='json')
+        self.assertEqual(response.json()['Версия'], 3)
+        response = self.client.delete(reverse('basket'), {'items': [item_id], 'version': '3'}, format='json')
+        self.assertEqual(response.json()['Версия'], 4)
+        self.assertEqual(Order.objects.get(user=self.user).version, 4)
+
+    def test_version_from_get(self):
+        self.post_item()
+        basket = self.client.get(reverse('basket')).json()[0]
+        version, item_id = basket['version'], basket['ordered_items'][0]['id']
+        self.assertEqual(self.client.get(reverse('basket'), {'view': 'compact'}).json()[0]['version'], version)
+        self.assertEqual(self.client.get(reverse('basket'), {'fields': 'id,version'}).json(),
+                         [{'id': basket['id'], 'version': version}])
+
+        # Корзину изменили с другого устройства после чтения
+        self.post_item()
+        response = self.client.put(reverse('basket'), {'items': [{'id': item_id, 'quantity': 5}],
+                                                       'version': version}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.json()['Версия'], version + 1)
+        self.assertEqual(self.quantity(), 2)
+
+        version = self.client.get(reverse('basket')).json()[0]['version']
+        response = self.client.put(reverse('basket'), {'items': [{'id': item_id, 'quantity': 5}],
+                                                       'version': version}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.quantity(), 5)
+
+    def test_stale_version_rejected(self):
+        self.post_item()
+        # Корзину изменили с другого устройства
+        self.post_item()
+        response = self.post_item(version=1)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.json()['Версия'], 2)
+        self.assertEqual(self.quantity(), 2)
+
+        item_id = OrderItem.objects.get().id
+        response = self.client.put(reverse('basket'), {'items': [{'id': item_id, 'quantity': 5}], 'version': 1},
+                                   format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.quantity(), 2)
+
+    def test_invalid_version(self):
+        response = self.post_item(version=-1)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+
+    def test_quantity_incremented_in_database(self):
+        self.post_item()
+        with CaptureQueriesContext(connection) as queries:
+            self.post_item()
+        self.assertEqual(self.quantity(), 2)
+        self.assertFalse(any('FOR UPDATE' in query['sql'] for query in queries))
+        self.assertTrue(any(query['sql'].startswith('UPDATE "backend_orderitem" SET "quantity" = ("backend_orderitem"'
+                                                    '."quantity" + ') for query in queries))
@@ -0,0 +1,207 @@
+import json
+import os
+from unittest import skipUnless
+from unittest.mock import patch, MagicMock
+
+import redis
+from backend.cache import CATALOG_VERSION_KEY, get_catalog_version, bump_catalog_version, get_catalog_cached
+from backend.models import Shop, Category, Product, ProductInfo
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.compute = MagicMock(return_value=['data'])
+
+    def test_value_is_cached(self):
+        self.assertEqual(get_catalog_cached('catalog:test', self.compute), ['data'])
+        self.assertEqual(get_catalog_cached('catalog:test', self.compute), ['data'])
+        self.compute.assert_called_once()
+
+    def test_version_bump_invalidates(self):
+        version = get_catalog_version()
+        get_catalog_cached('catalog:test', self.compute)
+        self.assertEqual(bump_catalog_version(), version + 1)
+        get_catalog_cached('catalog:test', self.compute)
+        self.assertEqual(self.compute.call_count, 2)
+
+    def test_stale_value_returned_while_locked(self):
+        """
+        Пока другой запрос пересчитывает выборку, отдаём устаревшее значение.
+        """
+        get_catalog_cached('catalog:test', self.compute)
+        bump_catalog_version()
+        cache.add('catalog:test:lock', 1)
+
+        self.assertEqual(get_catalog_cached('catalog:test', MagicMock(return_value=['new'])), ['data'])
+
+    def test_waits_for_recompute_without_stale_value(self):
+        cache.add('catalog:test:lock', 1)
+
+        def release(_):
+            # Имитируем завершение чужого пересчёта
+            cache.delete('catalog:test:lock')
+
+        with patch('backend.cache.time.sleep', side_effect=release):
+            self.assertEqual(get_catalog_cached('catalog:test', self.compute), ['data'])
+        self.compute.assert_called_once()
+
+    def test_early_refresh(self):
+        """
+        При долгом пересчёте значение обновляется до истечения срока.
+        """
+        get_catalog_cached('catalog:test', self.compute)
+        value, version, expires_at, _ = cache.get('catalog:test')
+        cache.set('catalog:test', (value, version, expires_at, 10 ** 6))
+
+        get_catalog_cached('catalog:test', self.compute)
+        self.assertEqual(self.compute.call_count, 2)
+
+
+class ProductInfoViewCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = Shop.objects.create(name='Test Shop', state=True)
+        self.category = Category.objects.create(name='Test Category')
+        self.product = Product.objects.create(name='Test Product', category=self.category)
+        self.product_info = ProductInfo.objects.create(shop=self.shop, product=self.product, quantity=10,
+                                                       price=100, price_rrc=120, external_id=1)
+
+    def tearDown(self):
+        # Сбрасываем счётчики троттлинга, чтобы не влиять на другие тесты
+        cache.clear()
+
+    def test_listing_is_cached(self):
+        self.client.get(reverse('products'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('products'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+    def test_listing_invalidated_on_change(self):
+        self.client.get(reverse('products'))
+        self.product_info.price = 200
+        self.product_info.save()
+
+        response = self.client.get(reverse('products'))
+        self.assertEqual(response.data[0]['price'], 200)
+
+
+class CatalogETagTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        Shop.objects.create(name='Test Shop', state=True)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_etag_returned(self):
+        for name in ('categories', 'shops', 'products'):
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.has_header('ETag'))
+
+    def test_not_modified(self):
+        etag = self.client.get(reverse('shops'))['ETag']
+        response = self.client.get(reverse('shops'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_depends_on_params_and_version(self):
+        etag = self.client.get(reverse('products'))['ETag']
+        self.assertNotEqual(self.client.get(reverse('products'), {'shop_id': 1})['ETag'], etag)
+
+        bump_catalog_version()
+        response = self.client.get(reverse('products'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_stale_value_keeps_its_etag(self):
+        """
+        Устаревшее значение, отданное во время чужого пересчёта, получает ETag своей версии,
+        и повторная проверка с ним не подтверждает устаревшее тело ответом 304.
+        """
+        category = Category.objects.create(name='Test Category')
+        product = Product.objects.create(name='Test Product', category=category)
+        for encoding in ('', 'gzip'):
+            with self.subTest(encoding=encoding):
+                cache.clear()
+                product_info = ProductInfo.objects.create(shop=Shop.objects.get(), product=product, quantity=10,
+                                                          price=100, price_rrc=120, external_id=1)
+                first = self.client.get(reverse('products'), HTTP_ACCEPT_ENCODING=encoding)
+                product_info.price = 200
+                product_info.save()
+
+                add = cache.add
+                # Пересчёт держит другой запрос
+                with patch('backend.cache.cache.add',
+                           side_effect=lambda key, *args: not key.endswith(':lock') and add(key, *args)):
+                    stale = self.client.get(reverse('products'), HTTP_ACCEPT_ENCODING=encoding)
+                self.assertEqual(json.loads(stale.content)[0]['price'], 100)
+                self.assertEqual(stale['ETag'], first['ETag'])
+
+                response = self.client.get(reverse('products'), HTTP_ACCEPT_ENCODING=encoding,
+                                           HTTP_IF_NONE_MATCH=stale['ETag'])
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(json.loads(response.content)[0]['price'], 200)
+                self.assertNotEqual(response['ETag'], stale['ETag'])
+                product_info.delete()
+
+
+REDIS_TEST_URL = os.environ.get('REDIS_TEST_URL', 'redis://localhost:6379/15')
+
+
+def redis_available():
+    try:
+        return redis.Redis.from_url(REDIS_TEST_URL, socket_connect_timeout=0.5).ping()
+    except redis.exceptions.ConnectionError:
+        return False
+
+
+@skipUnless(redis_available(), f'Redis недоступен: {REDIS_TEST_URL}')
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                                       'LOCATION': REDIS_TEST_URL}})
+class SharedCacheTests(APITestCase):
+    """
+    Кэш в Redis общий для процессов: изменения из worker celery или другого
+    процесса web видны сразу. Другой процесс имитируется отдельным подключением.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.other_process = caches.create_connection('default')
+        shop = Shop.objects.create(name='Test Shop', state=True)
+        product = Product.objects.create(name='Test Product', category=Category.objects.create(name='Test'))
+        self.product_info = ProductInfo.objects.create(shop=shop, product=product, quantity=10, price=100,
+                                                       price_rrc=120, external_id=1)
+
+    def tearDown(self):
+        cache.clear()
+        self.other_process.close()
+
+    def test_version_bump_from_other_process(self):
+        etag = self.client.get(reverse('products'))['ETag']
+        # Импорт в worker celery увеличивает версию каталога
+        self.other_process.incr(CATALOG_VERSION_KEY)
+        response = self.client.get(reverse('products'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_lock_shared_between_processes(self):
+        compute = MagicMock(return_value=['data'])
+        get_catalog_cached('catalog:test', compute)
+        bump_catalog_version()
+        # Пересчёт уже идёт в другом процессе, отдаём устаревшее значение
+        self.other_process.add('catalog:test:lock', 1)
+        self.assertEqual(get_catalog_cached('catalog:test', MagicMock(return_value=['new'])), ['data'])
+
+    def test_offer_cache_invalidated_for_other_process(self):
+        self.client.get(reverse('products-batch'), {'ids': str(self.product_info.id)})
+        self.assertIsNotNone(self.other_process.get(f'catalog:offer:{self.product_info.id}'))
+        self.product_info.price = 200
+        self.product_info.save()
+        self.assertIsNone(self.other_process.get(f'catalog:offer:{self.product_info.id}'))
@@ -0,0 +1,147 @@
+from backend.catalog import catalog_sync_paused, rebuild_catalog_for_shop
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, CatalogOffer, \
+    BestOffer, User
+from backend.serializers import ProductInfoSerializer
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+
+class CatalogOfferSyncTests(TestCase):
+    def setUp(self):
+        self.shop = Shop.objects.create(name='Test Shop', state=True)
+        self.category = Category.objects.create(name='Test Category')
+        self.product = Product.objects.create(name='Test Product', category=self.category)
+        self.product_info = ProductInfo.objects.create(shop=self.shop, product=self.product, model='Model',
+                                                       quantity=10, price=100, price_rrc=120, external_id=1)
+        self.parameter = Parameter.objects.create(name='Цвет')
+        ProductParameter.objects.create(product_info=self.product_info, parameter=self.parameter, value='Красный')
+
+    def test_offer_created(self):
+        offer = CatalogOffer.objects.get(product_info=self.product_info)
+        self.assertEqual(offer.product_name, 'Test Product')
+        self.assertEqual(offer.category_name, 'Test Category')
+        self.assertEqual(offer.parameters, [{'parameter': 'Цвет', 'value': 'Красный'}])
+
+    def test_related_changes_propagate(self):
+        self.product.name = 'Renamed Product'
+        self.product.save()
+        self.parameter.name = 'Окрас'
+        self.parameter.save()
+
+        offer = CatalogOffer.objects.get(product_info=self.product_info)
+        self.assertEqual(offer.product_name, 'Renamed Product')
+        self.assertEqual(offer.parameters, [{'parameter': 'Окрас', 'value': 'Красный'}])
+
+    def test_parameter_deleted(self):
+        ProductParameter.objects.filter(product_info=self.product_info).delete()
+        self.assertEqual(CatalogOffer.objects.get(product_info=self.product_info).parameters, [])
+
+    def test_offer_deleted(self):
+        self.product_info.delete()
+        self.assertFalse(CatalogOffer.objects.exists())
+
+    def test_inactive_shop_excluded(self):
+        Shop.objects.filter(id=self.shop.id).update(state=False)
+        rebuild_catalog_for_shop(self.shop.id)
+        self.assertFalse(CatalogOffer.objects.exists())
+
+    def test_sync_paused(self):
+        with catalog_sync_paused():
+            product_info = ProductInfo.objects.create(shop=self.shop, product=self.product, quantity=1,
+                                                      price=50, price_rrc=60, external_id=2)
+        self.assertFalse(CatalogOffer.objects.filter(product_info=product_info).exists())
+
+        rebuild_catalog_for_shop(self.shop.id)
+        self.assertTrue(CatalogOffer.objects.filter(product_info=product_info).exists())
+
+
+class ProductInfoViewCatalogTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = Shop.objects.create(name='Test Shop', state=True)
+        self.category = Category.objects.create(name='Test Category')
+        product = Product.objects.create(name='Test Product', category=self.category)
+        self.product_info = ProductInfo.objects.create(shop=self.shop, product=product, model='Model',
+                                                       quantity=10, price=100, price_rrc=120, external_id=1)
+        ProductParameter.objects.create(product_info=self.product_info,
+                                        parameter=Parameter.objects.create(name='Цвет'), value='Красный')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_listing_matches_serializer(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('products'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [ProductInfoSerializer(self.product_info).data])
+
+    def test_inactive_shop_hidden_from_listing(self):
+        Shop.objects.filter(id=self.shop.id).update(state=False)
+        rebuild_catalog_for_shop(self.shop.id)
+        response = self.client.get(reverse('products'), {'category_id': self.category.id})
+        self.assertEqual(response.data, [])
+
+
+class BestOfferTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Test Category')
+        self.product = Product.objects.create(name='Test Product', category=self.category)
+        self.shops = [Shop.objects.create(name=f'Shop {i}', state=True) for i in range(3)]
+        self.offers = [
+            ProductInfo.objects.create(shop=shop, product=self.product, quantity=quantity, price=price,
+                                       price_rrc=200, external_id=1)
+            for shop, price, quantity in zip(self.shops, (150, 100, 50), (5, 5, 0))
+        ]
+
+    def tearDown(self):
+        cache.clear()
+
+    def best_offer_id(self):
+        return BestOffer.objects.get(product=self.product).offer_id
+
+    def test_cheapest_in_stock(self):
+        self.assertEqual(self.best_offer_id(), self.offers[1].id)
+
+    def test_price_change(self):
+        self.offers[0].price = 90
+        self.offers[0].save()
+        self.assertEqual(self.best_offer_id(), self.offers[0].id)
+
+        self.offers[2].quantity = 1
+        self.offers[2].save()
+        self.assertEqual(self.best_offer_id(), self.offers[2].id)
+
+    def test_shop_disabled(self):
+        user = User.objects.create_user(email='shop@example.com', password='password123', type='shop',
+                                        is_active=True)
+        Shop.objects.filter(id=self.shops[1].id).update(user=user)
+        self.client.force_authenticate(user=user)
+        response = self.client.post(reverse('partner-state'), {'state': 'off'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.best_offer_id(), self.offers[0].id)
+
+    def test_offer_deleted(self):
+        self.offers[1].delete()
+        self.assertEqual(self.best_offer_id(), self.offers[0].id)
+
+        self.offers[0].delete()
+        self.assertFalse(BestOffer.objects.exists())
+
+    def test_product_deleted(self):
+        self.product.delete()
+        self.assertFalse(BestOffer.objects.exists())
+
+    def test_listing_mode(self):
+        other = Product.objects.create(name='Other Product', category=Category.objects.create(name='Other'))
+        other_offer = ProductInfo.objects.create(shop=self.shops[0], product=other, quantity=1, price=10,
+                                                 price_rrc=20, external_id=2)
+
+        response = self.client.get(reverse('products'), {'mode': 'best'})
+        self.assertEqual([offer['id'] for offer in response.json()], [self.offers[1].id, other_offer.id])
+
+        response = self.client.get(reverse('products'), {'mode': 'best', 'category_id': self.category.id})
+        self.assertEqual(response.json(), [ProductInfoSerializer(self.offers[1]).data])
@@ -0,0 +1,172 @@
+import threading
+import time
+
+from backend.catalog import rebuild_catalog_for_shop, record_catalog_changes
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, CatalogChange
+from django.core.cache import cache
+from django.db.backends.base.operations import BaseDatabaseOperations
+from django.db import OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+class CatalogChangesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.shop = Shop.objects.create(name='Test Shop', state=True)
+        self.category = Category.objects.create(name='Категория')
+        self.parameter = Parameter.objects.create(name='Цвет')
+        self.product_infos = []
+        for i in range(3):
+            product = Product.objects.create(name=f'Товар {i}', category=self.category)
+            product_info = ProductInfo.objects.create(shop=self.shop, product=product, quantity=10, price=100 + i,
+                                                      price_rrc=120, external_id=i)
+            ProductParameter.objects.create(product_info=product_info, parameter=self.parameter, value='Красный')
+            self.product_infos.append(product_info)
+        self.token = self.client.get(reverse('catalog-changes')).json()['next']
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_changes(self, since, **params):
+        response = self.client.get(reverse('catalog-changes'), {'since': since, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_initial_token(self):
+        self.assertEqual(self.token, CatalogChange.objects.order_by('-id').first().id)
+        self.assertEqual(self.get_changes(self.token),
+                         {'next': self.token, 'has_more': False, 'upserted': [], 'deleted': []})
+
+    def test_full_history(self):
+        changes = self.get_changes(0)
+        self.assertEqual(changes['next'], self.token)
+        self.assertEqual(sorted(offer['id'] for offer in changes['upserted']),
+                         [product_info.id for product_info in self.product_infos])
+        self.assertEqual(changes['upserted'][0]['product_parameters'], [{'parameter': 'Цвет', 'value': 'Красный'}])
+
+    def test_updated(self):
+        product_info = self.product_infos[0]
+        product_info.price = 500
+        product_info.save()
+
+        changes = self.get_changes(self.token)
+        self.assertEqual([(offer['id'], offer['price']) for offer in changes['upserted']], [(product_info.id, 500)])
+        self.assertEqual(changes['deleted'], [])
+        self.assertEqual(self.get_changes(changes['next'])['upserted'], [])
+
+    def test_deleted(self):
+        product_info_id = self.product_infos[1].id
+        self.product_infos[1].delete()
+
+        changes = self.get_changes(self.token)
+        self.assertEqual(changes['upserted'], [])
+        self.assertEqual(changes['deleted'], [product_info_id])
+
+    def test_updated_then_deleted(self):
+        product_info = self.product_infos[0]
+        product_info.price = 500
+        product_info.save()
+        product_info_id = product_info.id
+        product_info.delete()
+
+        self.assertEqual(self.get_changes(self.token)['deleted'], [product_info_id])
+
+    def test_shop_disabled(self):
+        Shop.objects.filter(id=self.shop.id).update(state=False)
+        rebuild_catalog_for_shop(self.shop.id)
+
+        changes = self.get_changes(self.token)
+        self.assertEqual(changes['deleted'], [product_info.id for product_info in self.product_infos])
+
+    def test_unchanged_rebuild_not_recorded(self):
+        rebuild_catalog_for_shop(self.shop.id)
+        self.parameter.save()
+        self.assertEqual(CatalogChange.objects.filter(id__gt=self.token).count(), 0)
+
+    def test_parameter_changed(self):
+        self.parameter.name = 'Окрас'
+        self.parameter.save()
+
+        changes = self.get_changes(self.token, view='compact')
+        self.assertEqual(len(changes['upserted']), 3)
+        self.assertNotIn('product_parameters', changes['upserted'][0])
+        changes = self.get_changes(self.token)
+        self.assertEqual(changes['upserted'][0]['product_parameters'], [{'parameter': 'Окрас', 'value': 'Красный'}])
+
+    @override_settings(CATALOG_CHANGES_PAGE_SIZE=2)
+    def test_paging(self):
+        changes = self.get_changes(0, limit=100)
+        self.assertTrue(changes['has_more'])
+        pages, upserted = 1, {offer['id'] for offer in changes['upserted']}
+        while changes['has_more']:
+            changes = self.get_changes(changes['next'])
+            pages += 1
+            upserted.update(offer['id'] for offer in changes['upserted'])
+
+        self.assertEqual(pages, CatalogChange.objects.count() // 2)
+        self.assertEqual(upserted, {product_info.id for product_info in self.product_infos})
+        self.assertEqual(changes['next'], self.token)
+
+    def test_offer_id_column_fits_offer_ids(self):
+        # На SQLite все целые 64-битные, диапазоны столбцов сравниваем как на остальных базах
+        ranges = BaseDatabaseOperations.integer_field_ranges
+        column = CatalogChange._meta.get_field('product_info_id').get_internal_type()
+        self.assertGreaterEqual(ranges[column][1], ranges[ProductInfo._meta.pk.get_internal_type()][1])
+
+        change = CatalogChange(product_info_id=2 ** 40)
+        change.full_clean()
+        change.save()
+        self.assertEqual(CatalogChange.objects.get(id=change.id).product_info_id, 2 ** 40)
+
+    def test_invalid_token(self):
+        response = self.client.get(reverse('catalog-changes'), {'since': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CatalogChangesOrderTests(TransactionTestCase):
+    def test_changes_visible_in_id_order(self):
+        """
+        Короткая транзакция не фиксирует запись журнала раньше начатой до неё долгой:
+        иначе клиент получил бы токен больше id, который появится позже.
+        """
+        started, release, committed = threading.Event(), threading.Event(), threading.Event()
+
+        def long_transaction():
+            try:
+                with transaction.atomic():
+                    record_catalog_changes([1])
+                    started.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        def short_transaction():
+            try:
+                while True:
+                    try:
+                        with transaction.atomic():
+                            record_catalog_changes([2])
+                        committed.set()
+                        return
+                    except OperationalError:
+                        # SQLite в памяти отвечает на занятую блокировку ошибкой, повторяем
+                        time.sleep(0.01)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=long_transaction)]
+        threads[0].start()
+        self.assertTrue(started.wait(5))
+        threads.append(threading.Thread(target=short_transaction))
+        threads[1].start()
+        self.assertFalse(committed.wait(0.3))
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(committed.is_set())
+        self.assertEqual(list(CatalogChange.objects.order_by('id').values_list('product_info_id', flat=True)), [1, 2])
@@ -0,0 +1,73 @@
+from backend.catalog import rebuild_catalog_for_shop
+from backend.models import Shop, Category, Product, ProductInfo, CategoryStats
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+class CategoryStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = Shop.objects.create(name='Shop 1', state=True)
+        self.other_shop = Shop.objects.create(name='Shop 2', state=True)
+        self.phones = Category.objects.create(name='Смартфоны')
+        self.audio = Category.objects.create(name='Аудио')
+        self.empty = Category.objects.create(name='Пустая')
+        self.offers = []
+        for shop, category, price, quantity in ((self.shop, self.phones, 100, 5), (self.shop, self.phones, 300, 0),
+                                                (self.other_shop, self.phones, 50, 1),
+                                                (self.shop, self.audio, 20, 2)):
+            product = Product.objects.create(name=f'Товар {len(self.offers)}', category=category)
+            self.offers.append(ProductInfo.objects.create(shop=shop, product=product, quantity=quantity, price=price,
+                                                          price_rrc=price, external_id=len(self.offers)))
+
+    def tearDown(self):
+        cache.clear()
+
+    def stats(self, category):
+        return CategoryStats.objects.filter(category=category).values_list(
+            'offers_count', 'in_stock_count', 'min_price', 'max_price').first()
+
+    def test_maintained(self):
+        self.assertEqual(self.stats(self.phones), (3, 2, 50, 300))
+        self.assertEqual(self.stats(self.audio), (1, 1, 20, 20))
+        self.assertIsNone(self.stats(self.empty))
+
+    def test_offer_updated(self):
+        self.offers[1].quantity = 3
+        self.offers[1].price = 30
+        self.offers[1].save()
+        self.assertEqual(self.stats(self.phones), (3, 3, 30, 100))
+
+    def test_offer_deleted(self):
+        self.offers[3].delete()
+        self.assertIsNone(self.stats(self.audio))
+
+    def test_category_changed(self):
+        product = self.offers[0].product
+        product.category = self.audio
+        product.save()
+        self.assertEqual(self.stats(self.phones), (2, 1, 50, 300))
+        self.assertEqual(self.stats(self.audio), (2, 2, 20, 100))
+
+    def test_shop_state_changed(self):
+        Shop.objects.filter(id=self.shop.id).update(state=False)
+        rebuild_catalog_for_shop(self.shop.id)
+        self.assertEqual(self.stats(self.phones), (1, 1, 50, 50))
+        self.assertIsNone(self.stats(self.audio))
+
+    def test_view(self):
+        client = APIClient()
+        with self.assertNumQueries(1):
+            response = client.get(reverse('category-stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({category['name']: category for category in response.json()}, {
+            'Смартфоны': {'id': self.phones.id, 'name': 'Смартфоны', 'offers_count': 3, 'in_stock_count': 2,
+                          'min_price': 50, 'max_price': 300},
+            'Аудио': {'id': self.audio.id, 'name': 'Аудио', 'offers_count': 1, 'in_stock_count': 1,
+                      'min_price': 20, 'max_price': 20},
+            'Пустая': {'id': self.empty.id, 'name': 'Пустая', 'offers_count': 0, 'in_stock_count': 0,
+                       'min_price': None, 'max_price': None},
+        })
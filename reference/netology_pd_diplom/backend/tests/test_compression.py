@@ -0,0 +1,104 @@
+import gzip
+import json
+from unittest.mock import patch
+
+import zstandard
+from backend.compression import negotiate_encoding
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+class NegotiateEncodingTests(TestCase):
+    def negotiate(self, header):
+        return negotiate_encoding(RequestFactory().get('/', HTTP_ACCEPT_ENCODING=header))
+
+    def test_prefers_zstd(self):
+        self.assertEqual(self.negotiate('gzip, deflate, br, zstd'), 'zstd')
+
+    def test_quality_values(self):
+        self.assertEqual(self.negotiate('zstd;q=0.5, gzip'), 'gzip')
+        self.assertEqual(self.negotiate('gzip;q=0, *;q=0.1'), 'zstd')
+        self.assertIsNone(self.negotiate('br, identity'))
+        self.assertIsNone(self.negotiate(''))
+
+    def test_without_zstandard(self):
+        with patch('backend.compression.zstandard', None):
+            self.assertEqual(self.negotiate('zstd, gzip'), 'gzip')
+
+
+@override_settings(COMPRESSION_MIN_SIZE=100)
+class CompressionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        shop = Shop.objects.create(name='Test Shop', state=True)
+        category = Category.objects.create(name='Категория')
+        parameter = Parameter.objects.create(name='Цвет')
+        for i in range(20):
+            product = Product.objects.create(name=f'Товар {i}', category=category)
+            product_info = ProductInfo.objects.create(shop=shop, product=product, quantity=10, price=100 + i,
+                                                      price_rrc=120, external_id=i)
+            ProductParameter.objects.create(product_info=product_info, parameter=parameter, value='Красный')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_identity(self):
+        response = self.client.get(reverse('products'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_gzip(self):
+        expected = self.client.get(reverse('products')).json()
+        response = self.client.get(reverse('products'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content)), expected)
+
+    def test_zstd(self):
+        expected = self.client.get(reverse('products')).json()
+        response = self.client.get(reverse('products'), HTTP_ACCEPT_ENCODING='zstd')
+        self.assertEqual(response['Content-Encoding'], 'zstd')
+        body = zstandard.ZstdDecompressor().decompressobj().decompress(response.content)
+        self.assertEqual(json.loads(body), expected)
+
+    def test_precompressed_body_cached(self):
+        self.client.get(reverse('products'), HTTP_ACCEPT_ENCODING='gzip')
+        with patch('backend.cache.compress') as compress, self.assertNumQueries(0):
+            response = self.client.get(reverse('products'), HTTP_ACCEPT_ENCODING='gzip')
+        compress.assert_not_called()
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))), 20)
+
+    def test_etag_depends_on_encoding(self):
+        gzip_etag = self.client.get(reverse('products'), HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        zstd_etag = self.client.get(reverse('products'), HTTP_ACCEPT_ENCODING='zstd')['ETag']
+        self.assertNotEqual(gzip_etag, zstd_etag)
+
+        response = self.client.get(reverse('products'), HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=gzip_etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_small_response_not_compressed(self):
+        with override_settings(COMPRESSION_MIN_SIZE=10 ** 6):
+            response = self.client.get(reverse('products'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(len(response.json()), 20)
+
+    def test_middleware_compresses_stream(self):
+        response = self.client.get(reverse('products'), {'stream': 'true'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(b''.join(response.streaming_content)))), 20)
+
+    def test_middleware_compresses_other_views(self):
+        Category.objects.bulk_create(Category(name=f'Категория {i}') for i in range(20))
+        response = self.client.get(reverse('categories'), HTTP_ACCEPT_ENCODING='zstd')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Encoding'], 'zstd')
+        self.assertTrue(response['ETag'].startswith('W/'))
+        body = zstandard.ZstdDecompressor().decompressobj().decompress(response.content)
+        self.assertEqual(json.loads(body)['count'], 21)
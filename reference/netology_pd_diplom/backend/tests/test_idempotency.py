@@ -0,0 +1,122 @@
+from unittest import mock
+
+import msgpack
+from backend.models import Shop, Category, Product, ProductInfo, Order, OrderItem, Contact, User
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='buyer@example.com', password='password123', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        product = Product.objects.create(name='Смартфон', category=Category.objects.create(name='Смартфоны'))
+        self.product_info = ProductInfo.objects.create(shop=Shop.objects.create(name='Test Shop', state=True),
+                                                       product=product, quantity=10, price=100, price_rrc=120,
+                                                       external_id=1)
+
+    def tearDown(self):
+        cache.clear()
+
+    def add_to_basket(self, key, quantity=1, client=None, **extra):
+        return (client or self.client).post(reverse('basket'), {'items': [
+            {'product_info': self.product_info.id, 'quantity': quantity}]}, format='json',
+            HTTP_IDEMPOTENCY_KEY=key, **extra)
+
+    def quantities(self):
+        return list(OrderItem.objects.filter(order__state='basket').order_by('id').values_list('quantity', flat=True))
+
+    def test_basket_retry_replayed(self):
+        first = self.add_to_basket('retry-1')
+        with self.assertNumQueries(0):
+            second = self.add_to_basket('retry-1')
+        self.assertEqual(second.status_code, first.status_code)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.quantities(), [1])
+
+        self.add_to_basket('retry-2')
+        self.client.post(reverse('basket'), {'items': [{'product_info': self.product_info.id, 'quantity': 1}]},
+                         format='json')
+        self.assertEqual(self.quantities(), [3])
+
+    def test_replay_format_negotiated(self):
+        first = self.add_to_basket('retry-1', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(first['Content-Type'], 'application/msgpack')
+        second = self.add_to_basket('retry-1', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(second['Content-Type'], 'application/msgpack')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+
+        third = self.add_to_basket('retry-1')
+        self.assertEqual(third.json(), msgpack.unpackb(first.content, raw=False))
+        self.assertEqual(self.quantities(), [1])
+
+    @override_settings(BULK_MAX_BODY_SIZE=10)
+    def test_large_body_rejected_before_parsing(self):
+        with mock.patch('backend.idempotency._fingerprint') as fingerprint:
+            response = self.add_to_basket('retry-1')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        fingerprint.assert_not_called()
+
+    def test_key_reused_with_other_payload(self):
+        self.add_to_basket('retry-1')
+        response = self.add_to_basket('retry-1', quantity=5)
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(self.quantities(), [1])
+
+    def test_keys_scoped_by_user(self):
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(email='other@example.com', password='password123',
+                                                          is_active=True))
+        self.add_to_basket('retry-1')
+        response = self.add_to_basket('retry-1', client=other)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(self.quantities(), [1, 1])
+
+    def test_order_retry_replayed(self):
+        contact = Contact.objects.create(user=self.user, city='Москва', street='Ленина', phone='+79990000000')
+        self.add_to_basket('basket')
+        order = Order.objects.get(user=self.user, state='basket')
+        data = {'id': str(order.id), 'contact': contact.id}
+        with mock.patch('backend.views.new_order.send') as send:
+            first = self.client.post(reverse('order'), data, HTTP_IDEMPOTENCY_KEY='order-1')
+            second = self.client.post(reverse('order'), data, HTTP_IDEMPOTENCY_KEY='order-1')
+        self.assertEqual((first.status_code, second.status_code), (status.HTTP_200_OK, status.HTTP_200_OK))
+        self.assertEqual(send.call_count, 1)
+        self.product_info.refresh_from_db()
+        self.assertEqual(self.product_info.quantity, 9)
+
+    def test_failed_request_not_stored(self):
+        with mock.patch('backend.views.transaction.atomic', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.add_to_basket('retry-1')
+        self.assertEqual(self.add_to_basket('retry-1').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.quantities(), [1])
+
+    def test_in_progress_marker_expires_quickly(self):
+        with mock.patch('backend.idempotency.cache', wraps=cache) as wrapped:
+            self.add_to_basket('retry-1')
+        marker, timeout = wrapped.add.call_args.args[1:]
+        self.assertEqual(marker[0], 'in-progress')
+        self.assertEqual(timeout, settings.IDEMPOTENCY_LOCK_TIMEOUT)
+        self.assertLess(settings.IDEMPOTENCY_LOCK_TIMEOUT, settings.IDEMPOTENCY_TTL)
+        stored, timeout = wrapped.set.call_args.args[1:]
+        self.assertEqual(stored[0], 'done')
+        self.assertEqual(timeout, settings.IDEMPOTENCY_TTL)
+
+    def test_stale_marker_released(self):
+        # Запрос оборвался без очистки: метка истекает, и ключ можно использовать снова
+        with override_settings(IDEMPOTENCY_LOCK_TIMEOUT=-1), \
+                mock.patch('backend.idempotency.cache.delete'), \
+                mock.patch('backend.views.transaction.atomic', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.add_to_basket('retry-1')
+        self.assertEqual(self.add_to_basket('retry-1').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.quantities(), [1])
@@ -0,0 +1,74 @@
+import gzip
+
+import msgpack
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
+    Contact, User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+MSGPACK = 'application/msgpack'
+
+
+class MessagePackTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='shop@example.com', password='password123', type='shop',
+                                             is_active=True)
+        self.client.force_authenticate(user=self.user)
+        shop = Shop.objects.create(name='Test Shop', state=True, user=self.user)
+        product = Product.objects.create(name='Товар', category=Category.objects.create(name='Категория'))
+        product_info = ProductInfo.objects.create(shop=shop, product=product, quantity=10, price=100,
+                                                  price_rrc=120, external_id=1)
+        ProductParameter.objects.create(product_info=product_info, parameter=Parameter.objects.create(name='Цвет'),
+                                        value='Красный')
+        order = Order.objects.create(user=self.user, state='new')
+        OrderItem.objects.create(order=order, product_info=product_info, quantity=2)
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_msgpack(self, url, **kwargs):
+        response = self.client.get(url, HTTP_ACCEPT=MSGPACK, **kwargs)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], MSGPACK)
+        return msgpack.unpackb(response.content, raw=False)
+
+    def test_products(self):
+        self.assertEqual(self.get_msgpack(reverse('products')), self.client.get(reverse('products')).json())
+
+    def test_products_precompressed(self):
+        expected = self.client.get(reverse('products')).json()
+        with override_settings(COMPRESSION_MIN_SIZE=1):
+            response = self.client.get(reverse('products'), HTTP_ACCEPT=MSGPACK, HTTP_ACCEPT_ENCODING='gzip')
+            json_response = self.client.get(reverse('products'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Type'], MSGPACK)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertNotEqual(response['ETag'], json_response['ETag'])
+        self.assertEqual(msgpack.unpackb(gzip.decompress(response.content), raw=False), expected)
+
+    def test_orders(self):
+        self.assertEqual(self.get_msgpack(reverse('order')), self.client.get(reverse('order')).json())
+
+    def test_json_response_views(self):
+        expected = self.client.get(reverse('partner-orders')).json()
+        self.assertEqual(self.get_msgpack(reverse('partner-orders')), expected)
+
+    def test_json_preferred(self):
+        response = self.client.get(reverse('partner-orders'), HTTP_ACCEPT=f'application/json, {MSGPACK};q=0.5')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('Accept', response['Vary'])
+
+    def test_request_body(self):
+        data = {'city': 'Москва', 'street': 'Тверская', 'phone': '+79990000000'}
+        response = self.client.generic('POST', reverse('user-contact'), msgpack.packb(data), content_type=MSGPACK,
+                                       HTTP_ACCEPT=MSGPACK)
+        self.assertEqual(msgpack.unpackb(response.content), {'Status': True})
+        self.assertTrue(Contact.objects.filter(user=self.user, city='Москва').exists())
+
+    def test_invalid_request_body(self):
+        response = self.client.generic('POST', reverse('user-contact'), b'\xc1', content_type=MSGPACK)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,125 @@
+from io import StringIO
+from unittest import mock
+
+from backend.models import Shop, Category, Product, ProductInfo, Order, OrderItem, Contact, User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+class OrderSnapshotTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='buyer@example.com', password='password123', is_active=True)
+        self.contact = Contact.objects.create(user=self.user, city='Москва', street='Ленина', phone='+79990000000')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.shop = Shop.objects.create(name='Test Shop', state=True)
+        product = Product.objects.create(name='Смартфон', category=Category.objects.create(name='Смартфоны'))
+        self.product_info = ProductInfo.objects.create(shop=self.shop, product=product, model='x1', quantity=10,
+                                                       price=100, price_rrc=120, external_id=1)
+        self.order = Order.objects.create(user=self.user, state='basket')
+        OrderItem.objects.create(order=self.order, product_info=self.product_info, quantity=2)
+
+    def place_order(self):
+        with mock.patch('backend.views.new_order.send'):
+            return self.client.post(reverse('order'), {'id': str(self.order.id), 'contact': self.contact.id})
+
+    def test_snapshot_taken(self):
+        self.assertEqual(self.place_order().status_code, status.HTTP_200_OK)
+        item = OrderItem.objects.get(order=self.order)
+        self.assertEqual((item.price, item.product_name, item.model, item.shop_id),
+                         (100, 'Смартфон', 'x1', self.shop.id))
+
+    def test_history_independent_of_catalog(self):
+        self.place_order()
+        self.product_info.price = 500
+        self.product_info.model = 'x2'
+        self.product_info.save()
+        self.product_info.product.name = 'Телефон'
+        self.product_info.product.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('order'))
+        order = response.json()[0]
+        self.assertEqual(order['total_sum'], 200)
+        self.assertEqual(order['ordered_items'][0]['product_info'],
+                         {'id': self.product_info.id, 'name': 'Смартфон', 'model': 'x1', 'shop': self.shop.id,
+                          'price': 100})
+        self.assertFalse(any('backend_productinfo' in query['sql'] for query in queries))
+
+    def test_offer_deleted_after_checkout(self):
+        self.place_order()
+        basket = Order.objects.create(user=User.objects.create_user(email='other@example.com',
+                                                                    password='password123', is_active=True),
+                                      state='basket')
+        OrderItem.objects.create(order=basket, product_info=self.product_info, quantity=1)
+        self.product_info.delete()
+
+        # Оформленная позиция остаётся со снимком, из корзины предложение убирается
+        item = OrderItem.objects.get(order=self.order)
+        self.assertIsNone(item.product_info_id)
+        self.assertFalse(OrderItem.objects.filter(order=basket).exists())
+        basket.refresh_from_db()
+        self.assertEqual(basket.total_sum, 0)
+
+        order = self.client.get(reverse('order')).json()[0]
+        self.assertEqual(order['total_sum'], 200)
+        self.assertEqual(order['ordered_items'][0]['product_info'],
+                         {'id': None, 'name': 'Смартфон', 'model': 'x1', 'shop': self.shop.id, 'price': 100})
+
+    def test_partner_orders_after_offer_deleted(self):
+        partner = User.objects.create_user(email='shop@example.com', password='password123', type='shop',
+                                           is_active=True)
+        Shop.objects.filter(id=self.shop.id).update(user=partner)
+        # Позиция другого магазина в том же заказе в сумму партнёра не входит
+        other = ProductInfo.objects.create(shop=Shop.objects.create(name='Other Shop', state=True),
+                                           product=self.product_info.product, quantity=10, price=7, price_rrc=7,
+                                           external_id=2)
+        OrderItem.objects.create(order=self.order, product_info=other, quantity=1)
+        self.place_order()
+        self.product_info.price = 500
+        self.product_info.save()
+        self.product_info.delete()
+
+        client = APIClient()
+        client.force_authenticate(partner)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('partner-orders'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [{'id': self.order.id, 'user_id': self.user.id, 'total_sum': 200}])
+        self.assertFalse(any('backend_productparameter' in query['sql'] for query in queries))
+
+    def test_snapshot_not_overwritten(self):
+        self.place_order()
+        self.product_info.price = 500
+        self.product_info.save()
+        # Позиция без снимка в том же заказе, например созданная до появления снимков
+        other = ProductInfo.objects.create(shop=self.shop, product=self.product_info.product, quantity=10,
+                                           price=30, price_rrc=30, external_id=2)
+        OrderItem.objects.create(order=self.order, product_info=other, quantity=1)
+        other.delete()
+
+        self.assertEqual(sorted(OrderItem.objects.filter(order=self.order).values_list('price', flat=True)),
+                         [30, 100])
+
+    def test_offer_deleted_before_backfill(self):
+        Order.objects.filter(id=self.order.id).update(state='new')
+        self.product_info.delete()
+        item = OrderItem.objects.get(order=self.order)
+        self.assertEqual((item.product_info_id, item.price, item.product_name), (None, 100, 'Смартфон'))
+
+    def test_placed_order_not_placed_again(self):
+        self.place_order()
+        self.product_info.price = 500
+        self.product_info.save()
+        self.assertEqual(self.place_order().status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(OrderItem.objects.get(order=self.order).price, 100)
+
+    def test_backfill_command(self):
+        Order.objects.filter(id=self.order.id).update(state='new')
+        call_command('snapshot_order_items', stdout=StringIO())
+        self.assertEqual(OrderItem.objects.get(order=self.order).price, 100)
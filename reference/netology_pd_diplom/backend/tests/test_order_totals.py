@@ -0,0 +1,89 @@
+import json
+
+from backend.models import Shop, Category, Product, ProductInfo, Order, OrderItem, User
+from backend.orders import order_totals_deferred, refresh_order_totals
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+
+class OrderTotalsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='buyer@example.com', password='password123', is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        shop = Shop.objects.create(name='Test Shop', state=True)
+        category = Category.objects.create(name='Категория')
+        self.product_infos = []
+        for i, price in enumerate((100, 250, 40)):
+            product = Product.objects.create(name=f'Товар {i}', category=category)
+            self.product_infos.append(ProductInfo.objects.create(shop=shop, product=product, quantity=10,
+                                                                 price=price, price_rrc=price, external_id=i))
+
+    def totals(self, order):
+        order.refresh_from_db()
+        return order.total_sum, order.items_count
+
+    def test_item_signals(self):
+        order = Order.objects.create(user=self.user, state='basket')
+        item = OrderItem.objects.create(order=order, product_info=self.product_infos[0], quantity=2)
+        # Заказ, переданный при создании позиции, обновлён и в памяти
+        self.assertEqual((order.total_sum, order.items_count), (200, 1))
+
+        OrderItem.objects.create(order=order, product_info=self.product_infos[1], quantity=1)
+        self.assertEqual(self.totals(order), (450, 2))
+        item.quantity = 3
+        item.save()
+        self.assertEqual(self.totals(order), (550, 2))
+        item.delete()
+        self.assertEqual(self.totals(order), (250, 1))
+
+    def test_deferred(self):
+        order = Order.objects.create(user=self.user, state='basket')
+        for product_info in self.product_infos:
+            OrderItem.objects.create(order=order, product_info=product_info, quantity=1)
+        with CaptureQueriesContext(connection) as queries, order_totals_deferred():
+            OrderItem.objects.filter(order=order).delete()
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(self.totals(order), (0, 0))
+
+    def test_basket_endpoints(self):
+        self.client.post(reverse('basket'), {'items': [{'product_info': self.product_infos[0].id, 'quantity': 1},
+                                                       {'product_info': self.product_infos[2].id, 'quantity': 5}]},
+                         format='json')
+        basket = Order.objects.get(user=self.user, state='basket')
+        self.assertEqual(self.totals(basket), (300, 2))
+
+        item = OrderItem.objects.get(order=basket, product_info=self.product_infos[0])
+        self.client.put(reverse('basket'), {'items': json.dumps([{'id': item.id, 'quantity': 4}])}, format='json')
+        self.assertEqual(self.totals(basket), (600, 2))
+
+        self.client.delete(reverse('basket'), {'items': [item.id]}, format='json')
+        self.assertEqual(self.totals(basket), (200, 1))
+
+    def test_reprice_updates_baskets_only(self):
+        basket = Order.objects.create(user=self.user, state='basket')
+        placed = Order.objects.create(user=self.user, state='new')
+        for order in (basket, placed):
+            OrderItem.objects.create(order=order, product_info=self.product_infos[0], quantity=1)
+        self.product_infos[0].price = 120
+        self.product_infos[0].save()
+        self.assertEqual(self.totals(basket), (120, 1))
+        self.assertEqual(self.totals(placed), (100, 1))
+
+    def test_refresh(self):
+        order = Order.objects.create(user=self.user, state='new')
+        OrderItem.objects.bulk_create([OrderItem(order=order, product_info=self.product_infos[1], quantity=2)])
+        refresh_order_totals([order.id])
+        self.assertEqual(self.totals(order), (500, 1))
+
+    def test_listing_without_joins(self):
+        order = Order.objects.create(user=self.user, state='new')
+        OrderItem.objects.create(order=order, product_info=self.product_infos[0], quantity=2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('order'), {'fields': 'id,total_sum'})
+        self.assertEqual(response.json(), [{'id': order.id, 'total_sum': 200}])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('JOIN', queries[0]['sql'])
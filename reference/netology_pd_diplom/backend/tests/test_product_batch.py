@@ -0,0 +1,67 @@
+from backend.catalog import get_catalog_offer_rows
+from backend.models import Shop, Category, Product, ProductInfo
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+class ProductBatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.shop = Shop.objects.create(name='Test Shop', state=True)
+        category = Category.objects.create(name='Категория')
+        self.offers = []
+        for i in range(3):
+            product = Product.objects.create(name=f'Товар {i}', category=category)
+            self.offers.append(ProductInfo.objects.create(shop=self.shop, product=product, quantity=10,
+                                                          price=100 + i, price_rrc=120, external_id=i))
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_batch(self, ids, **params):
+        response = self.client.get(reverse('products-batch'), {'ids': ','.join(map(str, ids)), **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_order_and_missing(self):
+        ids = [self.offers[2].id, 0, self.offers[0].id, self.offers[2].id]
+        data = self.get_batch(ids, view='compact')
+        self.assertEqual([offer['id'] for offer in data], [self.offers[2].id, self.offers[0].id])
+        self.assertEqual(data[0], {'id': self.offers[2].id, 'name': 'Товар 2', 'model': '', 'shop': self.shop.id,
+                                   'price': 102})
+
+    def test_full_fields(self):
+        offer = self.get_batch([self.offers[0].id])[0]
+        self.assertEqual(offer['product'], {'name': 'Товар 0', 'category': 'Категория'})
+        self.assertEqual(offer['product_parameters'], [])
+
+    def test_cache(self):
+        ids = [offer.id for offer in self.offers]
+        with self.assertNumQueries(1):
+            get_catalog_offer_rows(ids[:2])
+        with self.assertNumQueries(1):
+            rows = get_catalog_offer_rows(ids)
+        self.assertEqual(set(rows), set(ids))
+        with self.assertNumQueries(0):
+            get_catalog_offer_rows(ids)
+
+    def test_invalidated(self):
+        self.get_batch([self.offers[0].id])
+        self.offers[0].price = 500
+        self.offers[0].save()
+        self.assertEqual(self.get_batch([self.offers[0].id])[0]['price'], 500)
+
+        Shop.objects.filter(id=self.shop.id).update(state=False)
+        self.shop.refresh_from_db()
+        self.shop.save()
+        self.assertEqual(self.get_batch([self.offers[0].id]), [])
+
+    @override_settings(PRODUCTS_BATCH_MAX_IDS=2)
+    def test_invalid(self):
+        for ids in ('', '1,x', '1,2,3'):
+            response = self.client.get(reverse('products-batch'), {'ids': ids})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
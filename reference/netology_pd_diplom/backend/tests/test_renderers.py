@@ -0,0 +1,71 @@
+import datetime
+import io
+import uuid
+from decimal import Decimal
+
+from backend.parsers import UJSONParser
+from backend.renderers import UJSONRenderer
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from django.utils.translation import gettext_lazy
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+
+class UJSONRendererTests(TestCase):
+    data = {
+        'id': 1,
+        'name': 'Смартфон / Apple',
+        'price': Decimal('100.50'),
+        'dt': datetime.datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=datetime.timezone.utc),
+        'date': datetime.date(2024, 1, 2),
+        'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'lazy': gettext_lazy('Заказ'),
+        'separator': 'a b',
+        'items': [{'parameter': 'Цвет', 'value': None}, True],
+    }
+
+    def test_matches_drf_renderer(self):
+        self.assertEqual(UJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+
+    def test_indent(self):
+        media_type = 'application/json; indent=4'
+        self.assertEqual(UJSONRenderer().render(self.data, media_type),
+                         JSONRenderer().render(self.data, media_type))
+
+    def test_none(self):
+        self.assertEqual(UJSONRenderer().render(None), b'')
+
+    def test_parser(self):
+        stream = io.BytesIO('{"items": [{"id": 1, "name": "Товар"}]}'.encode())
+        self.assertEqual(UJSONParser().parse(stream), {'items': [{'id': 1, 'name': 'Товар'}]})
+
+    def test_parser_error(self):
+        with self.assertRaises(ParseError):
+            UJSONParser().parse(io.BytesIO(b'{"items": '))
+
+
+class UJSONRendererViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        shop = Shop.objects.create(name='Test Shop', state=True)
+        product = Product.objects.create(name='Товар', category=Category.objects.create(name='Категория'))
+        product_info = ProductInfo.objects.create(shop=shop, product=product, quantity=10, price=100,
+                                                  price_rrc=120, external_id=1)
+        ProductParameter.objects.create(product_info=product_info, parameter=Parameter.objects.create(name='Цвет'),
+                                        value='Красный')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_listing_rendered(self):
+        response = self.client.get(reverse('products'), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('Товар'.encode(), response.content)
+        self.assertEqual(response.content, JSONRenderer().render(response.json()))
@@ -0,0 +1,137 @@
+from unittest import mock, skipUnless
+
+from backend.catalog import rebuild_catalog_for_shop
+from backend.models import Shop, Category, Product, ProductInfo, ProductTrigram
+from backend.search import rebuild_search_index, search_offer_ids, trigrams, word_similarity
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import CharField
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+class TrigramTests(TestCase):
+    def test_trigrams(self):
+        self.assertEqual(trigrams('Кот'), {'  к', ' ко', 'кот', 'от '})
+        self.assertEqual(trigrams('Ёж, ёж'), {'  е', ' еж', 'еж '})
+        self.assertEqual(trigrams('!!'), set())
+
+    def test_word_similarity(self):
+        self.assertEqual(word_similarity('iphone', 'Смартфон Apple iPhone XR'), 1.0)
+        self.assertGreater(word_similarity('iphon', 'Смартфон Apple iPhone XR'), 0.5)
+        self.assertLess(word_similarity('galaxy', 'Смартфон Apple iPhone XR'), 0.3)
+
+
+class TrigramSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = Shop.objects.create(name='Test Shop', state=True)
+        category = Category.objects.create(name='Смартфоны')
+        self.offers = {}
+        for name, model in (('Смартфон Apple iPhone XR', 'apple/iphone/xr'),
+                            ('Смартфон Samsung Galaxy S9', 'samsung/galaxy/s9'),
+                            ('Наушники Sony', 'sony/wh-1000xm4')):
+            product = Product.objects.create(name=name, category=category)
+            self.offers[name] = ProductInfo.objects.create(shop=self.shop, product=product, model=model, quantity=10,
+                                                           price=100, price_rrc=120, external_id=len(self.offers))
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_typos(self):
+        self.assertEqual(search_offer_ids('iphon', 10), [self.offers['Смартфон Apple iPhone XR'].id])
+        self.assertEqual(search_offer_ids('наушнеки', 10), [self.offers['Наушники Sony'].id])
+        self.assertEqual(search_offer_ids('galaxi s9', 10), [self.offers['Смартфон Samsung Galaxy S9'].id])
+
+    def test_ranking(self):
+        ids = search_offer_ids('смартфон', 10)
+        self.assertEqual(set(ids), {self.offers['Смартфон Apple iPhone XR'].id,
+                                    self.offers['Смартфон Samsung Galaxy S9'].id})
+        self.assertEqual(search_offer_ids('смартфон', 1), ids[:1])
+
+    def test_no_match(self):
+        self.assertEqual(search_offer_ids('холодильник', 10), [])
+        self.assertEqual(search_offer_ids('', 10), [])
+
+    def test_index_maintained(self):
+        offer = self.offers['Наушники Sony']
+        offer.product.name = 'Колонка Sony'
+        offer.product.save()
+        self.assertEqual(search_offer_ids('колонка', 10), [offer.id])
+        self.assertEqual(search_offer_ids('наушники', 10), [])
+
+        offer.delete()
+        self.assertFalse(ProductTrigram.objects.filter(product_info_id=offer.id).exists())
+
+    def test_unchanged_text_not_reindexed(self):
+        trigram_ids = set(ProductTrigram.objects.values_list('id', flat=True))
+        offer = self.offers['Наушники Sony']
+        offer.price = 50
+        offer.save()
+        rebuild_catalog_for_shop(self.shop.id)
+        self.assertEqual(set(ProductTrigram.objects.values_list('id', flat=True)), trigram_ids)
+
+    def test_inactive_shop_removed(self):
+        Shop.objects.filter(id=self.shop.id).update(state=False)
+        rebuild_catalog_for_shop(self.shop.id)
+        self.assertFalse(ProductTrigram.objects.exists())
+
+    def test_rebuild(self):
+        ProductTrigram.objects.all().delete()
+        rebuild_search_index()
+        self.assertEqual(search_offer_ids('iphon', 10), [self.offers['Смартфон Apple iPhone XR'].id])
+
+    @override_settings(SEARCH_CANDIDATES=1)
+    def test_candidates_bounded(self):
+        self.assertEqual(len(search_offer_ids('смартфон', 10)), 1)
+
+    @override_settings(SEARCH_TRIGRAM_POSTINGS=1)
+    def test_frequent_trigrams_dropped(self):
+        samsung = self.offers['Смартфон Samsung Galaxy S9'].id
+        # Триграммы "смартфон" есть у двух предложений и не учитываются при наличии более редких
+        with self.assertNumQueries(len(trigrams('смартфон samsung')) + 1):
+            self.assertEqual(search_offer_ids('смартфон samsung', 10), [samsung])
+        # Если все триграммы частые, кандидаты берутся из первых записей каждой
+        self.assertEqual(len(search_offer_ids('смартфон', 10)), 1)
+
+    def test_view(self):
+        response = APIClient().get(reverse('products-search'), {'q': 'samsung galaxi', 'view': 'compact'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([offer['name'] for offer in response.json()], ['Смартфон Samsung Galaxy S9'])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Поиск через pg_trgm только на PostgreSQL')
+class PgTrgmSearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        super().setUpClass()
+
+    def setUp(self):
+        cache.clear()
+        shop = Shop.objects.create(name='Test Shop', state=True)
+        category = Category.objects.create(name='Смартфоны')
+        self.iphone, self.galaxy = (
+            ProductInfo.objects.create(shop=shop, product=Product.objects.create(name=name, category=category),
+                                       model=model, quantity=10, price=100, price_rrc=120, external_id=external_id)
+            for external_id, (name, model) in enumerate((('Смартфон Apple iPhone XR', 'apple/iphone/xr'),
+                                                         ('Смартфон Samsung Galaxy S9', 'samsung/galaxy/s9'))))
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_search(self):
+        self.assertEqual(search_offer_ids('iphon', 10), [self.iphone.id])
+        self.assertEqual(search_offer_ids('galaxi s9', 10), [self.galaxy.id])
+        self.assertEqual(search_offer_ids('холодильник', 10), [])
+        # Собственный индекс триграмм на PostgreSQL не ведётся
+        self.assertFalse(ProductTrigram.objects.exists())
+
+    def test_lookup_registered_once(self):
+        self.assertIn('trigram_word_similar', CharField.get_lookups())
+        with mock.patch.object(CharField, 'register_lookup') as register_lookup:
+            search_offer_ids('смартфон', 10)
+        register_lookup.assert_not_called()
@@ -1,9 +1,15 @@
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
-from backend.models import User, Contact, Category, Shop, Product, ProductInfo, ProductParameter, Order, OrderItem
+from rest_framework.renderers import JSONRenderer
+from backend.catalog import catalog_sync_paused
+from backend.models import User, Contact, Category, Shop, Product, ProductInfo, ProductParameter, Order, OrderItem, \
+    Parameter
 from backend.serializers import (
     ContactSerializer, UserSerializer, CategorySerializer, ShopSerializer,
     ProductSerializer, ProductParameterSerializer, ProductInfoSerializer,
-    OrderItemSerializer, OrderSerializer
+    OrderItemSerializer, OrderSerializer, serialize_product_infos
 )
 
 
@@ -181,3 +187,45 @@ class OrderSerializerTest(TestCase):
         Проверяем, что поле 'contact' является read-only.
         """
         self.assertTrue(self.serializer.fields["contact"].read_only)
+
+
+class FastProductInfoSerializationTest(TestCase):
+    OFFERS_COUNT = 200
+
+    def setUp(self):
+        # Витрина для этих тестов не нужна, отключаем её поддержку
+        with catalog_sync_paused():
+            shops = [Shop.objects.create(name=f"Магазин {i}") for i in range(2)]
+            categories = [Category.objects.create(name=f"Категория {i}") for i in range(3)]
+            parameters = [Parameter.objects.create(name=f"Параметр «{i}»") for i in range(5)]
+            for i in range(self.OFFERS_COUNT):
+                product = Product.objects.create(name=f"Смартфон {i}", category=categories[i % len(categories)])
+                product_info = ProductInfo.objects.create(
+                    product=product, shop=shops[i % len(shops)], model=f"model/{i}", external_id=i,
+                    quantity=i, price=100 + i, price_rrc=120 + i,
+                )
+                # Часть предложений без параметров
+                for parameter in parameters[:i % (len(parameters) + 1)]:
+                    ProductParameter.objects.create(product_info=product_info, parameter=parameter,
+                                                    value=f"значение {i}")
+
+    def get_queryset(self):
+        return ProductInfo.objects.select_related('product__category').prefetch_related(
+            'product_parameters__parameter').order_by('id')
+
+    def test_output_is_byte_identical(self):
+        renderer = JSONRenderer()
+        expected = renderer.render(ProductInfoSerializer(self.get_queryset(), many=True).data)
+        actual = renderer.render(serialize_product_infos(self.get_queryset()))
+        self.assertEqual(actual, expected)
+
+    def test_query_count(self):
+        with self.assertNumQueries(2):
+            serialize_product_infos(self.get_queryset())
+
+    def test_benchmark_command(self):
+        # Время только выводится, сравнение скоростей в тестах нестабильно
+        stdout = StringIO()
+        call_command('benchmark_serializers', limit=10, repeat=1, stdout=stdout)
+        self.assertIn('Предложений: 10', stdout.getvalue())
+        self.assertIn('serialize_product_infos:', stdout.getvalue())
@@ -0,0 +1,145 @@
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter
+from backend.similar import ONE_HOT_WEIGHT, SimilarityIndex, build_similarity_index, encode_offers, \
+    get_similarity_index, similar_offer_ids
+from backend.tasks import rebuild_similarity_indexes
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+class EncodeOffersTests(TestCase):
+    def test_features(self):
+        ids, matrix = encode_offers([
+            (1, 100, [{'parameter': 'Цвет', 'value': 'черный'}, {'parameter': 'Память', 'value': '64'}]),
+            (2, 1000, [{'parameter': 'Цвет', 'value': 'белый'}, {'parameter': 'Память', 'value': '256'}]),
+            (3, 100, [{'parameter': 'Цвет', 'value': 'черный'}]),
+        ])
+        self.assertEqual(ids.tolist(), [1, 2, 3])
+        self.assertEqual(matrix.dtype, np.float32)
+        # Память (числовой, пропуск - среднее), Цвет: черный, белый; цена
+        np.testing.assert_allclose(matrix, [[0, ONE_HOT_WEIGHT, 0, 0],
+                                            [1, 0, ONE_HOT_WEIGHT, 1],
+                                            [0.5, ONE_HOT_WEIGHT, 0, 0]], atol=1e-6)
+
+    @override_settings(SIMILAR_MAX_VALUES=1)
+    def test_rare_values_dropped(self):
+        _, matrix = encode_offers([(1, 10, [{'parameter': 'Цвет', 'value': 'черный'}]),
+                                   (2, 10, [{'parameter': 'Цвет', 'value': 'черный'}]),
+                                   (3, 10, [{'parameter': 'Цвет', 'value': 'белый'}])])
+        self.assertEqual(matrix.shape, (3, 2))
+
+    def test_empty(self):
+        ids, matrix = encode_offers([])
+        self.assertEqual((ids.shape, matrix.shape), ((0,), (0, 0)))
+
+
+class SimilarProductsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(SIMILAR_INDEX_DIR=self.directory)
+        self.settings_override.enable()
+
+        self.shop = Shop.objects.create(name='Test Shop', state=True)
+        self.category = Category.objects.create(name='Смартфоны')
+        color, memory = Parameter.objects.create(name='Цвет'), Parameter.objects.create(name='Память')
+        self.offers = {}
+        for name, price, color_value, memory_value in (('iPhone 64 черный', 100, 'черный', '64'),
+                                                        ('iPhone 64 белый', 100, 'белый', '64'),
+                                                        ('iPhone 128 черный', 120, 'черный', '128'),
+                                                        ('iPhone 512 белый', 300, 'белый', '512')):
+            product = Product.objects.create(name=name, category=self.category)
+            product_info = ProductInfo.objects.create(shop=self.shop, product=product, quantity=10, price=price,
+                                                      price_rrc=price, external_id=len(self.offers))
+            ProductParameter.objects.create(product_info=product_info, parameter=color, value=color_value)
+            ProductParameter.objects.create(product_info=product_info, parameter=memory, value=memory_value)
+            self.offers[name] = product_info.id
+
+        other = Product.objects.create(name='Наушники', category=Category.objects.create(name='Аудио'))
+        self.other = ProductInfo.objects.create(shop=self.shop, product=other, quantity=10, price=100,
+                                                price_rrc=100, external_id=100)
+        build_similarity_index(self.category.id)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+        cache.clear()
+
+    def test_nearest(self):
+        result = similar_offer_ids(self.category.id, [self.offers['iPhone 64 черный']], 10)
+        self.assertEqual(result[self.offers['iPhone 64 черный']],
+                         [self.offers['iPhone 128 черный'], self.offers['iPhone 64 белый'],
+                          self.offers['iPhone 512 белый']])
+
+    @override_settings(SIMILAR_BATCH_SIZE=1)
+    def test_batch(self):
+        ids = list(self.offers.values())
+        result = similar_offer_ids(self.category.id, ids, 1)
+        self.assertEqual(result[self.offers['iPhone 64 черный']], [self.offers['iPhone 128 черный']])
+        self.assertEqual(result[self.offers['iPhone 512 белый']], [self.offers['iPhone 64 белый']])
+        self.assertTrue(all(len(neighbours) == 1 for neighbours in result.values()))
+
+    def test_index_cached_and_reloaded(self):
+        index = get_similarity_index(self.category.id)
+        self.assertIs(get_similarity_index(self.category.id), index)
+        build_similarity_index(self.category.id)
+        self.assertIsNot(get_similarity_index(self.category.id), index)
+
+    def test_new_offer_scheduled(self):
+        product = Product.objects.create(name='iPhone 64 черный 2', category=self.category)
+        product_info = ProductInfo.objects.create(shop=self.shop, product=product, quantity=1, price=100,
+                                                  price_rrc=100, external_id=200)
+        # Предложения ещё нет в матрице: пустой ответ без пересборки в запросе, сборка ставится в очередь один раз
+        with mock.patch('backend.tasks.rebuild_similarity_indexes.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                for _ in range(2):
+                    self.assertEqual(similar_offer_ids(self.category.id, [product_info.id], 10),
+                                     {product_info.id: []})
+        delay.assert_called_once_with([self.category.id])
+
+        rebuild_similarity_indexes([self.category.id])
+        self.assertEqual(len(similar_offer_ids(self.category.id, [product_info.id], 10)[product_info.id]), 4)
+
+    def test_missing_index(self):
+        category_id = self.other.product.category_id
+        self.assertIsNone(get_similarity_index(category_id))
+        with mock.patch('backend.tasks.rebuild_similarity_indexes.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(similar_offer_ids(category_id, [self.other.id], 10), {self.other.id: []})
+        delay.assert_called_once_with([category_id])
+
+    def test_nearest_without_positions(self):
+        index = get_similarity_index(self.category.id)
+        self.assertEqual(index.nearest([], 10).shape, (0, 0))
+
+    def test_large_category(self):
+        rng = np.random.default_rng(0)
+        index = SimilarityIndex.__new__(SimilarityIndex)
+        index.ids = np.arange(100_000, dtype=np.int64)
+        index.matrix = rng.random((100_000, 40), dtype=np.float32)
+        index.norms = np.einsum('ij,ij->i', index.matrix, index.matrix)
+        neighbours = index.nearest([0, 1], 5)
+        expected = np.argsort(((index.matrix - index.matrix[0]) ** 2).sum(axis=1))[1:6]
+        self.assertEqual(neighbours[0].tolist(), expected.tolist())
+
+    def test_view(self):
+        client = APIClient()
+        response = client.get(reverse('products-similar', args=[self.offers['iPhone 512 белый']]),
+                              {'limit': 2, 'view': 'compact'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([offer['name'] for offer in response.json()], ['iPhone 64 белый', 'iPhone 128 черный'])
+
+        response = client.get(reverse('products-similar', args=[self.other.id]))
+        self.assertEqual(response.json(), [])
+
+        response = client.get(reverse('products-similar', args=[0]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = client.get(reverse('products-similar', args=[self.other.id]), {'limit': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
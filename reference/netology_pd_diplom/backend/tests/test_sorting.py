@@ -0,0 +1,166 @@
+from unittest import mock
+
+from backend.cache import bump_catalog_version
+from backend.catalog import decode_cursor, encode_cursor
+from backend.models import Shop, Category, Product, ProductInfo, Order, OrderItem, Contact, User, CatalogOffer, \
+    ProductToken
+from backend.search import bm25_scores, rebuild_search_index
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+class CursorTests(TestCase):
+    def test_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor([100, 5]), 2), [100, 5])
+        self.assertEqual(decode_cursor(encode_cursor([1.25, 5]), 2), [1.25, 5])
+
+    def test_invalid(self):
+        for cursor in ('abc', encode_cursor([1]), encode_cursor(['x', 1]), encode_cursor({'a': 1})):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor, 2)
+
+
+class SortingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.shop = Shop.objects.create(name='Test Shop', state=True)
+        self.category = Category.objects.create(name='Смартфоны')
+        self.offers = {}
+        for name, price in (('Смартфон Apple iPhone XR', 300), ('Смартфон Samsung Galaxy S9', 200),
+                            ('Чехол для смартфона', 50), ('Наушники Apple AirPods', 200)):
+            product = Product.objects.create(name=name, category=self.category)
+            self.offers[name] = ProductInfo.objects.create(shop=self.shop, product=product, quantity=10, price=price,
+                                                           price_rrc=price, external_id=len(self.offers))
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_products(self, **params):
+        response = self.client.get(reverse('products'), {'view': 'compact', **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def get_all_pages(self, **params):
+        page = self.get_products(limit=1, **params)
+        names = [offer['name'] for offer in page['results']]
+        while page['next']:
+            page = self.get_products(limit=1, cursor=page['next'], **params)
+            names.extend(offer['name'] for offer in page['results'])
+        return names
+
+    def test_price(self):
+        self.assertEqual(self.get_all_pages(sort='price_asc'),
+                         ['Чехол для смартфона', 'Смартфон Samsung Galaxy S9', 'Наушники Apple AirPods',
+                          'Смартфон Apple iPhone XR'])
+        self.assertEqual(self.get_all_pages(sort='price_desc'),
+                         ['Смартфон Apple iPhone XR', 'Наушники Apple AirPods', 'Смартфон Samsung Galaxy S9',
+                          'Чехол для смартфона'])
+
+    def test_newest(self):
+        self.assertEqual(self.get_all_pages(sort='newest'), list(reversed(self.offers)))
+
+    def test_page(self):
+        page = self.get_products(sort='price_asc', limit=3)
+        self.assertEqual(len(page['results']), 3)
+        self.assertIsNotNone(page['next'])
+        page = self.get_products(sort='price_asc', limit=3, cursor=page['next'])
+        self.assertEqual([offer['name'] for offer in page['results']], ['Смартфон Apple iPhone XR'])
+        self.assertIsNone(page['next'])
+
+    def test_keyset_query_count(self):
+        page = self.get_products(sort='price_asc', limit=2)
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.get_products(sort='price_asc', limit=2, cursor=page['next'])
+
+    def test_popularity(self):
+        user = User.objects.create_user(email='buyer@example.com', password='password123', is_active=True)
+        contact = Contact.objects.create(user=user, city='Москва', street='Ленина', phone='+79990000000')
+        order = Order.objects.create(user=user, state='basket')
+        OrderItem.objects.create(order=order, product_info=self.offers['Чехол для смартфона'], quantity=3)
+        self.client.force_authenticate(user)
+        response = self.client.post(reverse('order'), {'id': str(order.id), 'contact': contact.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(CatalogOffer.objects.get(product_info=self.offers['Чехол для смартфона']).popularity, 3)
+        self.assertEqual(self.get_products(sort='popularity')['results'][0]['name'], 'Чехол для смартфона')
+
+        # При пересборке строки популярность считается по заказам
+        self.offers['Чехол для смартфона'].save()
+        self.assertEqual(CatalogOffer.objects.get(product_info=self.offers['Чехол для смартфона']).popularity, 3)
+
+    def test_query_filter(self):
+        self.assertEqual(self.get_all_pages(q='apple', sort='price_asc'),
+                         ['Наушники Apple AirPods', 'Смартфон Apple iPhone XR'])
+
+    def test_relevance(self):
+        names = self.get_all_pages(q='смартфон apple')
+        self.assertEqual(names[0], 'Смартфон Apple iPhone XR')
+        self.assertEqual(set(names), {'Смартфон Apple iPhone XR', 'Смартфон Samsung Galaxy S9',
+                                      'Наушники Apple AirPods'})
+        self.assertEqual(self.get_products(q='холодильник'), {'results': [], 'next': None})
+
+    def test_relevance_ranked_once(self):
+        # Порядок считается один раз на запрос и версию каталога, страницы берутся из него
+        with mock.patch('backend.views.bm25_scores', wraps=bm25_scores) as scores:
+            names = self.get_all_pages(q='смартфон apple')
+        self.assertEqual(len(names), 3)
+        self.assertEqual(scores.call_count, 1)
+
+        bump_catalog_version()
+        with mock.patch('backend.views.bm25_scores', wraps=bm25_scores) as scores:
+            self.get_products(q='смартфон apple', limit=1)
+        self.assertEqual(scores.call_count, 1)
+
+    @override_settings(SEARCH_RELEVANCE_MAX_RESULTS=2)
+    def test_relevance_bounded(self):
+        self.assertEqual(self.get_all_pages(q='смартфон apple'),
+                         ['Смартфон Apple iPhone XR', 'Наушники Apple AirPods'])
+
+    def test_plain_list_unchanged(self):
+        self.assertIsInstance(self.get_products(), list)
+
+    def test_invalid_params(self):
+        for params in ({'sort': 'name'}, {'sort': 'relevance'}, {'sort': 'price_asc', 'cursor': 'abc'},
+                       {'sort': 'price_asc', 'limit': 'x'}):
+            response = self.client.get(reverse('products'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(CATALOG_MAX_PAGE_SIZE=2)
+    def test_limit_capped(self):
+        self.assertEqual(len(self.get_products(sort='newest', limit=100)['results']), 2)
+
+
+class BM25Tests(TestCase):
+    def setUp(self):
+        cache.clear()
+        shop = Shop.objects.create(name='Test Shop', state=True)
+        category = Category.objects.create(name='Категория')
+        self.offers = []
+        for name in ('Кабель USB', 'Кабель USB USB длинный', 'Зарядка USB Type-C с кабелем в комплекте'):
+            product = Product.objects.create(name=name, category=category)
+            self.offers.append(ProductInfo.objects.create(shop=shop, product=product, quantity=1, price=10,
+                                                          price_rrc=10, external_id=len(self.offers)))
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_tokens_indexed(self):
+        token = ProductToken.objects.get(product_info=self.offers[1], token='usb')
+        self.assertEqual((token.tf, token.length), (2, 4))
+
+    def test_scores(self):
+        scores = bm25_scores('кабель usb')
+        self.assertEqual(set(scores), {offer.id for offer in self.offers[:2]} | {self.offers[2].id})
+        # Короткий текст с обоими словами выше длинного, где совпало одно
+        self.assertGreater(scores[self.offers[0].id], scores[self.offers[2].id])
+        self.assertEqual(bm25_scores(''), {})
+
+    def test_rebuild(self):
+        ProductToken.objects.all().delete()
+        rebuild_search_index()
+        self.assertEqual(set(bm25_scores('длинный')), {self.offers[1].id})
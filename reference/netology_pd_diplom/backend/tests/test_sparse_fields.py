@@ -0,0 +1,78 @@
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, User
+from backend.orders import snapshot_order_items
+from backend.serializers import ProductInfoSerializer, OrderSerializer
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='buyer@example.com', password='password123', is_active=True)
+        self.client.force_authenticate(user=self.user)
+        shop = Shop.objects.create(name='Test Shop', state=True)
+        category = Category.objects.create(name='Категория')
+        product = Product.objects.create(name='Товар', category=category)
+        self.product_info = ProductInfo.objects.create(shop=shop, product=product, model='Model', quantity=10,
+                                                       price=100, price_rrc=120, external_id=1)
+        ProductParameter.objects.create(product_info=self.product_info,
+                                        parameter=Parameter.objects.create(name='Цвет'), value='Красный')
+        self.order = Order.objects.create(user=self.user, state='new')
+        OrderItem.objects.create(order=self.order, product_info=self.product_info, quantity=2)
+        snapshot_order_items([self.order.id])
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_products_compact(self):
+        response = self.client.get(reverse('products'), {'view': 'compact'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [
+            {'id': self.product_info.id, 'name': 'Товар', 'model': 'Model', 'shop': self.product_info.shop_id,
+             'price': 100}])
+
+    def test_products_fields(self):
+        response = self.client.get(reverse('products'), {'fields': 'price,id,unknown'})
+        self.assertEqual(response.json(), [{'id': self.product_info.id, 'price': 100}])
+
+    def test_only_unknown_fields(self):
+        # Без известных полей ?fields= не учитывается одинаково для товаров, заказов и корзины
+        response = self.client.get(reverse('products'), {'fields': 'foo,bar'})
+        self.assertEqual(response.data, [ProductInfoSerializer(self.product_info).data])
+        response = self.client.get(reverse('products'), {'fields': 'foo', 'view': 'compact'})
+        self.assertEqual(set(response.json()[0]), {'id', 'name', 'model', 'shop', 'price'})
+
+        response = self.client.get(reverse('order'), {'fields': 'foo,bar'})
+        self.assertEqual(set(response.json()[0]), set(OrderSerializer.Meta.fields))
+
+        Order.objects.create(user=self.user, state='basket')
+        response = self.client.get(reverse('basket'), {'fields': 'foo'})
+        self.assertIn('version', response.json()[0])
+
+    def test_products_full_by_default(self):
+        response = self.client.get(reverse('products'))
+        self.assertEqual(response.data, [ProductInfoSerializer(self.product_info).data])
+
+    def test_orders_fields(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('order'), {'fields': 'id,state'})
+        self.assertEqual(response.json(), [{'id': self.order.id, 'state': 'new'}])
+
+    def test_orders_compact(self):
+        # заказы и позиции со снимком предложений - каталог не читается
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('order'), {'view': 'compact'})
+        order = response.json()[0]
+        self.assertEqual(order['total_sum'], 200)
+        self.assertEqual(order['ordered_items'][0]['product_info'], {
+            'id': self.product_info.id, 'name': 'Товар', 'model': 'Model', 'shop': self.product_info.shop_id,
+            'price': 100})
+
+    def test_orders_full_by_default(self):
+        response = self.client.get(reverse('order'))
+        self.assertEqual(response.json()[0]['ordered_items'][0]['product_info']['name'], 'Товар')
+        self.assertEqual(set(response.json()[0]), set(OrderSerializer.Meta.fields))
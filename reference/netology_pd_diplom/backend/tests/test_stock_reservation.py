@@ -0,0 +1,156 @@
+import random
+import threading
+import time
+from unittest import mock
+
+from backend.cache import get_catalog_version
+from backend.models import Shop, Category, Product, ProductInfo, Order, OrderItem, Contact, User, CatalogOffer, \
+    BestOffer, CatalogChange, CategoryStats
+from backend.views import OrderView
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+def create_buyer(index):
+    user = User.objects.create_user(email=f'buyer{index}@example.com', password='password123', is_active=True)
+    contact = Contact.objects.create(user=user, city='Москва', street='Ленина', phone='+79990000000')
+    return user, contact, Order.objects.create(user=user, state='basket')
+
+
+def place_order(user, contact, order):
+    client = APIClient()
+    client.force_authenticate(user)
+    with mock.patch('backend.views.new_order.send'):
+        return client.post(reverse('order'), {'id': str(order.id), 'contact': contact.id})
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        shop = Shop.objects.create(name='Test Shop', state=True)
+        category = Category.objects.create(name='Категория')
+        self.product_infos = []
+        for i, quantity in enumerate((5, 2)):
+            product = Product.objects.create(name=f'Товар {i}', category=category)
+            self.product_infos.append(ProductInfo.objects.create(shop=shop, product=product, quantity=quantity,
+                                                                 price=10, price_rrc=10, external_id=i))
+        self.user, self.contact, self.order = create_buyer(0)
+
+    def stock(self):
+        return [ProductInfo.objects.get(id=product_info.id).quantity for product_info in self.product_infos]
+
+    def test_stock_reserved(self):
+        OrderItem.objects.create(order=self.order, product_info=self.product_infos[0], quantity=3)
+        OrderItem.objects.create(order=self.order, product_info=self.product_infos[1], quantity=2)
+        response = place_order(self.user, self.contact, self.order)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.stock(), [2, 0])
+        self.assertEqual(CatalogOffer.objects.get(product_info=self.product_infos[0]).quantity, 2)
+
+    def test_catalog_updated_in_place(self):
+        OrderItem.objects.create(order=self.order, product_info=self.product_infos[0], quantity=3)
+        OrderItem.objects.create(order=self.order, product_info=self.product_infos[1], quantity=2)
+        version, change_id = get_catalog_version(), CatalogChange.objects.order_by('id').last().id
+
+        with self.captureOnCommitCallbacks() as callbacks, \
+                mock.patch('backend.catalog._replace_offers') as replace_offers:
+            self.assertEqual(place_order(self.user, self.contact, self.order).status_code, status.HTTP_200_OK)
+        # Строки витрины не пересобираются, журнал, сводки и версия каталога ждут фиксации
+        replace_offers.assert_not_called()
+        self.assertEqual(list(CatalogOffer.objects.order_by('product_info_id').values_list(
+            'quantity', 'popularity')), [(2, 3), (0, 2)])
+        self.assertFalse(CatalogChange.objects.filter(id__gt=change_id).exists())
+        self.assertEqual(CategoryStats.objects.get().in_stock_count, 2)
+        self.assertEqual(get_catalog_version(), version)
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(get_catalog_version(), version + 1)
+        self.assertEqual(sorted(CatalogChange.objects.filter(id__gt=change_id).values_list(
+            'product_info_id', flat=True)), [product_info.id for product_info in self.product_infos])
+        self.assertEqual(CategoryStats.objects.get().in_stock_count, 1)
+        self.assertFalse(BestOffer.objects.filter(offer_id=self.product_infos[1].id).exists())
+
+    def test_conditional_get_after_checkout(self):
+        OrderItem.objects.create(order=self.order, product_info=self.product_infos[0], quantity=3)
+        client = APIClient()
+        response = client.get(reverse('products'))
+        etag = response['ETag']
+        self.assertEqual(client.get(reverse('products'), HTTP_IF_NONE_MATCH=etag).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(place_order(self.user, self.contact, self.order).status_code, status.HTTP_200_OK)
+        response = client.get(reverse('products'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        quantities = {offer['id']: offer['quantity'] for offer in response.json()}
+        self.assertEqual(quantities[self.product_infos[0].id], 2)
+
+    def test_shortage_rolls_back(self):
+        OrderItem.objects.create(order=self.order, product_info=self.product_infos[0], quantity=3)
+        OrderItem.objects.create(order=self.order, product_info=self.product_infos[1], quantity=4)
+        response = place_order(self.user, self.contact, self.order)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.json()['Позиции'],
+                         [{'product_info': self.product_infos[1].id, 'requested': 4, 'available': 2}])
+        self.assertEqual(self.stock(), [5, 2])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.state, 'basket')
+        self.assertIsNone(OrderItem.objects.get(order=self.order, product_info=self.product_infos[0]).price)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    buyers_count = 12
+    stock = 5
+
+    def setUp(self):
+        shop = Shop.objects.create(name='Test Shop', state=True)
+        product = Product.objects.create(name='Хит продаж', category=Category.objects.create(name='Категория'))
+        self.product_info = ProductInfo.objects.create(shop=shop, product=product, quantity=self.stock, price=10,
+                                                       price_rrc=10, external_id=1)
+        self.buyers = []
+        for index in range(self.buyers_count):
+            user, contact, order = create_buyer(index)
+            OrderItem.objects.create(order=order, product_info=self.product_info, quantity=1)
+            self.buyers.append((user, contact, order))
+
+    @mock.patch.object(OrderView, 'throttle_classes', [])
+    def test_hot_item_not_oversold(self):
+        barrier = threading.Barrier(self.buyers_count)
+        results = {}
+
+        def checkout(user, contact, order):
+            try:
+                barrier.wait()
+                while True:
+                    # Общая база SQLite в памяти отвечает на конкуренцию ошибкой блокировки,
+                    # клиент повторяет запрос, пока заказ не оформлен
+                    try:
+                        if not Order.objects.filter(id=order.id, state='basket').exists():
+                            results[order.id] = status.HTTP_200_OK
+                            return
+                        results[order.id] = place_order(user, contact, order).status_code
+                        return
+                    except OperationalError:
+                        time.sleep(random.random() / 100)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=buyer) for buyer in self.buyers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        outcomes = list(results.values())
+        self.assertEqual(outcomes.count(status.HTTP_200_OK), self.stock)
+        self.assertEqual(outcomes.count(status.HTTP_409_CONFLICT), self.buyers_count - self.stock)
+        self.product_info.refresh_from_db()
+        self.assertEqual(self.product_info.quantity, 0)
+        self.assertEqual(Order.objects.filter(state='new').count(), self.stock)
+        self.assertEqual(CatalogOffer.objects.get(product_info=self.product_info).quantity, 0)
@@ -0,0 +1,58 @@
+import json
+from unittest.mock import patch
+
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+
+@override_settings(STREAM_CHUNK_SIZE=2)
+class StreamingResponseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='shop@example.com', password='password123', type='shop',
+                                             is_active=True)
+        self.client.force_authenticate(user=self.user)
+        shop = Shop.objects.create(name='Test Shop', state=True, user=self.user)
+        category = Category.objects.create(name='Категория')
+        parameter = Parameter.objects.create(name='Цвет')
+        for i in range(5):
+            product = Product.objects.create(name=f'Товар {i}', category=category)
+            product_info = ProductInfo.objects.create(shop=shop, product=product, quantity=10, price=100 + i,
+                                                      price_rrc=120, external_id=i)
+            ProductParameter.objects.create(product_info=product_info, parameter=parameter, value='Красный')
+            order = Order.objects.create(user=self.user, state='new')
+            OrderItem.objects.create(order=order, product_info=product_info, quantity=2)
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_streamed(self, url):
+        response = self.client.get(url, {'stream': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_products_stream(self):
+        expected = self.client.get(reverse('products')).json()
+        self.assertEqual(self.get_streamed(reverse('products')), expected)
+
+    def test_orders_stream(self):
+        expected = self.client.get(reverse('order')).json()
+        self.assertEqual(len(expected), 5)
+        self.assertEqual(self.get_streamed(reverse('order')), expected)
+
+    def test_partner_orders_stream(self):
+        expected = self.client.get(reverse('partner-orders')).json()
+        self.assertEqual(self.get_streamed(reverse('partner-orders')), expected)
+
+    def test_small_buffer(self):
+        with patch('backend.streaming.BUFFER_SIZE', 1):
+            response = self.client.get(reverse('products'), {'stream': 'true'})
+            chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(len(json.loads(b''.join(chunks))), 5)
@@ -3,7 +3,7 @@ from unittest.mock import patch, MagicMock
 import requests
 import yaml
 from backend.models import User, ConfirmEmailToken, TaskStatus, Shop, Category, Product, Parameter, \
-    ProductParameter, ProductInfo
+    ProductParameter, ProductInfo, CatalogOffer
 from backend.tasks import (
     send_email, send_password_reset_token, send_registration_confirmation,
     send_new_order_notification, load_data_from_url
@@ -115,6 +115,10 @@ class TestLoadDataFromUrlTask(TestCase):
         product_parameter = ProductParameter.objects.get(product_info=product_info, parameter=parameter)
         self.assertEqual(product_parameter.value, "Red")
 
+        # Проверяем, что витрина каталога пересобрана после импорта
+        offer = CatalogOffer.objects.get(product_info=product_info)
+        self.assertEqual(offer.parameters, [{"parameter": "Color", "value": "Red"}])
+
     def test_load_data_from_url_user_not_found(self):
         result = load_data_from_url.apply(args=[self.valid_url, 999]).result
         self.assertEqual(result["Status"], "FAILED")
@@ -2,8 +2,9 @@ from django.urls import path
 from django_rest_passwordreset.views import reset_password_request_token, reset_password_confirm
 
 from backend.views import PartnerUpdate, RegisterAccount, LoginAccount, CategoryView, ShopView, ProductInfoView, \
-    BasketView, \
-    AccountDetails, ContactView, OrderView, PartnerState, PartnerOrders, ConfirmAccount, run_task_view
+    CategoryStatsView, BasketView, CatalogChangesView, ProductAutocompleteView, ProductBatchView, ProductSearchView, \
+    SimilarProductsView, AccountDetails, ContactView, OrderView, PartnerState, PartnerOrders, ConfirmAccount, \
+    run_task_view
 
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
@@ -20,8 +21,14 @@ urlpatterns = [
     path('user/password_reset', reset_password_request_token, name='password-reset'),
     path('user/password_reset/confirm', reset_password_confirm, name='password-reset-confirm'),
     path('categories', CategoryView.as_view(), name='categories'),
+    path('categories/stats', CategoryStatsView.as_view(), name='category-stats'),
     path('shops', ShopView.as_view(), name='shops'),
     path('products', ProductInfoView.as_view(), name='products'),
+    path('products/batch', ProductBatchView.as_view(), name='products-batch'),
+    path('products/autocomplete', ProductAutocompleteView.as_view(), name='products-autocomplete'),
+    path('products/search', ProductSearchView.as_view(), name='products-search'),
+    path('products/<int:product_info_id>/similar', SimilarProductsView.as_view(), name='products-similar'),
+    path('catalog/changes', CatalogChangesView.as_view(), name='catalog-changes'),
     path('basket', BasketView.as_view(), name='basket'),
     path('order', OrderView.as_view(), name='order'),
     path('run_task', run_task_view, name='run-task'),
@@ -1,24 +1,44 @@
+import bisect
+import heapq
 import json
 from distutils.util import strtobool
 from rest_framework.request import Request
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.db import IntegrityError
-from django.db.models import Q, Sum, F
+from django.conf import settings
+from django.db.models import Sum, F, Q, Case, When, Value, PositiveIntegerField
+from django.db.models.functions import Coalesce
 from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.db import transaction
 from rest_framework.authtoken.models import Token
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from ujson import loads as load_json
-from backend.tasks import load_data_from_url
+from backend.tasks import load_data_from_url, schedule_autocomplete_build, schedule_similarity_build
+from backend.autocomplete import get_autocomplete_index
+from backend.cache import bump_catalog_version, catalog_cache_key, catalog_etag, catalog_response, \
+    get_catalog_cached
+from backend.catalog import CATALOG_OFFER_COLUMNS, CATALOG_OFFER_FIELDS, CATALOG_OFFER_COMPACT_FIELDS, \
+    CATALOG_SORTS, RELEVANCE_PARAMS, catalog_offer_columns, catalog_offer_data, rebuild_catalog_for_shop, \
+    reserve_catalog_offers, encode_cursor, decode_cursor, keyset_filter, get_catalog_offer_rows
 
 from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
-    Contact, ConfirmEmailToken, TaskStatus
-from backend.serializers import UserSerializer, CategorySerializer, ShopSerializer, ProductInfoSerializer, \
-    OrderItemSerializer, OrderSerializer, ContactSerializer
+    Contact, ConfirmEmailToken, TaskStatus, CatalogOffer, CatalogChange, ProductToken
+from backend.serializers import UserSerializer, CategorySerializer, ShopSerializer, \
+    OrderSerializer, CompactOrderSerializer, OrderHistorySerializer, BasketSerializer, CompactBasketSerializer, \
+    ContactSerializer, ORDER_FIELDS, BASKET_FIELDS, \
+    requested_fields, compact_requested, order_product_infos
 from backend.signals import new_user_registered, new_order
+from backend.idempotency import idempotent
+from backend.parsers import bulk_payload_error
+from backend.orders import BasketConflict, StockShortage, bump_basket_version, order_totals_deferred, \
+    refresh_order_totals, reserve_stock, snapshot_order_items
+from backend.search import bm25_scores, search_offer_ids, tokens
+from backend.similar import similar_offer_ids
+from backend.streaming import stream_queryset, stream_requested
 
 from django.shortcuts import redirect, render
 from django.contrib import admin, messages
@@ -83,6 +103,87 @@ def run_task_view(request):
     return render(request, "run_task_form.html", {"form": form})
 
 
+def order_fields(request, basket=False):
+    """
+    Поля заказа и сериализатор по параметрам ?fields= и ?view=compact.
+    basket - для корзины, у неё есть ещё поле version.
+    """
+    if basket:
+        fields = requested_fields(request, BASKET_FIELDS, None)
+        return fields, CompactBasketSerializer if compact_requested(request) else BasketSerializer
+    fields = requested_fields(request, ORDER_FIELDS, None)
+    serializer_class = CompactOrderSerializer if compact_requested(request) else OrderSerializer
+    return fields, serializer_class
+
+
+def order_queryset(queryset, fields, compact):
+    """
+    Подгружает только те связи заказа, которые нужны запрошенным полям.
+    Предложения полного представления строит order_product_infos.
+    """
+    if fields is None or 'ordered_items' in fields:
+        if compact:
+            queryset = queryset.prefetch_related('ordered_items__product_info__product')
+        else:
+            queryset = queryset.prefetch_related('ordered_items')
+
+    if fields is None or 'contact' in fields:
+        queryset = queryset.select_related('contact')
+    return queryset
+
+
+def bulk_items(request, comma_separated=False):
+    """
+    Список из поля items: JSON-массив или строка с JSON-массивом (прежний формат),
+    для удалений также строка id через запятую. Пустое значение - пустой список.
+    ValueError при неверном формате или больше BULK_MAX_ITEMS элементов.
+    """
+    items = request.data.get('items')
+    if isinstance(items, str):
+        if comma_separated and not items.lstrip().startswith('['):
+            items = [item.strip() for item in items.split(',') if item.strip()]
+        elif items:
+            items = json.loads(items)
+    if not items:
+        return []
+    if not isinstance(items, list):
+        raise ValueError('items должен быть списком')
+    if len(items) > settings.BULK_MAX_ITEMS:
+        raise ValueError(f'Не больше {settings.BULK_MAX_ITEMS} элементов в одном запросе')
+    return items
+
+
+def basket_version(request):
+    """
+    Версия корзины из поля version, которую видел клиент, или None, если не передана.
+    ValueError при неверном значении.
+    """
+    version = request.data.get('version')
+    if version is None:
+        return None
+    if isinstance(version, str) and version.isdigit():
+        return int(version)
+    if isinstance(version, int) and not isinstance(version, bool) and version >= 0:
+        return version
+    raise ValueError('version должен быть неотрицательным целым числом')
+
+
+def basket_conflict(error):
+    """
+    Ответ 409 на изменение устаревшей версии корзины.
+    """
+    return JsonResponse({'Status': False, 'Errors': 'Корзина была изменена, получите её заново',
+                         'Версия': error.version}, status=409)
+
+
+def bulk_ids(items):
+    """
+    id из списка удаления. Элементы, не являющиеся id, пропускаются.
+    """
+    return {int(item) for item in items
+            if (isinstance(item, int) and not isinstance(item, bool)) or (isinstance(item, str) and item.isdigit())}
+
+
 class RegisterAccount(APIView):
     """
     Для регистрации покупателей
@@ -243,6 +344,7 @@ class LoginAccount(APIView):
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
 
+@method_decorator(condition(etag_func=catalog_etag), name='get')
 class CategoryView(ListAPIView):
     """
     Класс для просмотра категорий
@@ -251,6 +353,46 @@ class CategoryView(ListAPIView):
     serializer_class = CategorySerializer
 
 
+@method_decorator(condition(etag_func=catalog_etag), name='get')
+class CategoryStatsView(APIView):
+    """
+        A class for categories with offer statistics.
+
+        Methods:
+        - get: Retrieve the categories with offer counts and price ranges.
+
+        Attributes:
+        - None
+        """
+
+    def get(self, request: Request, *args, **kwargs):
+        """
+               Retrieve every category with its precomputed offer counts and price range.
+
+               Args:
+               - request (Request): The Django request object.
+
+               Returns:
+               - Response: The list of categories with statistics.
+               """
+        return catalog_response(request, 'category-stats', self.get_categories_data)
+
+    @staticmethod
+    def get_categories_data():
+        """
+               Build the categories list from the CategoryStats table in one query.
+
+               Returns:
+               - list: The categories with statistics.
+               """
+        rows = Category.objects.values_list('id', 'name', 'stats__offers_count', 'stats__in_stock_count',
+                                            'stats__min_price', 'stats__max_price')
+        return [{'id': category_id, 'name': name, 'offers_count': offers_count or 0,
+                 'in_stock_count': in_stock_count or 0, 'min_price': min_price, 'max_price': max_price}
+                for category_id, name, offers_count, in_stock_count, min_price, max_price in rows]
+
+
+@method_decorator(condition(etag_func=catalog_etag), name='get')
 class ShopView(ListAPIView):
     """
     Класс для просмотра списка магазинов
@@ -259,6 +401,7 @@ class ShopView(ListAPIView):
     serializer_class = ShopSerializer
 
 
+@method_decorator(condition(etag_func=catalog_etag), name='get')
 class ProductInfoView(APIView):
     """
         A class for searching products.
@@ -280,25 +423,386 @@ class ProductInfoView(APIView):
                Returns:
                - Response: The response containing the product information.
                """
-        query = Q(shop__state=True)
+        if stream_requested(request):
+            fields = self.get_products_fields(request)
+            return stream_queryset(self.get_products_queryset(request).values(*catalog_offer_columns(fields)),
+                                   lambda row: catalog_offer_data(row, fields))
+
+        # ?sort= и ?q= - постраничная выдача с курсором
+        if {'sort', 'q'} & set(request.query_params):
+            try:
+                page = self.get_page_params(request)
+            except ValueError as error:
+                return JsonResponse({'Status': False, 'Errors': str(error)}, status=400)
+            return catalog_response(request, 'products', lambda: self.get_products_page(request, *page))
+
+        return catalog_response(request, 'products', lambda: self.get_products_data(request))
+
+    @staticmethod
+    def get_products_queryset(request: Request):
+        """
+               Build the catalog offers queryset for the specified filters.
+
+               Args:
+               - request (Request): The Django request object.
+
+               Returns:
+               - QuerySet: The catalog offers.
+               """
+        # Витрина содержит только предложения активных магазинов, соединения не нужны
+        queryset = CatalogOffer.objects.all()
         shop_id = request.query_params.get('shop_id')
         category_id = request.query_params.get('category_id')
 
+        # ?mode=best - только самое дешёвое предложение в наличии по каждому продукту
+        if request.query_params.get('mode') == 'best':
+            queryset = queryset.filter(best_offer__isnull=False)
+
         if shop_id:
-            query = query & Q(shop_id=shop_id)
+            queryset = queryset.filter(shop_id=shop_id)
 
         if category_id:
-            query = query & Q(product__category_id=category_id)
+            queryset = queryset.filter(category_id=category_id)
 
-        # фильтруем и отбрасываем дуликаты
-        queryset = ProductInfo.objects.filter(
-            query).select_related(
-            'shop', 'product__category').prefetch_related(
-            'product_parameters__parameter').distinct()
+        # ?q= - предложения, в названии или модели которых есть хотя бы одно слово запроса
+        query = request.query_params.get('q')
+        if query is not None:
+            queryset = queryset.filter(product_info_id__in=ProductToken.objects.filter(
+                token__in=set(tokens(query))).values('product_info_id'))
 
-        serializer = ProductInfoSerializer(queryset, many=True)
+        return queryset
+
+    @staticmethod
+    def get_products_fields(request: Request):
+        """
+               Fields of the product information requested with ?fields= or ?view=compact.
+
+               Args:
+               - request (Request): The Django request object.
+
+               Returns:
+               - tuple: The field names.
+               """
+        return requested_fields(request, tuple(CATALOG_OFFER_COLUMNS),
+                                CATALOG_OFFER_COMPACT_FIELDS) or CATALOG_OFFER_FIELDS
+
+    def get_products_data(self, request: Request):
+        """
+               Build the product information list for the specified filters.
+
+               Args:
+               - request (Request): The Django request object.
+
+               Returns:
+               - list: The serialized product information.
+               """
+        # Читаем из витрины только столбцы запрошенных полей
+        fields = self.get_products_fields(request)
+        queryset = self.get_products_queryset(request).values(*catalog_offer_columns(fields))
+        return [catalog_offer_data(row, fields) for row in queryset]
+
+    @staticmethod
+    def get_page_params(request: Request):
+        """
+               Validate the ?sort=, ?cursor= and ?limit= parameters of a paged listing.
+
+               Args:
+               - request (Request): The Django request object.
+
+               Returns:
+               - tuple: The sort name, the cursor values or None and the page size.
+
+               Raises:
+               - ValueError: If a parameter is invalid.
+               """
+        query = request.query_params.get('q')
+        sort = request.query_params.get('sort', 'relevance' if query else 'newest')
+        if sort not in CATALOG_SORTS:
+            raise ValueError(f'Неизвестная сортировка, доступны: {", ".join(CATALOG_SORTS)}')
+        if sort == 'relevance' and not query:
+            raise ValueError('Сортировка relevance требует параметра q')
+
+        try:
+            limit = int(request.query_params.get('limit', settings.CATALOG_PAGE_SIZE))
+        except ValueError:
+            raise ValueError('Неверный формат запроса')
+        limit = min(max(limit, 1), settings.CATALOG_MAX_PAGE_SIZE)
+
+        cursor = request.query_params.get('cursor')
+        if cursor is not None:
+            # Для relevance курсор - оценка и id последней строки
+            cursor = decode_cursor(cursor, 2 if CATALOG_SORTS[sort] is None else len(CATALOG_SORTS[sort]))
+        return sort, cursor, limit
+
+    @staticmethod
+    def get_relevance_ranking(request: Request, queryset):
+        """
+               Rank the offers matching ?q= by BM25, keeping the SEARCH_RELEVANCE_MAX_RESULTS best.
+
+               Args:
+               - request (Request): The Django request object.
+               - queryset (QuerySet): The filtered catalog offers.
+
+               Returns:
+               - list: The (negated score, offer id) pairs, best first.
+               """
+        scores = bm25_scores(request.query_params['q'])
+        return heapq.nsmallest(settings.SEARCH_RELEVANCE_MAX_RESULTS,
+                               ((-scores[product_info_id], product_info_id)
+                                for product_info_id in queryset.values_list('product_info_id', flat=True)))
+
+    def get_products_page(self, request: Request, sort, cursor, limit):
+        """
+               Build a page of the product information in the requested order.
+
+               Args:
+               - request (Request): The Django request object.
+               - sort (str): The sort name.
+               - cursor (list): The sort values of the previous page's last row or None.
+               - limit (int): The page size.
+
+               Returns:
+               - dict: The serialized product information and the cursor of the next page.
+               """
+        fields = self.get_products_fields(request)
+        queryset = self.get_products_queryset(request)
+        ordering = CATALOG_SORTS[sort]
+
+        if ordering is None:
+            ranked = get_catalog_cached(catalog_cache_key('relevance', request, RELEVANCE_PARAMS),
+                                        lambda: self.get_relevance_ranking(request, queryset))
+            start = bisect.bisect_right(ranked, (-cursor[0], cursor[1])) if cursor is not None else 0
+            ranked = ranked[start:start + limit + 1]
+            has_more, ranked = len(ranked) > limit, ranked[:limit]
+            rows = queryset.filter(product_info_id__in=[product_info_id for _, product_info_id in ranked]).values(
+                'product_info_id', *catalog_offer_columns(fields))
+            offers = {row['product_info_id']: catalog_offer_data(row, fields) for row in rows}
+            results = [offers[product_info_id] for _, product_info_id in ranked if product_info_id in offers]
+            last = [-ranked[-1][0], ranked[-1][1]] if ranked else None
+        else:
+            if cursor is not None:
+                queryset = queryset.filter(keyset_filter(ordering, cursor))
+            columns = [field.lstrip('-') for field in ordering]
+            rows = list(queryset.order_by(*ordering).values(*columns, *catalog_offer_columns(fields))[:limit + 1])
+            has_more, rows = len(rows) > limit, rows[:limit]
+            results = [catalog_offer_data(row, fields) for row in rows]
+            last = [rows[-1][column] for column in columns] if rows else None
+
+        return {'results': results, 'next': encode_cursor(last) if has_more else None}
 
-        return Response(serializer.data)
+
+class ProductBatchView(APIView):
+    """
+        A class for fetching offers by ids.
+
+        Methods:
+        - get: Retrieve the offers with the given ids.
+
+        Attributes:
+        - None
+        """
+
+    def get(self, request: Request, *args, **kwargs):
+        """
+               Retrieve the offers listed in ?ids= (comma-separated) in the requested order.
+               Offers that are not in the catalog are skipped.
+
+               Args:
+               - request (Request): The Django request object.
+
+               Returns:
+               - Response: The product information list.
+               """
+        ids = [item.strip() for item in request.query_params.get('ids', '').split(',') if item.strip()]
+        if not ids or not all(item.isdigit() for item in ids):
+            return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'}, status=400)
+        if len(ids) > settings.PRODUCTS_BATCH_MAX_IDS:
+            return JsonResponse({'Status': False,
+                                 'Errors': f'Не больше {settings.PRODUCTS_BATCH_MAX_IDS} id в одном запросе'},
+                                status=400)
+
+        product_info_ids = list(dict.fromkeys(int(item) for item in ids))
+        fields = ProductInfoView.get_products_fields(request)
+        rows = get_catalog_offer_rows(product_info_ids)
+        return Response([catalog_offer_data(rows[product_info_id], fields) for product_info_id in product_info_ids
+                         if product_info_id in rows])
+
+
+class ProductAutocompleteView(APIView):
+    """
+        A class for product name and model suggestions.
+
+        Methods:
+        - get: Retrieve the suggestions for the entered prefix.
+
+        Attributes:
+        - None
+        """
+
+    def get(self, request: Request, *args, **kwargs):
+        """
+               Retrieve the suggestions for the ?q= prefix, most popular first.
+
+               Args:
+               - request (Request): The Django request object.
+
+               Returns:
+               - Response: The list of suggestions with product ids.
+               """
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), settings.AUTOCOMPLETE_MAX_LIMIT)
+        except ValueError:
+            return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'}, status=400)
+
+        index = get_autocomplete_index()
+        if index is None:
+            # Индекс ещё не собран: не строим его в запросе, а ставим сборку в очередь
+            schedule_autocomplete_build()
+            return Response([])
+        return Response(index.search(request.query_params.get('q', ''), max(limit, 1)))
+
+
+class ProductSearchView(APIView):
+    """
+        A class for typo-tolerant product search.
+
+        Methods:
+        - get: Retrieve the offers similar to the query.
+
+        Attributes:
+        - None
+        """
+
+    def get(self, request: Request, *args, **kwargs):
+        """
+               Retrieve the catalog offers whose name or model is similar to ?q=, best matches first.
+
+               Args:
+               - request (Request): The Django request object.
+
+               Returns:
+               - Response: The product information list.
+               """
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), settings.SEARCH_MAX_LIMIT)
+        except ValueError:
+            return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'}, status=400)
+
+        product_info_ids = search_offer_ids(request.query_params.get('q', ''), max(limit, 1))
+        fields = ProductInfoView.get_products_fields(request)
+        rows = CatalogOffer.objects.filter(product_info_id__in=product_info_ids).values(
+            'product_info_id', *catalog_offer_columns(fields))
+        offers = {row['product_info_id']: catalog_offer_data(row, fields) for row in rows}
+        return Response([offers[product_info_id] for product_info_id in product_info_ids
+                         if product_info_id in offers])
+
+
+class SimilarProductsView(APIView):
+    """
+        A class for similar products recommendations.
+
+        Methods:
+        - get: Retrieve the offers most similar to the given one.
+
+        Attributes:
+        - None
+        """
+
+    def get(self, request: Request, product_info_id, *args, **kwargs):
+        """
+               Retrieve the offers of the same category with the closest parameters and price.
+
+               Args:
+               - request (Request): The Django request object.
+               - product_info_id (int): The offer id.
+
+               Returns:
+               - Response: The product information list, most similar first.
+               """
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), settings.SIMILAR_MAX_LIMIT)
+        except ValueError:
+            return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'}, status=400)
+
+        category_id = CatalogOffer.objects.filter(product_info_id=product_info_id).values_list(
+            'category_id', flat=True).first()
+        if category_id is None:
+            return JsonResponse({'Status': False, 'Errors': 'Товар не найден'}, status=404)
+
+        product_info_ids = similar_offer_ids(category_id, [product_info_id], max(limit, 1))[product_info_id]
+        fields = ProductInfoView.get_products_fields(request)
+        rows = CatalogOffer.objects.filter(product_info_id__in=product_info_ids).values(
+            'product_info_id', *catalog_offer_columns(fields))
+        offers = {row['product_info_id']: catalog_offer_data(row, fields) for row in rows}
+        return Response([offers[product_info_id] for product_info_id in product_info_ids
+                         if product_info_id in offers])
+
+
+class CatalogChangesView(APIView):
+    """
+        A class for syncing the catalog by changes since a version token.
+
+        Methods:
+        - get: Retrieve the offers changed or deleted after the token.
+
+        Attributes:
+        - None
+        """
+
+    def get(self, request: Request, *args, **kwargs):
+        """
+               Retrieve the catalog changes after the ?since= token.
+
+               Without the token only the current token is returned: the client
+               downloads the full listing and then requests changes after it.
+
+               Args:
+               - request (Request): The Django request object.
+
+               Returns:
+               - Response: The changed offers, the deleted offer ids and the next token.
+               """
+        since = request.query_params.get('since')
+        if since is None:
+            last = CatalogChange.objects.order_by('-id').values_list('id', flat=True).first()
+            return Response({'next': last or 0, 'has_more': False, 'upserted': [], 'deleted': []})
+
+        try:
+            since = int(since)
+            limit = min(int(request.query_params.get('limit', settings.CATALOG_CHANGES_PAGE_SIZE)),
+                        settings.CATALOG_CHANGES_PAGE_SIZE)
+        except ValueError:
+            return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'}, status=400)
+        if since < 0 or limit < 1:
+            return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'}, status=400)
+
+        changes = list(CatalogChange.objects.filter(id__gt=since).values_list(
+            'id', 'product_info_id', 'deleted')[:limit + 1])
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        # Для каждого предложения важно только последнее изменение в странице
+        latest = {}
+        for change_id, product_info_id, deleted in changes:
+            latest[product_info_id] = deleted
+        upserted_ids = [product_info_id for product_info_id, deleted in latest.items() if not deleted]
+
+        fields = ProductInfoView.get_products_fields(request)
+        rows = CatalogOffer.objects.filter(product_info_id__in=upserted_ids).values(
+            'product_info_id', *catalog_offer_columns(fields))
+        upserted, present = [], set()
+        for row in rows:
+            upserted.append(catalog_offer_data(row, fields))
+            present.add(row['product_info_id'])
+        # Предложение могло исчезнуть после изменения - тогда клиенту нужно его удалить
+        deleted = sorted(product_info_id for product_info_id in latest if product_info_id not in present)
+
+        return Response({
+            'next': changes[-1][0] if changes else since,
+            'has_more': has_more,
+            'upserted': upserted,
+            'deleted': deleted,
+        })
 
 
 class BasketView(APIView):
@@ -319,6 +823,7 @@ class BasketView(APIView):
     def get(self, request, *args, **kwargs):
         """
                 Retrieve the items in the user's basket.
+                The version field is the value to send back in version when changing the basket.
 
                 Args:
                 - request (Request): The Django request object.
@@ -328,61 +833,90 @@ class BasketView(APIView):
                 """
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
-        basket = Order.objects.filter(
-            user_id=request.user.id, state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-
-        serializer = OrderSerializer(basket, many=True)
+        fields, serializer_class = order_fields(request, basket=True)
+        basket = order_queryset(Order.objects.filter(user_id=request.user.id, state='basket'), fields,
+                                serializer_class is CompactBasketSerializer)
+        context = {}
+        if serializer_class is BasketSerializer and (fields is None or 'ordered_items' in fields):
+            # Предложения всех позиций сериализуются разом, без вложенных сериализаторов
+            basket = list(basket)
+            context['product_infos'] = order_product_infos(basket)
+
+        serializer = serializer_class(basket, many=True, fields=fields, context=context)
         return Response(serializer.data)
 
     # редактировать корзину
 
+    @idempotent
     def post(self, request, *args, **kwargs):
+        """
+                Add items to the user's basket.
+                Quantities of products already in the basket are increased, repeated products are merged.
+                An optional version field makes the request fail with 409 if the basket has changed since.
+
+                Args:
+                - request (Request): The Django request object.
+
+                Returns:
+                - JsonResponse: The response indicating the status of the operation and any errors.
+                """
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
-        items_string = request.data.get('items')
-        if items_string:
+        too_large = bulk_payload_error(request)
+        if too_large:
+            return too_large
+        try:
+            items_dict = bulk_items(request)
+            expected_version = basket_version(request)
+        except (ValueError, TypeError) as e:
+            return JsonResponse({'Status': False, 'Errors': f'Неверный формат запроса: {str(e)}'}, status=400)
+        if items_dict:
+            # Проверяем все позиции до записи и складываем повторы одного товара
+            quantities = {}
+            for order_item in items_dict:
+                if not isinstance(order_item, dict) or 'product_info' not in order_item or \
+                        'quantity' not in order_item:
+                    return JsonResponse(
+                        {'Status': False,
+                         'Errors': 'Поля product_info и quantity обязательны для каждого элемента'},
+                        status=400
+                    )
+                product_info_id, quantity = order_item['product_info'], order_item['quantity']
+                if not isinstance(product_info_id, int) or not isinstance(quantity, int) or quantity < 1:
+                    return JsonResponse({'Status': False, 'Errors': 'Неверные данные в элементе'}, status=400)
+                quantities[product_info_id] = quantities.get(product_info_id, 0) + quantity
+
+            missing = quantities.keys() - set(ProductInfo.objects.filter(id__in=quantities).values_list(
+                'id', flat=True))
+            if missing:
+                return JsonResponse({'Status': False,
+                                     'Errors': f'Товары не найдены: {", ".join(map(str, sorted(missing)))}'},
+                                    status=400)
+
             try:
-                items_dict = json.loads(items_string)  # Заменила load_json на стандартный json.loads
-                if not isinstance(items_dict, list):  # Проверяем, что передан список объектов
-                    raise ValueError("Items должны быть списком")
-            except (ValueError, TypeError) as e:
-                return JsonResponse({'Status': False, 'Errors': f'Неверный формат запроса: {str(e)}'}, status=400)
-            with transaction.atomic():
-                basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-                objects_created = 0
-                for order_item in items_dict:
-                    if 'product_info' not in order_item or 'quantity' not in order_item:
-                        return JsonResponse(
-                            {'Status': False,
-                             'Errors': 'Поля product_info и quantity обязательны для каждого элемента'},
-                            status=400
-                        )
-
-                    try:
-                        order_item.update({'order': basket.id})
-                        existing_item = OrderItem.objects.filter(order=basket,
-                                                                 product_info_id=order_item.get('product_info')).first()
-                        if existing_item:
-                            existing_item.quantity += order_item.get('quantity', 0)
-                            existing_item.save()
-                        else:
-                            serializer = OrderItemSerializer(data=order_item)
-                            if serializer.is_valid():
-                                serializer.save()
-                                objects_created += 1
-                            else:
-                                return JsonResponse({'Status': False, 'Errors': serializer.errors}, status=400)
-
-                    except Exception as e:
-                        return JsonResponse({'Status': False, 'Errors': f'Ошибка обработки элемента: {str(e)}'},
-                                            status=400)
-                return JsonResponse({'Status': True, 'Создано объектов': objects_created}, status=201)
+                with transaction.atomic():
+                    basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
+                    version = bump_basket_version(request.user.id, expected_version)
+                    existing = set(OrderItem.objects.filter(order=basket, product_info_id__in=quantities).values_list(
+                        'product_info_id', flat=True))
+                    if existing:
+                        # Прибавляем в базе одним UPDATE, а не читаем и записываем количество
+                        OrderItem.objects.filter(order=basket, product_info_id__in=existing).update(
+                            quantity=F('quantity') + Case(
+                                *[When(product_info_id=product_info_id, then=Value(quantities[product_info_id]))
+                                  for product_info_id in existing], output_field=PositiveIntegerField()))
+                    created = OrderItem.objects.bulk_create(
+                        [OrderItem(order=basket, product_info_id=product_info_id, quantity=quantity)
+                         for product_info_id, quantity in quantities.items() if product_info_id not in existing])
+                    # Массовые операции не вызывают сигналов, итоги корзины пересчитываем явно
+                    refresh_order_totals([basket.id])
+            except BasketConflict as error:
+                return basket_conflict(error)
+            return JsonResponse({'Status': True, 'Создано объектов': len(created), 'Версия': version}, status=201)
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'}, status=400)
 
     # удалить товары из корзины
+    @idempotent
     def delete(self, request, *args, **kwargs):
         """
                 Remove  items from the user's basket.
@@ -396,23 +930,27 @@ class BasketView(APIView):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
 
-        items_sting = request.data.get('items')
-        if items_sting:
-            items_list = items_sting.split(',')
-            basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-            query = Q()
-            objects_deleted = False
-            for order_item_id in items_list:
-                if order_item_id.isdigit():
-                    query = query | Q(order_id=basket.id, id=order_item_id)
-                    objects_deleted = True
-
-            if objects_deleted:
-                deleted_count = OrderItem.objects.filter(query).delete()[0]
-                return JsonResponse({'Status': True, 'Удалено объектов': deleted_count})
+        too_large = bulk_payload_error(request)
+        if too_large:
+            return too_large
+        try:
+            item_ids = bulk_ids(bulk_items(request, comma_separated=True))
+            expected_version = basket_version(request)
+        except ValueError as error:
+            return JsonResponse({'Status': False, 'Errors': f'Неверный формат запроса: {error}'}, status=400)
+        if item_ids:
+            try:
+                with transaction.atomic(), order_totals_deferred():
+                    version = bump_basket_version(request.user.id, expected_version)
+                    deleted_count = OrderItem.objects.filter(order__user_id=request.user.id, order__state='basket',
+                                                             id__in=item_ids).delete()[0]
+            except BasketConflict as error:
+                return basket_conflict(error)
+            return JsonResponse({'Status': True, 'Удалено объектов': deleted_count, 'Версия': version})
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
     # добавить позиции в корзину
+    @idempotent
     def put(self, request, *args, **kwargs):
         """
         Update the items in the user's basket.
@@ -426,26 +964,42 @@ class BasketView(APIView):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
 
-        items_string = request.data.get('items')
-        if items_string:
+        too_large = bulk_payload_error(request)
+        if too_large:
+            return too_large
+        try:
+            items_dict = bulk_items(request)
+            expected_version = basket_version(request)
+        except ValueError:
+            return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'})
+        if items_dict:
+            quantities = {}
+            for order_item in items_dict:
+                # Убедимся, что оба поля ('id' и 'quantity') присутствуют и корректны
+                if isinstance(order_item, dict) and isinstance(order_item.get('id'), int) and \
+                        isinstance(order_item.get('quantity'), int) and order_item['quantity'] > 0:
+                    quantities[order_item['id']] = order_item['quantity']
+                else:
+                    return JsonResponse({'Status': False, 'Errors': 'Неверные данные в элементе'})
+
             try:
-                # Десериализация строки JSON в список словарей
-                items_dict = load_json(items_string)
-                if not isinstance(items_dict, list):
-                    raise ValueError("Invalid format: 'items' must be a list of dictionaries.")
-            except ValueError:
-                return JsonResponse({'Status': False, 'Errors': 'Неверный формат запроса'})
-            else:
-                basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-                objects_updated = 0
-                for order_item in items_dict:
-                    # Убедимся, что оба поля ('id' и 'quantity') присутствуют и корректны
-                    if isinstance(order_item.get('id'), int) and isinstance(order_item.get('quantity'), int):
-                        objects_updated += OrderItem.objects.filter(order_id=basket.id, id=order_item['id']).update(
-                            quantity=order_item['quantity'])
-                    else:
-                        return JsonResponse({'Status': False, 'Errors': 'Неверные данные в элементе'})
-                return JsonResponse({'Status': True, 'Обновлено объектов': objects_updated}, status=200)
+                with transaction.atomic():
+                    version = bump_basket_version(request.user.id, expected_version)
+                    # Одно чтение проверяет, что позиции лежат в корзине пользователя, одно обновление меняет все
+                    owned = dict(OrderItem.objects.filter(order__user_id=request.user.id, order__state='basket',
+                                                          id__in=quantities).values_list('id', 'order_id'))
+                    objects_updated = 0
+                    if owned:
+                        objects_updated = OrderItem.objects.filter(id__in=owned).update(quantity=Case(
+                            *[When(id=item_id, then=Value(quantities[item_id])) for item_id in owned],
+                            output_field=PositiveIntegerField()))
+                        refresh_order_totals(owned.values())
+            except BasketConflict as error:
+                return basket_conflict(error)
+            return JsonResponse({'Status': True, 'Обновлено объектов': objects_updated, 'Версия': version,
+                                 'Позиции': [{'id': item_id, 'Status': True} if item_id in owned else
+                                             {'id': item_id, 'Status': False, 'Errors': 'Позиция не найдена'}
+                                             for item_id in quantities]}, status=200)
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
 
@@ -536,7 +1090,15 @@ class PartnerState(APIView):
         state = request.data.get('state')
         if state:
             try:
-                Shop.objects.filter(user_id=request.user.id).update(state=strtobool(state))
+                shops = Shop.objects.filter(user_id=request.user.id)
+                shops.update(state=strtobool(state))
+                # update() не вызывает сигналы, поэтому обновляем витрину и кэш каталога явно
+                for shop_id in shops.values_list('id', flat=True):
+                    rebuild_catalog_for_shop(shop_id)
+                bump_catalog_version()
+                schedule_autocomplete_build()
+                schedule_similarity_build(Product.objects.filter(product_infos__shop__in=shops).values_list(
+                    'category_id', flat=True))
                 return JsonResponse({'Status': True})
             except ValueError as error:
                 return JsonResponse({'Status': False, 'Errors': str(error)})
@@ -552,13 +1114,15 @@ class PartnerOrders(APIView):
         if request.user.type != 'shop':
             return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
 
+        # Позиции магазина берём из снимка, он переживает удаление предложения из каталога.
+        # Каталог читается только для позиций без снимка (заказы до snapshot_order_items)
         order = Order.objects.filter(
-            ordered_items__product_info__shop__user_id=request.user.id
-        ).exclude(state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter'
-        ).select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))
+            Q(ordered_items__shop__user_id=request.user.id) |
+            Q(ordered_items__shop__isnull=True, ordered_items__product_info__shop__user_id=request.user.id)
+        ).exclude(state='basket').select_related('contact').annotate(
+            # Сумма только по позициям этого магазина
+            shop_total_sum=Sum(F('ordered_items__quantity') * Coalesce('ordered_items__price',
+                                                                       'ordered_items__product_info__price'))
         ).distinct()
 
         # Возвращаем 404, если заказы не найдены
@@ -566,14 +1130,17 @@ class PartnerOrders(APIView):
             return JsonResponse({'Status': False, 'Error': 'No orders found'}, status=404)
 
         # Сериализация данных вручную
-        orders_data = []
-        for o in order:
-            orders_data.append({
+        def serialize(o):
+            return {
                 'id': o.id,
-                'user_id': o.user.id,
-                'total_sum': o.total_sum,
-            })
+                'user_id': o.user_id,
+                'total_sum': o.shop_total_sum,
+            }
+
+        if stream_requested(request):
+            return stream_queryset(order, serialize)
 
+        orders_data = [serialize(o) for o in order]
         return JsonResponse(orders_data, safe=False, status=200)
 
 
@@ -650,19 +1217,16 @@ class ContactView(APIView):
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
 
-        items_sting = request.data.get('items')
-        if items_sting:
-            items_list = items_sting.split(',')
-            query = Q()
-            objects_deleted = False
-            for contact_id in items_list:
-                if contact_id.isdigit():
-                    query = query | Q(user_id=request.user.id, id=contact_id)
-                    objects_deleted = True
-
-            if objects_deleted:
-                deleted_count = Contact.objects.filter(query).delete()[0]
-                return JsonResponse({'Status': True, 'Удалено объектов': deleted_count})
+        too_large = bulk_payload_error(request)
+        if too_large:
+            return too_large
+        try:
+            contact_ids = bulk_ids(bulk_items(request, comma_separated=True))
+        except ValueError as error:
+            return JsonResponse({'Status': False, 'Errors': f'Неверный формат запроса: {error}'}, status=400)
+        if contact_ids:
+            deleted_count = Contact.objects.filter(user_id=request.user.id, id__in=contact_ids).delete()[0]
+            return JsonResponse({'Status': True, 'Удалено объектов': deleted_count})
         return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
     # редактировать контакт
@@ -720,16 +1284,22 @@ class OrderView(APIView):
                """
         if not request.user.is_authenticated:
             return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
-        order = Order.objects.filter(
-            user_id=request.user.id).exclude(state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-
-        serializer = OrderSerializer(order, many=True)
+        # Оформленные заказы читаются из снимка позиций, каталог не затрагивается
+        fields, _ = order_fields(request)
+        order = Order.objects.filter(user_id=request.user.id).exclude(state='basket')
+        if fields is None or 'ordered_items' in fields:
+            order = order.prefetch_related('ordered_items')
+        if fields is None or 'contact' in fields:
+            order = order.select_related('contact')
+
+        if stream_requested(request):
+            return stream_queryset(order, lambda o: OrderHistorySerializer(o, fields=fields).data)
+
+        serializer = OrderHistorySerializer(order, many=True, fields=fields)
         return Response(serializer.data)
 
     # разместить заказ из корзины
+    @idempotent
     def post(self, request, *args, **kwargs):
         """
         Разместить заказ из корзины.
@@ -743,11 +1313,21 @@ class OrderView(APIView):
                 return JsonResponse({'Status': False, 'Errors': 'Invalid id format'}, status=400)
 
             try:
-                is_updated = Order.objects.filter(
-                    user_id=request.user.id, id=request.data['id']
-                ).update(contact_id=request.data['contact'], state='new')
+                with transaction.atomic():
+                    # Оформить можно только корзину, повторное оформление не меняет снимок цен
+                    is_updated = Order.objects.filter(
+                        user_id=request.user.id, id=request.data['id'], state='basket'
+                    ).update(contact_id=request.data['contact'], state='new')
+                    if is_updated:
+                        snapshot_order_items([request.data['id']])
+                        refresh_order_totals([request.data['id']])
+                        # Остатки и популярность в витрине, UPDATE сигналов не вызывает
+                        reserve_catalog_offers(reserve_stock(request.data['id']))
             except IntegrityError as error:
                 return JsonResponse({'Status': False, 'Errors': 'Invalid arguments'}, status=400)
+            except StockShortage as error:
+                return JsonResponse({'Status': False, 'Errors': 'Недостаточно товара на складе',
+                                     'Позиции': error.shortages}, status=409)
             else:
                 if is_updated:
                     new_order.send(sender=self.__class__, user_id=request.user.id)
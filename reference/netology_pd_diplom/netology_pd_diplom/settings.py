@@ -48,6 +48,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'backend.middleware.CompressionMiddleware',
+    'backend.middleware.MessagePackMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -150,9 +152,16 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 40,
 
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
-
+        'backend.renderers.UJSONRenderer',
+        'backend.renderers.MessagePackRenderer',
+        # Browsable API только в режиме отладки
+        *(('rest_framework.renderers.BrowsableAPIRenderer',) if DEBUG else ()),
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'backend.parsers.UJSONParser',
+        'backend.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
 
@@ -198,6 +207,71 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
 CELERY_TIMEZONE = 'UTC'
 
+# Общий кэш процессов web и celery: версия каталога, блокировки пересчёта,
+# закэшированные выборки и ключи идемпотентности должны быть видны всем процессам
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('CACHE_URL', default='redis://redis:6379/1'),
+    }
+}
+
+# Тесты работают с кэшем в памяти и не требуют Redis, см. backend.test_runner
+TEST_RUNNER = 'backend.test_runner.TestRunner'
+
+# Кэш каталога
+CATALOG_CACHE_TIMEOUT = 300  # Срок жизни выборки каталога, сек
+CATALOG_CACHE_STALE_TIMEOUT = 3600  # Сколько храним устаревшее значение на время пересчёта, сек
+CATALOG_CACHE_LOCK_TIMEOUT = 30  # Блокировка пересчёта, сек
+CATALOG_CACHE_WAIT = 5  # Сколько ждём чужого пересчёта, если устаревшего значения нет, сек
+CATALOG_CACHE_BETA = 1.0  # Агрессивность досрочного обновления (XFetch)
+CATALOG_OFFER_CACHE_TIMEOUT = 300  # Срок жизни кэша отдельного предложения для выборки по id, сек
+
+# Файл индекса автодополнения, общий для всех процессов (читается через mmap)
+AUTOCOMPLETE_INDEX_PATH = os.path.join(BASE_DIR, 'var', 'autocomplete.idx')
+AUTOCOMPLETE_SCAN_LIMIT = 2000  # Сколько терминов просматриваем на один запрос
+AUTOCOMPLETE_MAX_LIMIT = 20  # Максимальное число подсказок в ответе
+
+# Нечёткий поиск по триграммам
+SEARCH_CANDIDATES = 200  # Сколько кандидатов ранжируем на один запрос
+SEARCH_TRIGRAM_POSTINGS = 5000  # Сколько записей читаем на одну триграмму, более частые отбрасываем
+SEARCH_SIMILARITY_THRESHOLD = 0.3  # Минимальное сходство, как pg_trgm.similarity_threshold по умолчанию
+SEARCH_MAX_LIMIT = 50  # Максимальное число результатов в ответе
+SEARCH_RELEVANCE_MAX_RESULTS = 1000  # Сколько лучших по релевантности предложений можно пролистать
+
+# Ограничения массовых операций с корзиной и контактами (items)
+BULK_MAX_ITEMS = 500  # Максимальное число элементов в одном запросе
+BULK_MAX_BODY_SIZE = 1024 * 1024  # Максимальный размер тела запроса, байт
+
+# Максимальное число id в одном запросе products/batch
+PRODUCTS_BATCH_MAX_IDS = 100
+
+# Похожие товары: файлы матриц признаков по категориям
+SIMILAR_INDEX_DIR = os.path.join(BASE_DIR, 'var', 'similar')
+SIMILAR_MAX_VALUES = 50  # Сколько самых частых значений текстового параметра кодируем
+SIMILAR_PRICE_WEIGHT = 1.0  # Вес цены относительно одного параметра
+SIMILAR_BATCH_SIZE = 64  # Сколько запросов считаем одним матричным умножением
+SIMILAR_MAX_LIMIT = 50  # Максимальное число похожих товаров в ответе
+
+# Размер страницы списка товаров с сортировкой (?sort=, ?q=) по умолчанию и максимальный
+CATALOG_PAGE_SIZE = 50
+CATALOG_MAX_PAGE_SIZE = 200
+
+# Максимальное число изменений каталога в одном ответе catalog/changes
+CATALOG_CHANGES_PAGE_SIZE = 1000
+
+# Ключи идемпотентности (Idempotency-Key) для корзины и оформления заказа
+IDEMPOTENCY_TTL = 24 * 60 * 60  # Сколько храним ответ для повтора, сек
+IDEMPOTENCY_LOCK_TIMEOUT = 60  # Метка выполняющегося запроса, сек (не меньше таймаута запроса)
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Сколько объектов читаем из базы за раз при потоковой выдаче списков
+STREAM_CHUNK_SIZE = 2000
+
+COMPRESSION_MIN_SIZE = 512  # Ответы меньше этого размера не сжимаются, байт
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_ZSTD_LEVEL = 3
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'API для проекта интернет магазина',
     'DESCRIPTION': 'Документация OpenAPI, сгенерированная с помощью DRF-Spectacular',